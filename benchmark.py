@@ -0,0 +1,318 @@
+"""Reproducible benchmarks for the encrypted engine, written to JSON so runs can be compared.
+
+    python benchmark.py --rows 10000 --output results.json
+    python benchmark.py --rows 10000 --compare results.json  # exits with 1 on regressions
+
+Timings are the median of --repeat runs. Query benchmarks clear the query
+cache before every run, except the cache benchmark itself. Data and
+encryption randomness are seeded, so runs with the same arguments do the
+same work.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import numpy as np
+from src.homomorphic_encryption import AESCounterStream, HomomorphicEncryption
+from src.profiling import Profiler
+from src.zk_database import ZKDatabase
+
+SELECTIVITIES = (0.001, 0.01, 0.1, 0.5, 1.0)
+
+
+def _median_seconds(function, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _seeded_stream(seed):
+    return AESCounterStream(seed.to_bytes(32, 'little'))
+
+
+def _open_database(seed, **options):
+    db = ZKDatabase(cache_size=options.pop('cache_size', 128), profiler=Profiler(), **options)
+    db.he.random = _seeded_stream(seed)
+    return db
+
+
+def _user_rows(count, seed):
+    rng = random.Random(seed)
+    # k is a shuffled permutation of 0..count-1, so "k < s * count" keeps a fraction s of the rows
+    keys = list(range(count))
+    rng.shuffle(keys)
+    return [[i, keys[i], keys[i], i % 100, rng.randint(0, 1000)] for i in range(count)]
+
+
+def _load_users(db, rows, seed):
+    """A users table whose column k is indexed and whose copy s is not, to compare index and scan."""
+    db.create_table("users", ["user_id", "k", "s", "grp", "balance"])
+    db.drop_index("users", "s")
+    db.drop_index("users", "balance")
+    db.insert_many("users", _user_rows(rows, seed))
+
+
+def _decryptions_per_call(db, operation):
+    timer = db.profiler.snapshot()['timers'].get(operation, {})
+    return timer.get('per_call', {}).get('decryptions', 0)
+
+
+def bench_encryption(rows, repeat, seed):
+    he = HomomorphicEncryption(lwe_dimension=512)
+    he.random = _seeded_stream(seed)
+    plaintexts = list(range(rows))
+    batch = he.encrypt_many(plaintexts, compact=True)
+    singles = min(rows, 200)
+    ciphertexts = [he.encrypt(value, compact=True) for value in range(singles)]
+    results = {
+        'encrypt_many_per_second': rows / _median_seconds(lambda: he.encrypt_many(plaintexts, compact=True), repeat),
+        'decrypt_many_per_second': rows / _median_seconds(lambda: he.decrypt_many(batch), repeat),
+        'add_many_per_second': rows / _median_seconds(lambda: he.add_many(batch, batch), repeat),
+        'decrypt_sum_per_second': rows / _median_seconds(lambda: he.decrypt_sum(batch), repeat),
+        'encrypt_per_second': singles / _median_seconds(
+            lambda: [he.encrypt(value, compact=True) for value in range(singles)], repeat),
+        'decrypt_per_second': singles / _median_seconds(lambda: [he.decrypt(ct) for ct in ciphertexts], repeat),
+        'add_per_second': singles / _median_seconds(
+            lambda: [he.add(ct, ct) for ct in ciphertexts], repeat),
+    }
+    return results
+
+
+def bench_insert(rows, repeat, seed):
+    data = _user_rows(rows, seed)
+    singles = min(rows, 200)
+    databases = []
+
+    def fresh():
+        db = _open_database(seed)
+        db.create_table("users", ["user_id", "k", "s", "grp", "balance"])
+        databases.append(db)
+
+    def insert_rows():
+        for row in data[:singles]:
+            databases[-1].insert("users", row)
+
+    results = {
+        'insert_rows_per_second': singles / _median_seconds(insert_rows, repeat, setup=fresh),
+        'insert_many_rows_per_second': rows / _median_seconds(
+            lambda: databases[-1].insert_many("users", data), repeat, setup=fresh),
+    }
+    # Memory per row, everything included: ciphertexts, proofs, indexes, Merkle tree and row ids
+    fresh()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    databases[-1].insert_many("users", data)
+    results['bytes_per_row'] = (tracemalloc.get_traced_memory()[0] - before) / rows
+    tracemalloc.stop()
+    for db in databases:
+        db.close()
+    return results
+
+
+def bench_select(db, rows, repeat):
+    results = {}
+    for selectivity in SELECTIVITIES:
+        bound = max(1, int(rows * selectivity))
+        for access, column in (('index', 'k'), ('scan', 's')):
+            db.profiler.reset()
+            seconds = _median_seconds(lambda: db.select("users", (column, "<", bound), columns=["balance"]),
+                                      repeat, setup=db.cache.clear)
+            results[f'{access}_{selectivity}'] = {
+                'rows': bound,
+                'median_seconds': seconds,
+                'decryptions_per_query': _decryptions_per_call(db, 'select'),
+            }
+    db.profiler.reset()
+    condition = ("AND", ("grp", "IN", [1, 2, 3]), ("OR", ("s", "<", rows // 2), ("NOT", ("balance", ">", 500))))
+    results['compound'] = {
+        'median_seconds': _median_seconds(lambda: db.select("users", condition), repeat, setup=db.cache.clear),
+        'decryptions_per_query': _decryptions_per_call(db, 'select'),
+    }
+    return results
+
+
+def bench_join(db, rows, repeat, seed):
+    rng = random.Random(seed)
+    db.create_table("orders", ["order_id", "user_id", "amount"])
+    db.insert_many("orders", [[i, rng.randrange(rows), rng.randint(1, 500)] for i in range(rows)])
+    results = {}
+    for name, arguments in (
+            ('inner', {}),
+            ('left', {'join_type': 'left'}),
+            ('inner_pushdown', {'condition': ("users.k", "<", max(1, rows // 100))}),
+    ):
+        db.profiler.reset()
+        seconds = _median_seconds(lambda: db.join("users", "orders", "user_id", "user_id",
+                                                  columns=["balance", "amount"], **arguments),
+                                  repeat, setup=db.cache.clear)
+        results[name] = {'median_seconds': seconds, 'decryptions_per_query': _decryptions_per_call(db, 'join')}
+    return results
+
+
+def bench_aggregate(db, rows, repeat):
+    results = {}
+    for name, arguments in (
+            ('sum', ("balance", "SUM")),
+            ('avg_filtered', ("balance", "AVG", ("k", "<", rows // 10))),
+            ('count_grouped', ("balance", "COUNT", None, "grp")),
+            ('sum_grouped', ("balance", "SUM", None, "grp")),
+    ):
+        db.profiler.reset()
+        seconds = _median_seconds(lambda: db.aggregate("users", *arguments), repeat, setup=db.cache.clear)
+        results[name] = {'median_seconds': seconds, 'decryptions_per_query': _decryptions_per_call(db, 'aggregate')}
+    return results
+
+
+def bench_transactions(db, rows, repeat, iterations=50):
+    """Per-update cost of small updates on their own, in committed and in rolled back transactions."""
+    condition = ("k", "<", max(1, rows // 100))
+
+    def updates(finish=None):
+        for _ in range(iterations):
+            if finish is not None:
+                db.begin_transaction()
+            db.update("users", condition, {"balance": 1})
+            if finish is not None:
+                finish()
+
+    update = _median_seconds(updates, repeat) / iterations
+    committed = _median_seconds(lambda: updates(db.commit), repeat) / iterations
+    rolled_back = _median_seconds(lambda: updates(db.rollback), repeat) / iterations
+    return {
+        'update_seconds': update,
+        'update_in_transaction_seconds': committed,
+        'update_rolled_back_seconds': rolled_back,
+        'transaction_overhead_seconds': committed - update,
+    }
+
+
+def bench_cache(db, rows, queries, seed):
+    """A skewed workload of point selects (Zipf-like), run against the database's LRU cache."""
+    rng = random.Random(seed)
+    keys = list(range(min(rows, 1000)))
+    weights = [1 / (rank + 1) for rank in range(len(keys))]
+    workload = rng.choices(keys, weights=weights, k=queries)
+    db.cache.clear()
+    db.profiler.reset()
+    stats_before = db.cache_stats()
+    for key in workload:
+        db.select("users", ("k", "=", key))
+    stats = db.cache_stats()
+    hits, misses = stats['hits'] - stats_before['hits'], stats['misses'] - stats_before['misses']
+    select = db.profiler.snapshot()['timers']['select']
+    return {
+        'queries': queries,
+        'cache_size': db.cache.max_entries,
+        'hit_rate': hits / max(hits + misses, 1),
+        'mean_query_seconds': select['mean_seconds'],
+        'decryptions_per_query': select['per_call'].get('decryptions', 0),
+    }
+
+
+def bench_rotation(db):
+    """Re-encrypt every column under a fresh key, synchronously; run last since it changes every ciphertext."""
+    start = time.perf_counter()
+    rotation = db.rotate_key(background=False)
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'rows_reencrypted': rotation.rows_reencrypted,
+            'reencrypted_per_second': rotation.rows_reencrypted / seconds}
+
+
+def run(rows, repeat, seed, workers, cache_queries):
+    random.seed(seed)
+    results = {
+        'encryption': bench_encryption(rows, repeat, seed),
+        'insert': bench_insert(rows, repeat, seed),
+    }
+    db = _open_database(seed, workers=workers)
+    _load_users(db, rows, seed)
+    results['select'] = bench_select(db, rows, repeat)
+    results['join'] = bench_join(db, rows, repeat, seed)
+    results['aggregate'] = bench_aggregate(db, rows, repeat)
+    results['transactions'] = bench_transactions(db, rows, repeat)
+    results['cache'] = bench_cache(db, rows, cache_queries, seed)
+    results['rotation'] = bench_rotation(db)
+    db.close()
+    return {
+        'meta': {
+            'rows': rows,
+            'repeat': repeat,
+            'seed': seed,
+            'workers': workers,
+            'cache_queries': cache_queries,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def _metrics(results, prefix=''):
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _metrics(value, name + '.')
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def compare(report, baseline, threshold):
+    """Print how each timing and throughput moved against a baseline; returns the regressed metrics."""
+    old = dict(_metrics(baseline['results']))
+    regressions = []
+    for name, value in _metrics(report['results']):
+        previous = old.get(name)
+        # Only timings (lower is better) and throughputs (higher is better) are judged
+        if not previous or previous < 0 or not (name.endswith('seconds') or name.endswith('per_second')):
+            continue
+        change = value / previous - 1
+        worse = change < -threshold if name.endswith('per_second') else change > threshold
+        print(f"{name:60} {previous:14.6g} -> {value:14.6g} {change:+8.1%}{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache-queries', type=int, default=2000)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="a previous results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative slowdown reported as a regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    report = run(args.rows, args.repeat, args.seed, args.workers, args.cache_queries)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
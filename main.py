@@ -1,6 +1,10 @@
+import logging
 from src.zk_database import ZKDatabase
 
 if __name__ == "__main__":
+    # Show the database's progress messages on the console
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     # Initialize the database with admin role
     db = ZKDatabase(user_role='admin')
 
@@ -26,6 +30,11 @@ if __name__ == "__main__":
     print("\nPerforming SELECT Query again (should use cache):")
     result2 = db.select("users", condition=("balance", ">=", 100))
 
+    # Homomorphic aggregation (one decryption per aggregate)
+    print("\nAggregating balances:")
+    print(f"SUM(balance) = {db.aggregate_sum('users', 'balance')}")
+    print(f"AVG(balance) WHERE age >= 30 = {db.aggregate_avg('users', 'balance', condition=('age', '>=', 30))}")
+
     # Demonstrate transaction support
     print("\nStarting a transaction to update balance:")
     db.begin_transaction()
@@ -58,4 +67,5 @@ if __name__ == "__main__":
 
     # View Logs
     print("\nViewing logs of database operations:")
-    db.view_logs()
+    for log in db.view_logs():
+        print(log)
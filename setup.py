@@ -8,6 +8,7 @@ setup(
     install_requires=[
         'lightphe',
         'pycryptodome',
+        'numpy',
         # Add other dependencies here
     ],
     entry_points={
@@ -0,0 +1,194 @@
+"""Audit trail for ZKDatabase built on the standard logging module.
+
+Each operation becomes one log record on a per-database audit logger,
+carrying a small dict entry. Two handlers are attached by default:
+
+- RingBufferHandler keeps the most recent entries in memory for view_logs.
+- A QueueHandler hands records to a background QueueListener, which writes
+  them through RotatingJSONLSink: batched appends to a JSONL file that is
+  rotated by size. A batch is written once full or once the queue is empty.
+
+The calling thread only formats the entry and enqueues it; file I/O happens
+on the listener thread. Further handlers can be attached to ``logger`` like
+any other logging handler.
+"""
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from src.query_planner import And, Compare, In, Not, parse_condition
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the audit entries of the most recent records in a bounded deque."""
+
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self.entries = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.entries.append(record.audit)
+
+
+class RotatingJSONLSink(logging.Handler):
+    """Append-only JSONL audit file, written in batches and rotated by size.
+
+    When the file would grow past max_bytes it is renamed to ``<path>.1``
+    (older files shift to ``.2`` and so on, keeping backup_count of them)
+    and a new file is started. Existing lines are never rewritten.
+    """
+
+    def __init__(self, path, max_bytes=64 << 20, backup_count=5, batch_size=256):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.pending = []
+        self.stream = None  # Set first, so that close() works if the open below fails
+        self.stream = open(path, 'a', encoding='utf-8')
+
+    def emit(self, record):
+        self.pending.append(json.dumps(record.audit, default=str) + '\n')
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self.pending or self.stream is None:
+                return
+            data = ''.join(self.pending)
+            self.pending = []
+            if self.max_bytes and self.stream.tell() + len(data) > self.max_bytes and self.stream.tell() > 0:
+                self._rotate()
+            self.stream.write(data)
+            self.stream.flush()
+        finally:
+            self.release()
+
+    def _rotate(self):
+        self.stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.stream = open(self.path, 'a', encoding='utf-8')
+
+    def tail(self, count):
+        """Return up to the last count entries written to the current file."""
+        self.flush()
+        with open(self.path, encoding='utf-8') as f:
+            return [json.loads(line) for line in collections.deque(f, maxlen=count)]
+
+    def close(self):
+        self.flush()
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+class _FlushingQueueListener(logging.handlers.QueueListener):
+    """Flushes its handlers whenever the queue runs dry, so batched entries never wait for the next burst."""
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+
+class AuditLog:
+    """Records database operations at a configurable level.
+
+    Entries below `level` are dropped before any work is done, so
+    level=logging.WARNING turns auditing off. With a path, entries are also
+    appended asynchronously to a rotating JSONL file, and the ring buffer
+    is primed from that file so view_logs survives restarts.
+    """
+
+    def __init__(self, path=None, level=logging.INFO, buffer_size=1000, max_bytes=64 << 20, backup_count=5,
+                 batch_size=256, key=None):
+        self.key = os.urandom(16) if key is None else key  # HMAC key of every digest in the trail
+        # A private logger, not registered with logging.getLogger, so that each
+        # database keeps its own handlers and nothing leaks once it is closed
+        self.logger = logging.Logger('zerotrustsql.audit', level)
+        self.ring = RingBufferHandler(buffer_size)
+        self.logger.addHandler(self.ring)
+        self.sink = None
+        self.listener = None
+        if path is not None:
+            self.sink = RotatingJSONLSink(path, max_bytes, backup_count, batch_size)
+            self.ring.entries.extend(self.sink.tail(buffer_size))
+            records = queue.SimpleQueue()
+            self.logger.addHandler(logging.handlers.QueueHandler(records))
+            self.listener = _FlushingQueueListener(records, self.sink)
+            self.listener.start()
+
+    @property
+    def entries(self):
+        return self.ring.entries
+
+    def record(self, operation, table_name, user_role, data=None, condition=None, rows=None, level=logging.INFO):
+        """Audit one operation.
+
+        Data and the values a condition compares against are stored as
+        HMAC-SHA256 digests under `key`, never in the clear; the columns and
+        operators of the condition are kept.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        entry = {
+            'time': time.time(),
+            'operation': operation,
+            'table': table_name,
+            'data': self._digest(data) if data else None,
+            'condition': self._redact(parse_condition(condition)) if condition else None,
+            'user_role': user_role,
+        }
+        if rows is not None:
+            entry['rows'] = rows
+        self.logger.log(level, '%s on %s', operation, table_name, extra={'audit': entry})
+
+    def _digest(self, value):
+        return hmac.new(self.key, str(value).encode(), hashlib.sha256).hexdigest()
+
+    def _redact(self, predicate):
+        """A condition as nested lists, with every value replaced by its digest."""
+        if isinstance(predicate, Compare):
+            return [predicate.column, predicate.operator, self._digest(predicate.value)]
+        if isinstance(predicate, In):
+            return [predicate.column, 'IN', [self._digest(value) for value in predicate.values]]
+        if isinstance(predicate, Not):
+            return ['NOT', self._redact(predicate.term)]
+        return ['AND' if isinstance(predicate, And) else 'OR', *(self._redact(term) for term in predicate.terms)]
+
+    def flush(self):
+        """Block until every queued entry has been written to the sink."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.sink.flush()
+            self.listener.start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
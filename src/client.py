@@ -0,0 +1,150 @@
+"""Async client and connection pool for ZKServer (see src/server.py for the protocol)."""
+import asyncio
+import itertools
+from src.server import encode_frame, read_frame
+
+_ERRORS = {'PermissionError': PermissionError, 'ValueError': ValueError, 'KeyError': KeyError}
+
+
+class _Operations:
+    """Database operations on top of an async request(op, **args) method."""
+
+    async def create_table(self, table_name, columns):
+        return await self.request('create_table', table_name=table_name, columns=columns)
+
+    async def create_index(self, table_name, column_name):
+        return await self.request('create_index', table_name=table_name, column_name=column_name)
+
+    async def insert(self, table_name, values):
+        return await self.request('insert', table_name=table_name, values=values)
+
+    async def insert_many(self, table_name, rows, batch_size=10000):
+        return await self.request('insert_many', table_name=table_name, rows=rows, batch_size=batch_size)
+
+    async def select(self, table_name, condition=None, columns=None):
+        return await self.request('select', table_name=table_name, condition=condition, columns=columns)
+
+    async def update(self, table_name, condition, update_values, columns=None):
+        return await self.request('update', table_name=table_name, condition=condition,
+                                  update_values=update_values, columns=columns)
+
+    async def delete(self, table_name, condition):
+        return await self.request('delete', table_name=table_name, condition=condition)
+
+    async def aggregate(self, table_name, column_name, function='SUM', condition=None, group_by=None):
+        result = await self.request('aggregate', table_name=table_name, column_name=column_name,
+                                    function=function, condition=condition, group_by=group_by)
+        return dict(result['groups']) if isinstance(result, dict) else result
+
+    async def join(self, table1, table2, table1_column, table2_column, join_type="inner", columns=None,
+                   condition=None):
+        return await self.request('join', table1=table1, table2=table2, table1_column=table1_column,
+                                  table2_column=table2_column, join_type=join_type, columns=columns,
+                                  condition=condition)
+
+    async def explain(self, table_name, condition):
+        return await self.request('explain', table_name=table_name, condition=condition)
+
+
+class AsyncClient(_Operations):
+    """One connection to a ZKServer, bound to a role; requests may be pipelined freely.
+
+    Rows come back as lists where the in-process API returns tuples.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}  # request id -> future of its response
+        self.receiver = None
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=None, role='read_only', token=None, path=None):
+        """Open a connection (TCP, or the Unix socket at path) and bind it to a role."""
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer)
+        client.receiver = asyncio.create_task(client._receive())
+        await client.request('hello', role=role, token=token, _raw=True)
+        return client
+
+    @property
+    def inflight(self):
+        return len(self.waiting)
+
+    async def request(self, op, _raw=False, **args):
+        """Send one request and wait for its response; other requests may be sent meanwhile."""
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = future
+        message = {'id': request_id, 'op': op, **args} if _raw else {'id': request_id, 'op': op, 'args': args}
+        self.writer.write(encode_frame(message))
+        await self.writer.drain()  # Waits while the server is not reading
+        response = await future
+        if not response['ok']:
+            error = response['error']
+            raise _ERRORS.get(error['type'], RuntimeError)(error['message'])
+        return response['result']
+
+    async def _receive(self):
+        try:
+            while True:
+                response = await read_frame(self.reader)
+                if response is None:
+                    break
+                future = self.waiting.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to the server was closed."))
+            self.waiting.clear()
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        if self.receiver is not None:
+            await self.receiver
+
+
+class ConnectionPool(_Operations):
+    """Up to `size` connections sharing one role; each request goes to the least busy one.
+
+    Connections are opened on demand, and since every connection pipelines,
+    many coroutines can share the pool without waiting for a free slot.
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, role='read_only', token=None, path=None, size=4):
+        self.connect_args = {'host': host, 'port': port, 'role': role, 'token': token, 'path': path}
+        self.size = size
+        self.clients = []
+        self.connecting = asyncio.Lock()
+
+    async def _client(self):
+        idle = [client for client in self.clients if client.inflight == 0]
+        if idle or len(self.clients) >= self.size:
+            return idle[0] if idle else min(self.clients, key=lambda client: client.inflight)
+        async with self.connecting:
+            if len(self.clients) < self.size:
+                self.clients.append(await AsyncClient.connect(**self.connect_args))
+            return self.clients[-1]
+
+    async def request(self, op, **args):
+        return await (await self._client()).request(op, **args)
+
+    async def close(self):
+        clients, self.clients = self.clients, []
+        for client in clients:
+            await client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
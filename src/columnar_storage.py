@@ -0,0 +1,271 @@
+import threading
+import numpy as np
+
+_load_lock = threading.Lock()  # Lets only one thread parse a column's bodies, so no load overwrites a later write
+
+
+class EncryptedColumn:
+    """A column of ciphertexts stored as a contiguous seed buffer plus a body array.
+
+    Fresh ciphertexts are kept in compact (seed, body) form. Ciphertexts whose
+    mask is not the expansion of a seed (e.g. results of homomorphic addition)
+    fall back to storing their full mask in ``expanded``, keyed by row position.
+    Every ciphertext of a column is under the key of the column's ``epoch``.
+    """
+    body_loader = None  # Parses the bodies on first access, for columns opened from disk
+
+    def __init__(self, lwe_dimension, expand_masks, capacity=16, epoch=0):
+        self.lwe_dimension = lwe_dimension
+        self.expand_masks = expand_masks
+        self.epoch = epoch
+        self.seeds = np.zeros(capacity, dtype=np.uint64)
+        self.bodies = np.empty(capacity, dtype=object)
+        self.expanded = {}
+        self.size = 0
+
+    @classmethod
+    def from_arrays(cls, lwe_dimension, expand_masks, seeds, bodies, expanded=None, epoch=0):
+        """Wrap existing seed and body arrays (e.g. memory-mapped from disk) without copying the seeds.
+
+        `bodies` may also be a callable returning the body array, which is
+        then only called the first time the bodies are used.
+        """
+        column = cls(lwe_dimension, expand_masks, capacity=0, epoch=epoch)
+        column.seeds = seeds
+        if callable(bodies):
+            column.body_loader = bodies
+        else:
+            column.bodies = bodies
+        column.expanded = dict(expanded or {})
+        column.size = len(seeds)
+        return column
+
+    @property
+    def bodies(self):
+        if self.body_loader is not None:
+            with _load_lock:
+                if self.body_loader is not None:
+                    self._bodies, self.body_loader = self.body_loader(), None
+        return self._bodies
+
+    @bodies.setter
+    def bodies(self, bodies):
+        self._bodies, self.body_loader = bodies, None
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, capacity):
+        """Grow the buffers geometrically so appends stay amortised O(1)."""
+        if capacity <= self.seeds.shape[0]:
+            return
+        new_capacity = max(capacity, 2 * self.seeds.shape[0])
+        seeds = np.zeros(new_capacity, dtype=np.uint64)
+        bodies = np.empty(new_capacity, dtype=object)
+        seeds[:self.size] = self.seeds[:self.size]
+        bodies[:self.size] = self.bodies[:self.size]
+        self.seeds, self.bodies = seeds, bodies
+
+    def _store(self, positions, batch):
+        masks_or_seeds, bodies = batch
+        self.bodies[positions] = bodies
+        if masks_or_seeds.ndim == 1:
+            self.seeds[positions] = masks_or_seeds
+            for position in positions.tolist():
+                self.expanded.pop(position, None)
+        else:
+            self.seeds[positions] = 0
+            for position, mask in zip(positions.tolist(), masks_or_seeds):
+                self.expanded[position] = mask.copy()
+
+    def append(self, batch):
+        """Append a compact (seeds, bodies) or expanded (masks, bodies) batch."""
+        count = len(batch[1])
+        self._reserve(self.size + count)
+        self._store(np.arange(self.size, self.size + count), batch)
+        self.size += count
+
+    def batch(self, positions=None):
+        """Return the batch for the given row positions (all rows by default).
+
+        The batch is compact unless one of the selected rows holds an expanded mask.
+        """
+        if positions is None:
+            positions = np.arange(self.size)
+        positions = np.asarray(positions, dtype=np.intp)
+        seeds, bodies = self.seeds[positions], self.bodies[positions]
+        if not self.expanded:
+            return seeds, bodies
+        fallback = [(offset, self.expanded[position]) for offset, position in enumerate(positions.tolist())
+                    if position in self.expanded]
+        if not fallback:
+            return seeds, bodies
+        masks = self.expand_masks(seeds).astype(np.uint64)
+        for offset, mask in fallback:
+            masks[offset] = mask
+        return masks, bodies
+
+    def set(self, positions, batch):
+        """Overwrite the ciphertexts at the given row positions."""
+        self._store(np.asarray(positions, dtype=np.intp), batch)
+
+    def keep(self, keep_mask):
+        """Compact the column, retaining only rows where keep_mask is True."""
+        if self.expanded:
+            new_positions = np.cumsum(keep_mask) - 1
+            self.expanded = {int(new_positions[position]): mask for position, mask in self.expanded.items()
+                             if keep_mask[position]}
+        seeds = self.seeds[:self.size][keep_mask]
+        bodies = self.bodies[:self.size][keep_mask]
+        self.size = len(bodies)
+        self.seeds[:self.size] = seeds
+        self.bodies[:self.size] = bodies
+        self.bodies[self.size:] = None
+
+    def permute(self, order):
+        """Reorder the rows so that new position i holds old position order[i]."""
+        self.seeds[:self.size] = self.seeds[:self.size][order]
+        self.bodies[:self.size] = self.bodies[:self.size][order]
+        if self.expanded:
+            new_positions = np.empty_like(order)
+            new_positions[order] = np.arange(len(order))
+            self.expanded = {int(new_positions[position]): mask for position, mask in self.expanded.items()}
+
+    def copy(self):
+        column = EncryptedColumn(self.lwe_dimension, self.expand_masks, capacity=max(self.size, 1), epoch=self.epoch)
+        column.seeds[:self.size] = self.seeds[:self.size]
+        column.bodies[:self.size] = self.bodies[:self.size]
+        column.expanded = {position: mask.copy() for position, mask in self.expanded.items()}
+        column.size = self.size
+        return column
+
+
+class ColumnarTable:
+    """Encrypted table stored column by column, with row proofs kept in a separate array.
+
+    Every row also gets a stable, monotonically increasing row id. Deletes keep
+    the remaining rows in order, so ``row_ids`` stays sorted and ids can be
+    mapped back to positions with a binary search.
+    """
+
+    def __init__(self, columns, lwe_dimension, expand_masks, epoch=0):
+        self.columns = list(columns)
+        self.lwe_dimension = lwe_dimension
+        self.expand_masks = expand_masks
+        self.data = [EncryptedColumn(lwe_dimension, expand_masks, epoch=epoch) for _ in self.columns]
+        self.proofs = []
+        self.row_ids = np.zeros(16, dtype=np.int64)
+        self.next_row_id = 0
+
+    @classmethod
+    def from_arrays(cls, columns, lwe_dimension, expand_masks, data, proofs, row_ids, next_row_id):
+        """Assemble a table from prebuilt EncryptedColumns and row metadata."""
+        table = cls(columns, lwe_dimension, expand_masks)
+        table.data = list(data)
+        table.proofs = list(proofs)
+        table.row_ids = row_ids
+        table.next_row_id = next_row_id
+        return table
+
+    def __len__(self):
+        return len(self.proofs)
+
+    def column_index(self, column_name):
+        return self.columns.index(column_name)
+
+    def append_rows(self, column_batches, proofs, row_ids=None):
+        """Append rows given one batch per column and one proof per row.
+
+        New rows get fresh row ids unless row_ids is given (e.g. when replaying
+        a write-ahead log); explicit ids must be larger than every live id.
+        """
+        if len(column_batches) != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} columns, got {len(column_batches)}.")
+        for column, batch in zip(self.data, column_batches):
+            column.append(batch)
+        start, count = len(self.proofs), len(proofs)
+        self._reserve_row_ids(start + count)
+        if row_ids is None:
+            new_ids = np.arange(self.next_row_id, self.next_row_id + count, dtype=np.int64)
+        else:
+            new_ids = np.asarray(row_ids, dtype=np.int64)
+        self.row_ids[start:start + count] = new_ids
+        if count:
+            self.next_row_id = max(self.next_row_id, int(new_ids[-1]) + 1)
+        self.proofs.extend(proofs)
+        return new_ids.tolist()
+
+    def restore_rows(self, row_ids, column_batches, proofs):
+        """Re-insert previously deleted rows at the positions their row ids sort to."""
+        for column, batch in zip(self.data, column_batches):
+            column.append(batch)
+        all_row_ids = np.concatenate([self.live_row_ids(), np.asarray(row_ids, dtype=np.int64)])
+        order = np.argsort(all_row_ids, kind='stable')
+        for column in self.data:
+            column.permute(order)
+        all_proofs = self.proofs + list(proofs)
+        self._reserve_row_ids(len(all_proofs))
+        self.row_ids[:len(all_proofs)] = all_row_ids[order]
+        self.proofs = [all_proofs[i] for i in order.tolist()]
+
+    def _reserve_row_ids(self, capacity):
+        if capacity > self.row_ids.shape[0]:
+            row_ids = np.zeros(max(capacity, 2 * self.row_ids.shape[0]), dtype=np.int64)
+            row_ids[:len(self.proofs)] = self.live_row_ids()
+            self.row_ids = row_ids
+
+    def live_row_ids(self):
+        return self.row_ids[:len(self.proofs)]
+
+    def positions(self, row_ids):
+        """Map row ids of live rows to their current positions; raises KeyError for any other id."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        positions, found = self._find(row_ids)
+        if not found.all():
+            raise KeyError(f"Row ids {row_ids[~found].tolist()} are not live.")
+        return positions
+
+    def live_positions(self, row_ids):
+        """Map row ids to their current positions, skipping ids of rows no longer live."""
+        positions, found = self._find(np.asarray(row_ids, dtype=np.int64))
+        return positions[found]
+
+    def _find(self, row_ids):
+        live_row_ids = self.live_row_ids()
+        positions = np.searchsorted(live_row_ids, row_ids)
+        found = positions < len(live_row_ids)
+        found[found] = live_row_ids[positions[found]] == row_ids[found]
+        return positions, found
+
+    def column_batch(self, column_index, positions=None):
+        return self.data[column_index].batch(positions)
+
+    def row_batch(self, position):
+        """Return every cell of one row as a single expanded (masks, bodies) batch."""
+        cells = [column.batch([position]) for column in self.data]
+        masks = np.concatenate([
+            self.expand_masks(batch[0]) if batch[0].ndim == 1 else batch[0] for batch in cells
+        ]).astype(np.uint64)
+        bodies = np.concatenate([batch[1] for batch in cells])
+        return masks, bodies
+
+    def update_column(self, column_index, positions, batch):
+        self.data[column_index].set(positions, batch)
+
+    def delete_rows(self, positions):
+        """Remove the rows at the given positions, preserving the order of the rest."""
+        keep_mask = np.ones(len(self), dtype=bool)
+        keep_mask[np.asarray(positions, dtype=np.intp)] = False
+        for column in self.data:
+            column.keep(keep_mask)
+        row_ids = self.live_row_ids()[keep_mask]
+        self.row_ids[:len(row_ids)] = row_ids
+        self.proofs = [proof for proof, keep in zip(self.proofs, keep_mask) if keep]
+
+    def copy(self):
+        table = ColumnarTable(self.columns, self.lwe_dimension, self.expand_masks)
+        table.data = [column.copy() for column in self.data]
+        table.proofs = list(self.proofs)
+        table.row_ids = self.row_ids.copy()
+        table.next_row_id = self.next_row_id
+        return table
@@ -1,27 +1,314 @@
-import random
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from Crypto.Cipher import AES
+from src.profiling import profiled
+
+# Secret keys are split into 16-bit limbs, one column per limb. Masks are
+# split the same way, so every partial inner product stays below 2**53 and
+# can be computed exactly as a float64 matrix product.
+_LIMB_BITS = 16
+_LIMB_MASK = (1 << _LIMB_BITS) - 1
+
+# Masks of compact ciphertexts are AES-128 under this fixed, public key,
+# applied to the blocks seed || 0, seed || 1, ...; each block gives four
+# 32-bit mask words. Changing it invalidates every stored ciphertext.
+MASK_EXPANSION = 'aes128-ecb-v1'
+_EXPANSION_KEY = hashlib.sha256(b'ZeroTrustSQL mask expansion v1').digest()[:16]
+_WORDS_PER_BLOCK = 4
+
+
+def _aes_blocks(cipher, high, low):
+    """Encrypt the 16-byte blocks high[i] || low[j] for every i and j, as a (len(high), 4 * len(low)) uint32 array."""
+    blocks = np.empty((len(high), len(low), 2), dtype=np.uint64)
+    blocks[:, :, 0] = np.asarray(high, dtype=np.uint64)[:, None]
+    blocks[:, :, 1] = low
+    if blocks.size:
+        buffer = memoryview(blocks).cast('B')
+        cipher.encrypt(buffer, output=buffer)  # In place, one call for the whole buffer
+    return blocks.view(np.uint32).reshape(len(high), _WORDS_PER_BLOCK * len(low))
+
+
+class SecretKey:
+    """An LWE secret key, kept as an array together with its precomputed limb matrix.
+
+    `epoch` numbers the keys of one database: rotating to a new key moves
+    every column to the next epoch.
+    """
+
+    def __init__(self, values, epoch=0):
+        self.values = np.asarray(values, dtype=np.uint64)
+        if self.values.ndim != 1 or (self.values >> np.uint64(32)).any():
+            raise ValueError("A secret key is a sequence of 32-bit integers.")
+        self.epoch = epoch
+        self.limbs = np.stack([self.values & _LIMB_MASK, self.values >> _LIMB_BITS], axis=1).astype(np.float64)
+
+    @classmethod
+    def generate(cls, lwe_dimension, epoch=0):
+        """Draw a fresh key from the operating system's CSPRNG."""
+        return cls(np.frombuffer(os.urandom(4 * lwe_dimension), dtype='<u4'), epoch)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __reduce__(self):
+        # Ship only the key words to worker processes; the limbs are cheap to rebuild
+        return SecretKey, (self.values, self.epoch)
+
+    def fingerprint(self):
+        """A digest identifying the key without revealing it."""
+        return hashlib.sha256(json.dumps(list(self)).encode()).hexdigest()
+
+
+class AESCounterStream:
+    """Cryptographically secure random numbers: AES-256 in counter mode, produced a whole buffer at a time.
+
+    Keyed from os.urandom unless a key is given (e.g. for reproducible
+    benchmarks). Thread-safe.
+    """
+
+    def __init__(self, key=None):
+        self.cipher = AES.new(key if key is not None else os.urandom(32), AES.MODE_ECB)
+        self.nonce = np.frombuffer(os.urandom(8) if key is None else bytes(8), dtype=np.uint64)
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def words(self, count):
+        """Return `count` uniformly random uint32 values."""
+        blocks = -(-count // _WORDS_PER_BLOCK)
+        with self.lock:
+            start, self.counter = self.counter, self.counter + blocks
+        counters = np.arange(start, start + blocks, dtype=np.uint64)
+        return _aes_blocks(self.cipher, self.nonce, counters).reshape(-1)[:count]
+
+    def uint32(self, shape):
+        return self.words(int(np.prod(shape))).reshape(shape)
+
+    def uint64(self, count):
+        return self.words(2 * count).view(np.uint64)
+
+    def below(self, bound, count):
+        """Return `count` uniform integers in [0, bound), as an object array of Python ints."""
+        if bound & (bound - 1) == 0:
+            values = self.uint64(count) & np.uint64(bound - 1)
+        else:
+            values = self.uint64(count) % np.uint64(bound)  # Bias below bound / 2**64
+        return values.astype(object)
+
+
+def _key_ring(key, lwe_dimension):
+    """Normalise a SecretKey, a sequence of key words or a sequence of SecretKeys to {epoch: SecretKey}."""
+    if key is None:
+        return {0: SecretKey.generate(lwe_dimension)}
+    if isinstance(key, SecretKey):
+        return {key.epoch: key}
+    key = list(key)
+    if key and all(isinstance(item, SecretKey) for item in key):
+        return {item.epoch: item for item in key}
+    return {0: SecretKey(key)}
+
+
+def _batch_size(batch):
+    return len(batch[1])
 
-# Define a secret key globally (used by HomomorphicEncryption)
-secret_key = [random.randint(0, (1 << 32) - 1) for _ in range(512)]
 
 class HomomorphicEncryption:
-    def __init__(self, lwe_dimension):
+    """LWE encryption under a per-instance key ring.
+
+    New ciphertexts use the current key (the highest epoch); decryption
+    takes the epoch a ciphertext was encrypted under and defaults to the
+    current one. `key` may be a SecretKey, a list of 32-bit key words, or a
+    list of SecretKeys of different epochs; a fresh key is generated when
+    it is omitted.
+    """
+
+    def __init__(self, lwe_dimension, noise_budget_bits=20, profiler=None, key=None):
         self.lwe_dimension = lwe_dimension
+        self.profiler = profiler  # Optional src.profiling.Profiler timing every call below
+        self.keys = _key_ring(key, lwe_dimension)
+        for secret_key in self.keys.values():
+            if len(secret_key) < lwe_dimension:
+                raise ValueError(f"A key of {len(secret_key)} words is too short for dimension {lwe_dimension}.")
+        self.random = AESCounterStream()
+        # Noise is drawn below delta / 2**(noise_budget_bits + 1), so up to
+        # 2**noise_budget_bits ciphertexts can be summed before the accumulated
+        # noise could reach delta / 2 and corrupt the rounded plaintext.
+        delta = (1 << (32 - 1))
+        self.noise_bound = delta >> (noise_budget_bits + 1)
+        self.addition_budget = 1 << noise_budget_bits
+
+    # ----- Keys -----
+    @property
+    def key(self):
+        """The current key, used for new ciphertexts."""
+        return self.keys[max(self.keys)]
+
+    def add_key(self, key=None):
+        """Make a key (a fresh one by default) current, under the next epoch; returns it."""
+        epoch = max(self.keys) + 1
+        key = SecretKey.generate(self.lwe_dimension, epoch) if key is None else SecretKey(key.values, epoch)
+        self.keys[epoch] = key
+        return key
+
+    def drop_key(self, epoch):
+        """Forget the key of an epoch that no ciphertext uses any more."""
+        if epoch == max(self.keys):
+            raise ValueError("The current key cannot be dropped.")
+        self.keys.pop(epoch, None)
 
-    def encrypt(self, plaintext):
-        delta = (1 << (32 - 1))  # Scaling factor
-        encoded_plaintext = delta * plaintext
-        noise = random.randint(0, delta >> 1)
-        mask = [random.randint(0, (1 << 32) - 1) for _ in range(self.lwe_dimension)]
-        body = sum([mask[i] * secret_key[i] for i in range(self.lwe_dimension)]) + encoded_plaintext + noise
+    def _key(self, epoch):
+        if epoch is None:
+            return self.key
+        try:
+            return self.keys[epoch]
+        except KeyError:
+            raise KeyError(f"No key for epoch {epoch}.") from None
+
+    # ----- Single Ciphertexts -----
+    @profiled('he.encrypt', items=lambda _: 1)
+    def encrypt(self, plaintext, compact=False, epoch=None):
+        masks_or_seeds, bodies = self._encrypt_batch([plaintext], compact, epoch)
+        if compact:
+            return (int(masks_or_seeds[0]), bodies[0])
+        return (masks_or_seeds[0].tolist(), bodies[0])
+
+    def expand(self, ciphertext):
+        """Return the expanded (mask, body) form of a compact (seed, body) ciphertext."""
+        mask, body = ciphertext
+        if isinstance(mask, (int, np.integer)):
+            mask = self.expand_masks([mask])[0].tolist()
         return (mask, body)
 
+    @profiled('he.add', items=lambda _: 1)
     def add(self, ct1, ct2):
+        # A sum no longer corresponds to any single seed, so the result is always expanded.
+        ct1, ct2 = self.expand(ct1), self.expand(ct2)
         mask_sum = [(ct1[0][i] + ct2[0][i]) for i in range(self.lwe_dimension)]
         body_sum = ct1[1] + ct2[1]
         return (mask_sum, body_sum)
 
-    def decrypt(self, ciphertext):
+    @profiled('he.decrypt', items=lambda _: 1)
+    def decrypt(self, ciphertext, epoch=None):
+        return self._decrypt_batch([ciphertext], epoch)[0]
+
+    # ----- Batch API -----
+    @profiled('he.encrypt_many', items=_batch_size)
+    def encrypt_many(self, plaintexts, compact=False, epoch=None):
+        """Encrypt a sequence of plaintexts into a batch of (masks, bodies).
+
+        With compact=True the batch is (seeds, bodies) instead: each mask is
+        replaced by the 64-bit seed it is expanded from. Seeds, masks and
+        noise all come from one AES-CTR buffer per call.
+        """
+        return self._encrypt_batch(plaintexts, compact, epoch)
+
+    def _encrypt_batch(self, plaintexts, compact, epoch):
         delta = (1 << (32 - 1))
-        mask, body = ciphertext
-        recovered_plaintext = body - sum([mask[i] * secret_key[i] for i in range(self.lwe_dimension)])
-        return round(recovered_plaintext / delta)
+        count = len(plaintexts)
+        if compact:
+            seeds = self.random.uint64(count)
+            masks = self.expand_masks(seeds)
+        else:
+            masks = self.random.uint32((count, self.lwe_dimension))
+        noise = self.random.below(self.noise_bound, count)
+        encoded = np.array(plaintexts, dtype=object).reshape(count) * delta
+        bodies = self._inner_products(masks, self._key(epoch)) + encoded + noise
+        return (seeds if compact else masks, bodies)
+
+    @profiled('he.expand_masks', items=len)
+    def expand_masks(self, seeds):
+        """Regenerate the (N, n) uint32 masks of compact ciphertexts from their seeds."""
+        seeds = np.asarray(seeds, dtype=np.uint64).reshape(-1)
+        counters = np.arange(-(-self.lwe_dimension // _WORDS_PER_BLOCK), dtype=np.uint64)
+        masks = _aes_blocks(AES.new(_EXPANSION_KEY, AES.MODE_ECB), seeds, counters)
+        return masks[:, :self.lwe_dimension]
+
+    @profiled('he.add_many', items=_batch_size)
+    def add_many(self, batch1, batch2):
+        """Add two batches of ciphertexts element-wise."""
+        masks1, bodies1 = self.as_batch(batch1)
+        masks2, bodies2 = self.as_batch(batch2)
+        mask_sum = masks1.astype(np.uint64) + masks2.astype(np.uint64)
+        return (mask_sum, bodies1 + bodies2)
+
+    @profiled('he.decrypt_many', items=len)
+    def decrypt_many(self, batch, epoch=None):
+        """Decrypt a batch of ciphertexts of one key epoch, returning a list of plaintexts."""
+        return self._decrypt_batch(batch, epoch)
+
+    def _decrypt_batch(self, batch, epoch):
+        delta = (1 << (32 - 1))
+        masks, bodies = self.as_batch(batch)
+        recovered_plaintexts = bodies - self._inner_products(masks, self._key(epoch))
+        return ((recovered_plaintexts + (delta >> 1)) // delta).tolist()
+
+    @profiled('he.sum_many')
+    def sum_many(self, batch, chunk_rows=4096):
+        """Homomorphically sum a batch into a single expanded ciphertext.
+
+        Compact batches are expanded chunk by chunk; each chunk and then the
+        per-chunk partial sums are combined by pairwise tree reduction.
+        """
+        masks_or_seeds, bodies = batch
+        partial_masks, partial_bodies = [], []
+        for start in range(0, len(bodies), chunk_rows):
+            chunk = (masks_or_seeds[start:start + chunk_rows], bodies[start:start + chunk_rows])
+            masks, chunk_bodies = self.as_batch(chunk)
+            mask_sum, body_sum = self._tree_sum(masks.astype(np.uint64), chunk_bodies)
+            partial_masks.append(mask_sum)
+            partial_bodies.append(body_sum)
+        if not partial_masks:
+            return (np.zeros(self.lwe_dimension, dtype=np.uint64), 0)
+        bodies = np.empty(len(partial_bodies), dtype=object)
+        bodies[:] = partial_bodies
+        return self._tree_sum(np.stack(partial_masks), bodies)
+
+    def decrypt_sum(self, batch, epoch=None):
+        """Return the plaintext sum of a batch, decrypting once per addition budget."""
+        total = 0
+        for start in range(0, len(batch[1]), self.addition_budget):
+            chunk = (batch[0][start:start + self.addition_budget], batch[1][start:start + self.addition_budget])
+            mask_sum, body_sum = self.sum_many(chunk)
+            bodies = np.empty(1, dtype=object)
+            bodies[0] = body_sum
+            total += self.decrypt_many((mask_sum[None, :], bodies), epoch)[0]
+        return total
+
+    def _tree_sum(self, masks, bodies):
+        """Reduce (N, n) uint64 masks and N bodies to one ciphertext by pairwise addition."""
+        while masks.shape[0] > 1:
+            half = masks.shape[0] // 2
+            carry_masks, carry_bodies = masks[2 * half:], bodies[2 * half:]
+            masks = np.concatenate([masks[:half] + masks[half:2 * half], carry_masks])
+            bodies = np.concatenate([bodies[:half] + bodies[half:2 * half], carry_bodies])
+        return masks[0], bodies[0]
+
+    def as_batch(self, ciphertexts):
+        """Normalise a batch or a sequence of single ciphertexts to expanded (masks, bodies)."""
+        if isinstance(ciphertexts, tuple) and isinstance(ciphertexts[0], np.ndarray):
+            masks, bodies = ciphertexts
+            if masks.ndim == 1:
+                masks = self.expand_masks(masks)
+            return masks, np.asarray(bodies, dtype=object)
+        masks = np.array([self.expand(ct)[0] for ct in ciphertexts], dtype=np.uint64)
+        masks = masks.reshape(len(ciphertexts), self.lwe_dimension)
+        bodies = np.empty(len(ciphertexts), dtype=object)
+        bodies[:] = [body for _, body in ciphertexts]
+        return masks, bodies
+
+    def _inner_products(self, masks, key):
+        """Exact <mask, key> for every row of a mask matrix."""
+        key_limbs = key.limbs[:self.lwe_dimension]
+        mask_limb_count = 2 if masks.dtype.itemsize <= 4 else 4
+        totals = np.zeros(masks.shape[0], dtype=object)
+        for i in range(mask_limb_count):
+            mask_limb = ((masks >> (_LIMB_BITS * i)) & _LIMB_MASK).astype(np.float64)
+            partial = (mask_limb @ key_limbs).astype(np.int64).astype(object)
+            for j in range(2):
+                totals += partial[:, j] << (_LIMB_BITS * (i + j))
+        return totals
@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+JOIN_TYPES = ('inner', 'left', 'right', 'outer')
+
+
+class JoinEngine:
+    """Equi-join strategies over (key, row_id) streams, plus a planner choosing between them.
+
+    Both strategies emit (left_row_id, right_row_id) pairs; None stands for the
+    missing side of an unmatched row in left, right and outer joins. Every
+    pairing of duplicate keys is produced, so one-to-many and many-to-many
+    joins are complete.
+    """
+
+    def __init__(self, hash_ratio=16):
+        # When one input is more than hash_ratio times larger than the other,
+        # hashing the small side beats walking both sorted inputs in step.
+        self.hash_ratio = hash_ratio
+
+    def plan(self, left_size, right_size, left_sorted, right_sorted):
+        """Return (strategy, build_side) for joining inputs of the given sizes.
+
+        Inputs that already arrive in key order (e.g. from a sorted index) are
+        merged directly unless their sizes are badly skewed. Otherwise a hash
+        join builds on the smaller input and streams the larger one past it.
+        """
+        small, large = sorted((left_size, right_size))
+        if left_sorted and right_sorted and large <= self.hash_ratio * max(small, 1):
+            return 'merge', None
+        return 'hash', 'left' if left_size <= right_size else 'right'
+
+    def hash_join(self, build, probe, join_type, build_side='left'):
+        """Join by hashing the build input and streaming the probe input through it."""
+        if join_type not in JOIN_TYPES:
+            raise ValueError(f"Unsupported join type '{join_type}'.")
+        probe_side = 'right' if build_side == 'left' else 'left'
+        keep_build = join_type in ('outer', build_side)
+        keep_probe = join_type in ('outer', probe_side)
+
+        def pair(build_row_id, probe_row_id):
+            return (build_row_id, probe_row_id) if build_side == 'left' else (probe_row_id, build_row_id)
+
+        hash_table = defaultdict(list)
+        for key, row_id in build:
+            hash_table[key].append(row_id)
+        matched_keys = set()
+        for key, probe_row_id in probe:
+            build_row_ids = hash_table.get(key)
+            if build_row_ids:
+                matched_keys.add(key)
+                for build_row_id in build_row_ids:
+                    yield pair(build_row_id, probe_row_id)
+            elif keep_probe:
+                yield pair(None, probe_row_id)
+        if keep_build:
+            for key, build_row_ids in hash_table.items():
+                if key not in matched_keys:
+                    for build_row_id in build_row_ids:
+                        yield pair(build_row_id, None)
+
+    def merge_join(self, left, right, join_type):
+        """Join two inputs sorted by key by walking them in step, one key group at a time."""
+        if join_type not in JOIN_TYPES:
+            raise ValueError(f"Unsupported join type '{join_type}'.")
+        keep_left = join_type in ('outer', 'left')
+        keep_right = join_type in ('outer', 'right')
+        left_groups, right_groups = _key_groups(left), _key_groups(right)
+        left_group, right_group = next(left_groups, None), next(right_groups, None)
+        while left_group is not None or right_group is not None:
+            if right_group is None or (left_group is not None and left_group[0] < right_group[0]):
+                if keep_left:
+                    for row_id in left_group[1]:
+                        yield row_id, None
+                left_group = next(left_groups, None)
+            elif left_group is None or right_group[0] < left_group[0]:
+                if keep_right:
+                    for row_id in right_group[1]:
+                        yield None, row_id
+                right_group = next(right_groups, None)
+            else:
+                for left_row_id in left_group[1]:
+                    for right_row_id in right_group[1]:
+                        yield left_row_id, right_row_id
+                left_group, right_group = next(left_groups, None), next(right_groups, None)
+
+
+def _key_groups(pairs):
+    """Group a key-sorted (key, row_id) stream into (key, [row_ids])."""
+    current_key, row_ids = None, []
+    for key, row_id in pairs:
+        if row_ids and key != current_key:
+            yield current_key, row_ids
+            row_ids = []
+        current_key = key
+        row_ids.append(row_id)
+    if row_ids:
+        yield current_key, row_ids
@@ -0,0 +1,156 @@
+"""Background re-encryption of a ZKDatabase under a new key."""
+import logging
+import threading
+import time
+import numpy as np
+from src.persistence import encode_batch
+
+logger = logging.getLogger(__name__)
+
+
+class KeyRotation:
+    """Moves every column of a database to the key of `epoch`, one chunk of rows at a time.
+
+    Each chunk is copied under the database's write lock, then decrypted and
+    re-encrypted without holding it, so queries and writes carry on in
+    between. A finished column is swapped in atomically, between
+    transactions; rows written after they were copied are re-encrypted
+    during the swap.
+    """
+
+    RETRY_SECONDS = 0.01  # Pause between attempts to swap while a transaction is open
+
+    def __init__(self, db, epoch, chunk_rows=4096):
+        self.db = db
+        self.epoch = epoch
+        self.chunk_rows = chunk_rows
+        self.columns_total = 0
+        self.columns_done = 0
+        self.rows_reencrypted = 0
+        self.error = None
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Run the rotation on a background thread; returns self."""
+        self.thread = threading.Thread(target=self._run_in_background, name='key-rotation', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run_in_background(self):
+        try:
+            self.run()
+        except Exception as error:
+            self.error = error
+            logger.exception("Key rotation to epoch %d failed.", self.epoch)
+
+    def wait(self, timeout=None):
+        """Wait for the rotation to end; re-raises its error. Returns False on timeout."""
+        if not self.done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def cancel(self):
+        """Stop after the current chunk. Columns already swapped stay under the new key."""
+        self.cancelled.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    @property
+    def progress(self):
+        return self.columns_done / self.columns_total if self.columns_total else float(self.done.is_set())
+
+    def run(self):
+        """Rotate every column on the calling thread."""
+        try:
+            with self.db.write_lock:
+                pending = [(table_name, info, column_index)
+                           for table_name, info in self.db.tables.items()
+                           for column_index, column in enumerate(info['data'].data) if column.epoch != self.epoch]
+            self.columns_total = len(pending)
+            for table_name, info, column_index in pending:
+                if self.cancelled.is_set():
+                    return
+                self._rotate_column(table_name, info, column_index)
+                self.columns_done += 1
+            self._between_transactions(self._finish)
+        finally:
+            self.done.set()
+
+    def _rotate_column(self, table_name, info, column_index):
+        db = self.db
+        row_ids, old_bodies, seeds, bodies = [], [], [], []
+        next_row_id = 0
+        while True:
+            if self.cancelled.is_set():
+                return
+            with db.write_lock:
+                if db.tables.get(table_name) is not info:
+                    return  # The table was dropped or recreated meanwhile
+                table = info['data']
+                column = table.data[column_index]
+                start = int(np.searchsorted(table.live_row_ids(), next_row_id))
+                positions = np.arange(start, min(start + self.chunk_rows, len(table)))
+                if not len(positions):
+                    break
+                chunk_row_ids = table.live_row_ids()[positions].copy()
+                batch, epoch = column.batch(positions), column.epoch
+            # Rows are addressed by id, since deletes may shift positions before the next chunk
+            next_row_id = int(chunk_row_ids[-1]) + 1
+            new_seeds, new_bodies = self._reencrypt(batch, epoch)
+            row_ids.append(chunk_row_ids)
+            old_bodies.append(batch[1])
+            seeds.append(new_seeds)
+            bodies.append(new_bodies)
+        self._between_transactions(lambda: self._swap(
+            table_name, info, column_index, np.concatenate(row_ids or [np.zeros(0, dtype=np.int64)]),
+            np.concatenate(old_bodies or [np.empty(0, dtype=object)]),
+            np.concatenate(seeds or [np.zeros(0, dtype=np.uint64)]),
+            np.concatenate(bodies or [np.empty(0, dtype=object)])))
+
+    def _reencrypt(self, batch, epoch):
+        values = self.db.executor.decrypt_many(batch, epoch)
+        self.rows_reencrypted += len(values)
+        return self.db.he.encrypt_many(values, compact=True, epoch=self.epoch)
+
+    def _swap(self, table_name, info, column_index, row_ids, old_bodies, seeds, bodies):
+        """Install the re-encrypted column, catching up on rows changed since their chunk was copied."""
+        db = self.db
+        if db.tables.get(table_name) is not info:
+            return
+        table = info['data']
+        column = table.data[column_index]
+        live_row_ids = table.live_row_ids()
+        slots = np.searchsorted(row_ids, live_row_ids).clip(max=max(len(row_ids) - 1, 0))
+        unchanged = np.zeros(len(live_row_ids), dtype=bool)
+        if len(row_ids):
+            # A rewritten cell has a new body, since every encryption draws fresh randomness
+            unchanged = (row_ids[slots] == live_row_ids) & (old_bodies[slots] == column.bodies[:len(column)])
+        new_seeds = np.zeros(len(live_row_ids), dtype=np.uint64)
+        new_bodies = np.empty(len(live_row_ids), dtype=object)
+        new_seeds[unchanged] = seeds[slots[unchanged]]
+        new_bodies[unchanged] = bodies[slots[unchanged]]
+        stale = np.flatnonzero(~unchanged)
+        if len(stale):
+            new_seeds[stale], new_bodies[stale] = self._reencrypt(column.batch(stale), column.epoch)
+        db._apply_rotate(table_name, column_index, self.epoch, (new_seeds, new_bodies))
+        db._write_wal({'op': 'rotate', 'table': table_name, 'column': column_index, 'epoch': self.epoch,
+                       'batch': encode_batch((new_seeds, new_bodies))})
+
+    def _finish(self):
+        # Checkpoint first, so that no write-ahead log record needs the old key any more
+        if self.db.store is not None:
+            self.db.checkpoint()
+        self.db._drop_unused_keys()
+        logger.info("Key rotation to epoch %d finished: %d rows re-encrypted.", self.epoch, self.rows_reencrypted)
+
+    def _between_transactions(self, function):
+        """Call function under the write lock as soon as no transaction is open, unless cancelled first."""
+        while not self.cancelled.is_set():
+            with self.db.write_lock:
+                if not self.db.open_transactions:
+                    return function()
+            time.sleep(self.RETRY_SECONDS)
@@ -0,0 +1,94 @@
+import hashlib
+
+# Domain-separation prefixes, so that a leaf can never be passed off as an inner node
+_LEAF = b'\x00'
+_NODE = b'\x01'
+# Placeholder leaf for a slot whose row was deleted (or never filled)
+EMPTY_LEAF = hashlib.sha256(_LEAF).digest()
+
+
+def leaf_hash(proof):
+    """Hash a hex row proof into a Merkle leaf."""
+    return hashlib.sha256(_LEAF + bytes.fromhex(proof)).digest()
+
+
+def _node_hash(left, right):
+    return hashlib.sha256(_NODE + left + right).digest()
+
+
+class MerkleTree:
+    """Merkle tree over row proofs, with O(log n) membership proofs and updates.
+
+    Leaves live at fixed slots; a table uses the row id as the slot, so
+    deleting a row just empties its leaf and inserting fills new slots at the
+    end. A node without a right sibling is carried up unchanged. Only the
+    nodes above changed leaves are rehashed.
+    """
+
+    def __init__(self):
+        self.levels = [[]]  # levels[0] are the leaves, levels[-1] holds the root
+
+    @classmethod
+    def from_proofs(cls, proofs):
+        """Commit to a sequence of row proofs, e.g. a query result."""
+        tree = cls()
+        tree.update({slot: leaf_hash(proof) for slot, proof in enumerate(proofs)})
+        return tree
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        """Hex digest committing to every leaf."""
+        return (self.levels[-1][0] if self.levels[0] else EMPTY_LEAF).hex()
+
+    def set(self, slot, proof):
+        """Set one slot to a row proof, or empty it with proof=None."""
+        self.update({slot: EMPTY_LEAF if proof is None else leaf_hash(proof)})
+
+    def update(self, leaves):
+        """Apply a {slot: leaf hash} batch, rehashing each affected inner node once."""
+        if not leaves:
+            return
+        nodes = self.levels[0]
+        dirty = set(leaves)
+        old_size, last = len(nodes), max(leaves)
+        if last >= old_size:
+            # Slots between the old end and the last new leaf start out empty, and their ancestors are new too
+            nodes.extend([EMPTY_LEAF] * (last + 1 - old_size))
+            dirty.update(range(old_size, last + 1))
+        for slot, leaf in leaves.items():
+            nodes[slot] = leaf
+        depth = 0
+        while len(self.levels[depth]) > 1:
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            nodes, parents = self.levels[depth], self.levels[depth + 1]
+            parent_count = (len(nodes) + 1) // 2
+            if len(parents) < parent_count:
+                parents.extend([None] * (parent_count - len(parents)))
+            dirty = {slot // 2 for slot in dirty}
+            for parent in dirty:
+                left = nodes[2 * parent]
+                parents[parent] = _node_hash(left, nodes[2 * parent + 1]) if 2 * parent + 1 < len(nodes) else left
+            depth += 1
+
+    def prove(self, slot):
+        """Return the membership proof of a slot: [('L' | 'R', sibling hex digest), ...] from leaf to root."""
+        path = []
+        for nodes in self.levels[:-1]:
+            sibling = slot ^ 1
+            if sibling < len(nodes):
+                path.append(('L' if sibling < slot else 'R', nodes[sibling].hex()))
+            slot //= 2
+        return path
+
+
+def verify_membership(root, proof, path):
+    """Check that a row proof is committed to by root, given its membership path."""
+    node = leaf_hash(proof)
+    for side, sibling in path:
+        sibling = bytes.fromhex(sibling)
+        node = _node_hash(sibling, node) if side == 'L' else _node_hash(node, sibling)
+    return node.hex() == root
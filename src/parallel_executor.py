@@ -0,0 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import threading
+import numpy as np
+from src.homomorphic_encryption import HomomorphicEncryption
+
+# HomomorphicEncryption instances of a worker process, one per key it was sent
+_worker_instances = {}
+
+
+def _instance(he, key):
+    """The parent's instance in thread mode; in process mode, this worker's instance for a shipped key.
+
+    Worker processes hold no key of their own: each task carries the
+    (SecretKey, lwe_dimension) it needs, so instances with different keys
+    can share one process and a rotated key needs no pool restart.
+    """
+    if he is not None:
+        return he
+    secret_key, lwe_dimension = key
+    cache_key = (secret_key.epoch, secret_key.fingerprint(), lwe_dimension)
+    he = _worker_instances.get(cache_key)
+    if he is None:
+        he = _worker_instances[cache_key] = HomomorphicEncryption(lwe_dimension, key=secret_key)
+    return he
+
+
+def _decrypt_chunk(he, key, epoch, chunk):
+    return _instance(he, key).decrypt_many(chunk, epoch)
+
+
+def _filter_chunk(he, key, epoch, chunk, test):
+    values = _instance(he, key).decrypt_many(chunk, epoch)
+    return [offset for offset, value in enumerate(values) if test(value)]
+
+
+def _sum_chunk(he, key, epoch, chunk):
+    return _instance(he, key).sum_many(chunk)
+
+
+class ParallelExecutor:
+    """Runs decryption, predicate evaluation and summation over row chunks on a worker pool.
+
+    mode='thread' suits the NumPy backend, whose matrix products and mask
+    expansion release the GIL; mode='process' sidesteps the GIL entirely and
+    ships the key of the batch's epoch along with every chunk. With a
+    single worker, or batches no larger than one chunk, work runs inline.
+    Results are always merged in row order.
+    """
+
+    def __init__(self, he, workers=1, mode='thread', chunk_rows=4096):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unsupported parallel mode '{mode}'.")
+        self.he = he
+        self.workers = workers
+        self.mode = mode
+        self.chunk_rows = chunk_rows
+        self.pool = None
+        self.pool_lock = threading.Lock()  # Scans may start from several threads (e.g. a server's workers)
+
+    def _parallel(self, row_count):
+        return self.workers > 1 and row_count > self.chunk_rows
+
+    def _pool(self):
+        with self.pool_lock:
+            if self.pool is None:
+                if self.mode == 'thread':
+                    self.pool = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self.pool
+
+    def _map(self, function, batch, chunk_rows, epoch=None):
+        """Apply function to consecutive chunks of a batch, returning results in row order."""
+        masks_or_seeds, bodies = batch
+        chunks = [
+            (masks_or_seeds[start:start + chunk_rows], bodies[start:start + chunk_rows])
+            for start in range(0, len(bodies), chunk_rows)
+        ]
+        if self.mode == 'thread':
+            function = partial(function, self.he, None, epoch)
+        else:
+            function = partial(function, None, (self.he._key(epoch), self.he.lwe_dimension), epoch)
+        return list(self._pool().map(function, chunks))
+
+    def _count_decryptions(self, amount):
+        # Counted here, on the calling thread, so that decryptions on pool workers count towards the query
+        if self.he.profiler is not None:
+            self.he.profiler.count('decryptions', amount)
+
+    def decrypt_many(self, batch, epoch=None):
+        """Decrypt a batch of ciphertexts of one key epoch (the current one by default)."""
+        self._count_decryptions(len(batch[1]))
+        if not self._parallel(len(batch[1])):
+            return self.he.decrypt_many(batch, epoch)
+        return [value for chunk in self._map(_decrypt_chunk, batch, self.chunk_rows, epoch) for value in chunk]
+
+    def filter(self, batch, test, epoch=None):
+        """Return the offsets within batch whose plaintext passes test (picklable in process mode)."""
+        self._count_decryptions(len(batch[1]))
+        if not self._parallel(len(batch[1])):
+            return _filter_chunk(self.he, None, epoch, batch, test)
+        results = self._map(partial(_filter_chunk, test=test), batch, self.chunk_rows, epoch)
+        return [start + offset for start, chunk in zip(range(0, len(batch[1]), self.chunk_rows), results)
+                for offset in chunk]
+
+    def decrypt_sum(self, batch, epoch=None):
+        """Plaintext sum of a batch; workers pre-sum chunks, one decryption per addition budget."""
+        self._count_decryptions(-(-len(batch[1]) // self.he.addition_budget))
+        if not self._parallel(len(batch[1])):
+            return self.he.decrypt_sum(batch, epoch)
+        total = 0
+        budget = self.he.addition_budget
+        for start in range(0, len(batch[1]), budget):
+            window = (batch[0][start:start + budget], batch[1][start:start + budget])
+            partial_sums = self._map(_sum_chunk, window, min(self.chunk_rows, budget), epoch)
+            bodies = np.empty(len(partial_sums), dtype=object)
+            bodies[:] = [body for _, body in partial_sums]
+            total += self.he.decrypt_sum((np.stack([mask for mask, _ in partial_sums]), bodies), epoch)
+        return total
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,401 @@
+"""On-disk storage for ZKDatabase: memory-mapped checkpoints plus a write-ahead log.
+
+Layout of a database directory::
+
+    CURRENT                 name of the live checkpoint directory
+    checkpoint-<lsn>/       catalog.json and, per table, binary column files
+    wal.log                 JSON lines, one committed change per line
+    keys.json               optional; written only when key persistence is requested
+
+Each column is stored as a ``.npy`` array of 64-bit mask seeds, which is
+memory-mapped copy-on-write on open, plus a body file: signed big-endian
+integers concatenated in a ``.bin`` blob and located by an ``.npy`` offsets
+array. Ciphertexts with expanded masks go in an optional ``.expanded.npz``.
+Nothing is re-encrypted on open, and nothing is parsed or decrypted until it
+is used: bodies are read from their blob the first time a column is
+touched, and each index is loaded, or rebuilt by decrypting its column, the
+first time a query or write needs it. A checkpoint hard-links the files of
+columns and indexes that were never loaded instead of rewriting them. The catalog records the key epoch of every
+column and a fingerprint of every key, so a store is only opened with the
+keys it was written with and the mask expansion it was written for.
+
+Index keys are plaintext, so they are only written to disk when
+``persist_indexes`` is set; otherwise the first use of each index after
+opening costs a decryption of its column. WAL records never carry plaintext.
+"""
+import functools
+import json
+import mmap
+import os
+import shutil
+import numpy as np
+from src.columnar_storage import ColumnarTable, EncryptedColumn
+from src.homomorphic_encryption import MASK_EXPANSION, SecretKey
+from src.merkle_tree import MerkleTree, EMPTY_LEAF, leaf_hash
+from src.secondary_index import SortedIndex
+
+
+def encode_batch(batch):
+    """Encode a compact or expanded ciphertext batch as JSON-serialisable lists."""
+    masks_or_seeds, bodies = batch
+    key = 'seeds' if masks_or_seeds.ndim == 1 else 'masks'
+    return {key: masks_or_seeds.tolist(), 'bodies': list(bodies)}
+
+
+def decode_batch(encoded):
+    bodies = np.empty(len(encoded['bodies']), dtype=object)
+    bodies[:] = encoded['bodies']
+    if 'seeds' in encoded:
+        return np.array(encoded['seeds'], dtype=np.uint64), bodies
+    return np.array(encoded['masks'], dtype=np.uint64), bodies
+
+
+def _write_ints(prefix, values):
+    encoded = [value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True) for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    with open(prefix + '.bin', 'wb') as f:
+        f.write(b''.join(encoded))
+    np.save(prefix + '.offsets.npy', offsets)
+
+
+def _map_array(path):
+    """Memory-map a saved array copy-on-write; empty arrays cannot be mapped and are loaded directly."""
+    try:
+        return np.load(path, mmap_mode='c')
+    except ValueError:
+        return np.load(path)
+
+
+def _read_ints(prefix):
+    offsets = _map_array(prefix + '.offsets.npy').tolist()
+    values = np.empty(len(offsets) - 1, dtype=object)
+    if offsets[-1] == 0:
+        return values
+    with open(prefix + '.bin', 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+        values[:] = [int.from_bytes(blob[start:end], 'big', signed=True)
+                     for start, end in zip(offsets, offsets[1:])]
+    return values
+
+
+def _link_files(source_prefix, target_prefix, suffixes):
+    """Reuse unchanged files of the previous checkpoint: hard-link them, or copy where links are unsupported."""
+    for suffix in suffixes:
+        try:
+            os.link(source_prefix + suffix, target_prefix + suffix)
+        except OSError:
+            shutil.copyfile(source_prefix + suffix, target_prefix + suffix)
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_tree(directory):
+    """fsync every file under directory, then the directories themselves, deepest first."""
+    for root, _, files in os.walk(directory, topdown=False):
+        for file in files:
+            _fsync_path(os.path.join(root, file))
+        _fsync_path(root)
+
+
+class _StoredInts:
+    """Integers of a checkpoint file, parsed when called."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __call__(self):
+        return _read_ints(self.prefix)
+
+
+class _StoredIndex:
+    """A persisted index, loaded when called."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __call__(self):
+        return SortedIndex.from_pairs(_read_ints(self.prefix + '.keys').tolist(),
+                                      np.load(self.prefix + '.row_ids.npy').tolist())
+
+
+_PENDING = object()
+
+
+class LazyIndexes(dict):
+    """The indexes of a table opened from disk; each is loaded or built the first time it is used.
+
+    `loaders` maps column names to functions returning their index. Loading
+    happens under `lock` (the database's write lock), so that it never sees
+    a write half done.
+    """
+
+    def __init__(self, loaders, lock):
+        super().__init__(dict.fromkeys(loaders, _PENDING))
+        self.loaders = loaders
+        self.lock = lock
+
+    def __getitem__(self, column):
+        index = super().__getitem__(column)
+        if index is _PENDING:
+            with self.lock:
+                index = super().__getitem__(column)
+                if index is _PENDING:
+                    index = self.loaders.pop(column)()
+                    super().__setitem__(column, index)
+        return index
+
+    def __setitem__(self, column, index):
+        self.loaders.pop(column, None)
+        super().__setitem__(column, index)
+
+    def get(self, column, default=None):
+        return self[column] if column in self else default
+
+    def values(self):
+        return [self[column] for column in self]
+
+    def items(self):
+        return [(column, self[column]) for column in self]
+
+    def pop(self, column, *default):
+        self.loaders.pop(column, None)
+        index = super().pop(column, *default)
+        return None if index is _PENDING else index
+
+    def maintained(self):
+        """(column, index) pairs that writes must keep up to date.
+
+        Persisted indexes are loaded, since their files miss later writes;
+        indexes still to be built are left out, as building reads the rows
+        as they are by then.
+        """
+        return [(column, self[column]) for column in self
+                if dict.__getitem__(self, column) is not _PENDING or isinstance(self.loaders[column], _StoredIndex)]
+
+    def defer(self, column, loader):
+        """Drop a loaded index; loader rebuilds it when it is next used."""
+        with self.lock:
+            self.loaders[column] = loader
+            super().__setitem__(column, _PENDING)
+
+
+class DiskStore:
+    """Persists ZKDatabase tables as memory-mapped checkpoints plus a write-ahead log."""
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.lsn = 0
+        os.makedirs(path, exist_ok=True)
+        self.wal = None
+
+    # ----- Key Material -----
+    def save_key_material(self, keys, proof_salt):
+        """Write the secret keys and proof salt next to the data. Only done on explicit request."""
+        path = os.path.join(self.path, 'keys.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'keys': {str(key.epoch): list(key) for key in keys}, 'proof_salt': proof_salt.hex()}, f)
+        os.replace(path + '.tmp', path)
+
+    def load_key_material(self):
+        """Return ([SecretKey], proof_salt) if key material was persisted, else None."""
+        path = os.path.join(self.path, 'keys.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            material = json.load(f)
+        stored = material['keys'] if 'keys' in material else {'0': material['secret_key']}
+        return [SecretKey(values, int(epoch)) for epoch, values in stored.items()], bytes.fromhex(material['proof_salt'])
+
+    # ----- Write-Ahead Log -----
+    def append(self, records):
+        """Durably append committed change records to the write-ahead log."""
+        if not records:
+            return
+        lines = []
+        for record in records:
+            self.lsn += 1
+            lines.append(json.dumps(dict(record, lsn=self.lsn)) + '\n')
+        self.wal.write(''.join(lines))
+        self.wal.flush()
+        if self.fsync:
+            os.fsync(self.wal.fileno())
+
+    def _open_wal(self, after_lsn):
+        """Return the WAL records after after_lsn and reopen the log for appending.
+
+        A torn record at the tail (from a crash mid-write) is cut off, so that
+        records appended from now on are not hidden behind it.
+        """
+        path = os.path.join(self.path, 'wal.log')
+        records, valid_bytes = [], 0
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if not line.endswith(b'\n'):
+                        break
+                    valid_bytes += len(line)
+                    self.lsn = max(self.lsn, record['lsn'])
+                    if record['lsn'] > after_lsn:
+                        records.append(record)
+            os.truncate(path, valid_bytes)
+        self.wal = open(path, 'a')
+        return records
+
+    # ----- Open / Checkpoint -----
+    def load(self, db, keys):
+        """Load the last checkpoint into db and return the WAL records to replay on top of it.
+
+        keys is the database's {epoch: SecretKey} ring; every key the store
+        knows under the same epoch must match it.
+        """
+        current_path = os.path.join(self.path, 'CURRENT')
+        if not os.path.exists(current_path):
+            # A new store: write an empty checkpoint so the key fingerprint is on disk before any WAL record
+            self._open_wal(0)
+            self.checkpoint(db, keys)
+            return []
+        with open(current_path) as f:
+            checkpoint_dir = os.path.join(self.path, f.read().strip())
+        with open(os.path.join(checkpoint_dir, 'catalog.json')) as f:
+            catalog = json.load(f)
+        if catalog.get('mask_expansion') != MASK_EXPANSION:
+            raise ValueError(f"Database at {self.path} was written by an older version with another ciphertext "
+                             f"format; export and re-import its data.")
+        for epoch, fingerprint in catalog['key_fingerprints'].items():
+            if int(epoch) in keys and keys[int(epoch)].fingerprint() != fingerprint:
+                raise ValueError(f"Database at {self.path} was written with a different secret key.")
+        for meta in catalog['tables'].values():
+            missing = sorted(set(meta['epochs']) - set(keys))
+            if missing:
+                raise ValueError(f"Database at {self.path} needs the keys of epochs {missing}.")
+        for table_name, meta in catalog['tables'].items():
+            self._load_table(db, table_name, meta, os.path.join(checkpoint_dir, meta['dir']))
+        self.lsn = catalog['lsn']
+        return self._open_wal(catalog['lsn'])
+
+    def _load_table(self, db, table_name, meta, table_dir):
+        columns = meta['columns']
+        data = []
+        for i, epoch in enumerate(meta['epochs']):
+            prefix = os.path.join(table_dir, f'c{i}')
+            expanded = {}
+            if os.path.exists(prefix + '.expanded.npz'):
+                with np.load(prefix + '.expanded.npz') as fallback:
+                    expanded = dict(zip(fallback['positions'].tolist(), fallback['masks']))
+            seeds = _map_array(prefix + '.seeds.npy')
+            data.append(EncryptedColumn.from_arrays(db.he.lwe_dimension, db.he.expand_masks, seeds,
+                                                    _StoredInts(prefix + '.bodies'), expanded, epoch))
+        with open(os.path.join(table_dir, 'proofs.json')) as f:
+            proofs = json.load(f)
+        row_ids = _map_array(os.path.join(table_dir, 'row_ids.npy'))
+        table = ColumnarTable.from_arrays(columns, db.he.lwe_dimension, db.he.expand_masks, data, proofs,
+                                          row_ids, meta['next_row_id'])
+        commitment = MerkleTree()
+        leaves = {row_id: leaf_hash(proof) for row_id, proof in zip(row_ids.tolist(), proofs)}
+        if meta['next_row_id']:
+            # Slots of rows deleted at the end of the table still count towards the tree's shape
+            leaves.setdefault(meta['next_row_id'] - 1, EMPTY_LEAF)
+        commitment.update(leaves)
+        db.tables[table_name] = {'columns': columns, 'data': table, 'commitment': commitment}
+        loaders = {}
+        for i in meta['indexes']:
+            prefix = os.path.join(table_dir, f'i{i}')
+            if os.path.exists(prefix + '.keys.offsets.npy'):
+                loaders[columns[i]] = _StoredIndex(prefix)
+            else:
+                loaders[columns[i]] = functools.partial(db._build_index, table_name, columns[i])
+        db.indexes[table_name] = LazyIndexes(loaders, db.write_lock)
+
+    def checkpoint(self, db, keys, persist_indexes=False):
+        """Write every table to a new checkpoint directory, switch to it and truncate the WAL."""
+        current_path = os.path.join(self.path, 'CURRENT')
+        previous = None
+        if os.path.exists(current_path):
+            with open(current_path) as f:
+                previous = f.read().strip()
+        name = f'checkpoint-{self.lsn:012d}'
+        if name == previous:
+            name += '.1'  # Never overwrite the live checkpoint: columns not loaded yet still read from it
+        checkpoint_dir = os.path.join(self.path, name)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.makedirs(checkpoint_dir)
+        catalog = {
+            'lsn': self.lsn,
+            'mask_expansion': MASK_EXPANSION,
+            'key_fingerprints': {str(epoch): key.fingerprint() for epoch, key in keys.items()},
+            'tables': {},
+        }
+        for number, (table_name, table_info) in enumerate(db.tables.items()):
+            table_dir = os.path.join(checkpoint_dir, f't{number}')
+            os.makedirs(table_dir)
+            table = table_info['data']
+            for i, column in enumerate(table.data):
+                prefix = os.path.join(table_dir, f'c{i}')
+                np.save(prefix + '.seeds.npy', np.ascontiguousarray(column.seeds[:len(column)]))
+                if isinstance(column.body_loader, _StoredInts):
+                    _link_files(column.body_loader.prefix, prefix + '.bodies', ('.bin', '.offsets.npy'))
+                    column.body_loader.prefix = prefix + '.bodies'
+                else:
+                    _write_ints(prefix + '.bodies', column.bodies[:len(column)].tolist())
+                if column.expanded:
+                    positions = sorted(column.expanded)
+                    np.savez(prefix + '.expanded.npz', positions=np.array(positions, dtype=np.int64),
+                             masks=np.stack([column.expanded[p] for p in positions]).astype(np.uint64))
+            with open(os.path.join(table_dir, 'proofs.json'), 'w') as f:
+                json.dump(table.proofs, f)
+            np.save(os.path.join(table_dir, 'row_ids.npy'), np.ascontiguousarray(table.live_row_ids()))
+            indexes = db.indexes[table_name]
+            indexed = [table.column_index(column) for column in indexes]
+            for i in indexed:
+                prefix = os.path.join(table_dir, f'i{i}')
+                loader = indexes.loaders.get(table.columns[i]) if isinstance(indexes, LazyIndexes) else None
+                if isinstance(loader, _StoredIndex):
+                    if persist_indexes:
+                        _link_files(loader.prefix, prefix, ('.keys.bin', '.keys.offsets.npy', '.row_ids.npy'))
+                        loader.prefix = prefix
+                    else:  # Its files go with the previous checkpoint
+                        indexes.loaders[table.columns[i]] = functools.partial(
+                            db._build_index, table_name, table.columns[i])
+                elif persist_indexes:
+                    index = indexes[table.columns[i]]
+                    row_ids = [row_id for key in index.keys for row_id in index.postings[key]]
+                    _write_ints(prefix + '.keys', [index.values[row_id] for row_id in row_ids])
+                    np.save(prefix + '.row_ids.npy', np.array(row_ids, dtype=np.int64))
+            catalog['tables'][table_name] = {
+                'dir': f't{number}', 'columns': table.columns, 'epochs': [column.epoch for column in table.data],
+                'next_row_id': table.next_row_id, 'indexes': indexed,
+            }
+        with open(os.path.join(checkpoint_dir, 'catalog.json'), 'w') as f:
+            json.dump(catalog, f)
+
+        if self.fsync:
+            _fsync_tree(checkpoint_dir)  # The checkpoint must be on disk before CURRENT points to it
+        with open(current_path + '.tmp', 'w') as f:
+            f.write(name)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(current_path + '.tmp', current_path)
+        if self.fsync:
+            _fsync_path(self.path)  # Makes the switch durable before the WAL it replaces is truncated
+        # Records up to self.lsn are now in the checkpoint; replay skips them even if truncation is interrupted
+        self.wal.close()
+        self.wal = open(os.path.join(self.path, 'wal.log'), 'w')
+        if previous and previous != name:
+            shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+
+    def close(self):
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
@@ -0,0 +1,125 @@
+"""Opt-in timers and counters for the database and encryption hot paths.
+
+Instrumented methods check `self.profiler` on every call and run untouched
+when it is None, so profiling costs one attribute lookup unless enabled.
+Counters incremented while an operation runs are also attributed to that
+operation (and to any enclosing one on the same thread), which gives
+figures such as decryptions per select.
+"""
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Profiler:
+    """Thread-safe per-operation timers and named counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Stack of counter dicts of the operations running on this thread
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}  # name -> [calls, total seconds, max seconds, items]
+            self.counters = {}
+            self.operation_counters = {}  # operation name -> {counter name: total}
+
+    def _scopes(self):
+        scopes = getattr(self.local, 'scopes', None)
+        if scopes is None:
+            scopes = self.local.scopes = []
+        return scopes
+
+    def _record(self, name, seconds, items):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0, 0]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3] += items
+
+    @contextmanager
+    def measure(self, name, items=0):
+        """Time a block under `name`; items (rows, ciphertexts, ...) are summed across calls."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start, items)
+
+    @contextmanager
+    def operation(self, name):
+        """Time a block and attribute the counters it increments on this thread to `name`."""
+        scopes = self._scopes()
+        counts = {}
+        scopes.append(counts)
+        try:
+            with self.measure(name):
+                yield
+        finally:
+            scopes.pop()
+            with self.lock:
+                totals = self.operation_counters.setdefault(name, {})
+                for counter, value in counts.items():
+                    totals[counter] = totals.get(counter, 0) + value
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for counts in self._scopes():
+            counts[name] = counts.get(name, 0) + amount
+
+    def snapshot(self):
+        """Return every timer and counter as a JSON-serialisable dict.
+
+        Each timer lists its calls, total/mean/max seconds and items; timers
+        of operations also list the counters they incremented, in total and
+        per call.
+        """
+        with self.lock:
+            timers = {}
+            for name, (calls, total, maximum, items) in sorted(self.timers.items()):
+                timer = {'calls': calls, 'total_seconds': total, 'mean_seconds': total / calls,
+                         'max_seconds': maximum}
+                if items:
+                    timer['items'] = items
+                    timer['items_per_second'] = items / total if total else None
+                counts = self.operation_counters.get(name)
+                if counts:
+                    timer['counters'] = dict(counts)
+                    timer['per_call'] = {counter: value / calls for counter, value in counts.items()}
+                timers[name] = timer
+            return {'timers': timers, 'counters': dict(self.counters)}
+
+    def dump(self, path):
+        """Write snapshot() to a JSON file."""
+        with open(path, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+
+def profiled(name, items=None, operation=False):
+    """Instrument a method of an object with a `profiler` attribute.
+
+    `items(result)` gives the number of items the call handled. With
+    operation=True the call is an operation that counters are attributed to.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            if operation:
+                with profiler.operation(name):
+                    return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            profiler._record(name, time.perf_counter() - start, items(result) if items is not None else 0)
+            return result
+        return wrapper
+    return decorator
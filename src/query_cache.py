@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+
+def _copy(result):
+    """Copy the lists, tuples and dicts of a result; the values in them are immutable."""
+    if isinstance(result, list):
+        return [_copy(item) for item in result]
+    if isinstance(result, tuple):
+        return tuple(_copy(item) for item in result)
+    if isinstance(result, dict):
+        return {key: _copy(value) for key, value in result.items()}
+    return result
+
+
+class QueryCache:
+    """Size-bounded LRU cache of query results.
+
+    Each entry remembers the version of every table it was computed from.
+    Writers bump a table's version through `invalidate`, which makes every
+    dependent entry stale; stale entries are dropped the next time they are read.
+    Queries should take `table_versions(key)` before they run and pass it to
+    `put`, so that a result computed while a write landed is not cached.
+    Results are copied on the way in and out, so callers may change what
+    they get. All methods are thread-safe, so concurrent readers can share
+    one cache.
+    """
+
+    MISS = object()  # Sentinel, so that empty results can be cached too
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (table versions, result)
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def make_key(self, kind, tables, *params):
+        """Build a cache key from the query kind, the tables it reads and its parameters."""
+        return (kind, tuple(tables), repr(params))
+
+    def _table_versions(self, tables):
+        return tuple(self.versions.get(table, 0) for table in tables)
+
+    def table_versions(self, key):
+        """The current versions of the tables a key's query reads."""
+        with self.lock:
+            return self._table_versions(key[1])
+
+    def get(self, key):
+        """Return the cached result for key, or QueryCache.MISS."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != self._table_versions(key[1]):
+                del self.entries[key]
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return self.MISS
+            self.entries.move_to_end(key)
+            self.hits += 1
+            result = entry[1]
+        return _copy(result)
+
+    def put(self, key, result, versions=None):
+        """Cache a result; with the versions taken when its query started, skip it if a table changed since."""
+        if self.max_entries <= 0:
+            return
+        result = _copy(result)
+        with self.lock:
+            current = self._table_versions(key[1])
+            if versions is not None and versions != current:
+                return
+            self.entries[key] = (current, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table_name):
+        """Mark every cached result that depends on table_name as stale."""
+        with self.lock:
+            self.versions[table_name] = self.versions.get(table_name, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
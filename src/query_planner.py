@@ -0,0 +1,323 @@
+"""Predicate AST and a cost-based planner that evaluates predicates over encrypted tables.
+
+Conditions are trees of Compare, In, And, Or and Not nodes. The classic
+``(column, operator, value)`` tuple still works, as do nested tuples such as
+``('AND', ('age', '>', 30), ('name', 'IN', ['Alice', 'Bob']))``.
+
+A condition is compiled once per query: columns are resolved to positions,
+values are encoded, and each comparison becomes a plain Python test.
+Evaluation works on sets of candidate row positions. Each comparison either
+looks up its index, which decrypts nothing, or scans its column for the
+current candidates only, decrypting and testing them on the executor's pool. The cheaper of the two is picked at run time.
+Conjuncts run in order of estimated selectivity, so every later conjunct
+decrypts fewer rows.
+"""
+import operator
+import numpy as np
+
+COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# Expected fraction of rows a comparison on an unindexed column keeps
+DEFAULT_SELECTIVITY = {'=': 0.05, '!=': 0.95, '<': 0.33, '<=': 0.33, '>': 0.33, '>=': 0.33}
+
+
+class Predicate:
+    """Base class of predicate nodes; nodes combine with &, | and ~."""
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and repr(self) == repr(other)
+
+    def __hash__(self):
+        return hash(repr(self))
+
+
+class Compare(Predicate):
+    def __init__(self, column, operator, value):
+        if operator not in COMPARISONS:
+            raise ValueError(f"Unsupported operator '{operator}'.")
+        self.column, self.operator, self.value = column, operator, value
+
+    def __repr__(self):
+        return f"Compare({self.column!r}, {self.operator!r}, {self.value!r})"
+
+
+class In(Predicate):
+    def __init__(self, column, values):
+        self.column, self.values = column, tuple(values)
+
+    def __repr__(self):
+        return f"In({self.column!r}, {list(self.values)!r})"
+
+
+class And(Predicate):
+    def __init__(self, *terms):
+        self.terms = tuple(parse_condition(term) for term in terms)
+
+    def __repr__(self):
+        return f"And({', '.join(map(repr, self.terms))})"
+
+
+class Or(Predicate):
+    def __init__(self, *terms):
+        self.terms = tuple(parse_condition(term) for term in terms)
+
+    def __repr__(self):
+        return f"Or({', '.join(map(repr, self.terms))})"
+
+
+class Not(Predicate):
+    def __init__(self, term):
+        self.term = parse_condition(term)
+
+    def __repr__(self):
+        return f"Not({self.term!r})"
+
+
+def parse_condition(condition):
+    """Turn a condition given as AST nodes or (nested) tuples into a Predicate."""
+    if isinstance(condition, Predicate):
+        return condition
+    keyword = condition[0].upper() if isinstance(condition[0], str) else None
+    # A leading AND/OR/NOT is a connective only when followed by conditions; ('AND', '=', 1) compares a column
+    if keyword in ('AND', 'OR', 'NOT') and all(isinstance(term, (tuple, list, Predicate)) for term in condition[1:]):
+        if keyword == 'NOT':
+            return Not(*condition[1:])
+        return (And if keyword == 'AND' else Or)(*condition[1:])
+    column, op, value = condition
+    if op.upper() == 'IN':
+        return In(column, value)
+    if op.upper() == 'NOT IN':
+        return Not(In(column, value))
+    return Compare(column, op, value)
+
+
+def predicate_columns(predicate):
+    """Return the set of column names a predicate reads."""
+    if isinstance(predicate, (Compare, In)):
+        return {predicate.column}
+    if isinstance(predicate, Not):
+        return predicate_columns(predicate.term)
+    return set().union(*(predicate_columns(term) for term in predicate.terms))
+
+
+def conjuncts(predicate):
+    """Split a predicate into the terms of its top-level AND."""
+    if isinstance(predicate, And):
+        return [term for part in predicate.terms for term in conjuncts(part)]
+    return [predicate]
+
+
+# ----- Compiled Nodes -----
+class ValueTest:
+    """The test of one comparison against a plaintext; picklable, so that worker processes can run it."""
+
+    def __init__(self, op, values):
+        self.operator = op
+        self.operand = frozenset(values) if op == 'IN' else values[0]
+
+    def __call__(self, value):
+        if self.operator == 'IN':
+            return value in self.operand
+        return value is not None and COMPARISONS[self.operator](value, self.operand)
+
+
+class _Leaf:
+    """One comparison with its column resolved, values encoded and its test function built."""
+
+    def __init__(self, column, column_index, op, values, index):
+        self.column, self.column_index, self.operator, self.values = column, column_index, op, values
+        # '!=' is planned as NOT '=', so only these operators can use an index
+        self.index = index if op in ('=', '<', '<=', '>', '>=', 'IN') else None
+        self.row_ids = None  # Index lookup result, computed at most once per query
+        self.test = ValueTest(op, values)
+
+    def estimate(self, row_count):
+        """Expected number of matching rows."""
+        if self.index is not None:
+            if self.operator == 'IN':
+                return sum(self.index.estimate('=', value) for value in self.values)
+            return self.index.estimate(self.operator, self.values[0])
+        if self.operator == 'IN':
+            return row_count * min(1.0, DEFAULT_SELECTIVITY['='] * len(self.values))
+        return row_count * DEFAULT_SELECTIVITY[self.operator]
+
+    def lookup(self):
+        if self.row_ids is None:
+            if self.operator == 'IN':
+                row_ids = [row_id for value in set(self.values) for row_id in self.index.lookup('=', value)]
+                row_ids.sort()
+            else:
+                row_ids = self.index.lookup(self.operator, self.values[0])
+            self.row_ids = np.asarray(row_ids, dtype=np.int64)
+        return self.row_ids
+
+    def describe(self):
+        return self.column, self.operator, self.values if self.operator == 'IN' else self.values[0]
+
+
+class _Node:
+    def __init__(self, kind, children):
+        self.kind, self.children = kind, children
+
+
+class QueryPlan:
+    """A predicate compiled against one table, evaluated with index lookups and partial scans.
+
+    `filter(column_index, positions, test)` decrypts one column at the given
+    positions and returns the offsets, within positions, of the plaintexts
+    that pass test; it is only called for rows still in the running.
+    """
+
+    # Relative cost of handling one index posting and of decrypting one ciphertext
+    INDEX_ROW_COST = 1
+    SCAN_ROW_COST = 64
+
+    def __init__(self, predicate, table, indexes, encode, filter):
+        self.table = table
+        self.filter = filter
+        self.root = self._compile(parse_condition(predicate), indexes, encode)
+
+    def _compile(self, predicate, indexes, encode):
+        if isinstance(predicate, (Compare, In)):
+            column = predicate.column.rpartition('.')[2]  # Accept "table.column" as pushed down from a join
+            column_index, index = self.table.column_index(column), indexes.get(column)
+            if isinstance(predicate, In):
+                return _Leaf(column, column_index, 'IN', tuple(encode(value) for value in predicate.values), index)
+            value = encode(predicate.value)
+            if predicate.operator == '!=':
+                return _Node('NOT', [_Leaf(column, column_index, '=', (value,), index)])
+            return _Leaf(column, column_index, predicate.operator, (value,), index)
+        if isinstance(predicate, Not):
+            return _Node('NOT', [self._compile(predicate.term, indexes, encode)])
+        kind = 'AND' if isinstance(predicate, And) else 'OR'
+        return _Node(kind, [self._compile(term, indexes, encode) for term in predicate.terms])
+
+    # ----- Cost Model -----
+    def _selectivity(self, node):
+        row_count = max(len(self.table), 1)
+        if isinstance(node, _Leaf):
+            return min(1.0, node.estimate(row_count) / row_count)
+        selectivities = [self._selectivity(child) for child in node.children]
+        if node.kind == 'NOT':
+            return 1.0 - selectivities[0]
+        product = 1.0
+        for selectivity in selectivities:
+            product *= selectivity if node.kind == 'AND' else 1.0 - selectivity
+        return product if node.kind == 'AND' else 1.0 - product
+
+    def _uses_index(self, leaf, candidate_count):
+        if leaf.index is None:
+            return False
+        if leaf.row_ids is not None:
+            return True
+        return leaf.estimate(len(self.table)) * self.INDEX_ROW_COST <= candidate_count * self.SCAN_ROW_COST
+
+    def _needs_scan(self, node, candidate_count):
+        if isinstance(node, _Leaf):
+            return not self._uses_index(node, candidate_count)
+        return any(self._needs_scan(child, candidate_count) for child in node.children)
+
+    def _order(self, node, candidate_count):
+        """Children of an AND/OR in evaluation order: index-only terms first, then by selectivity."""
+        reverse = node.kind == 'OR'  # For OR, terms that match more leave fewer rows for the rest
+        return sorted(node.children, key=lambda child: (
+            self._needs_scan(child, candidate_count),
+            -self._selectivity(child) if reverse else self._selectivity(child),
+        ))
+
+    @property
+    def index_only(self):
+        """True when the whole predicate is answered from indexes without decrypting anything."""
+        return not self._needs_scan(self.root, len(self.table))
+
+    # ----- Evaluation -----
+    def matching_positions(self, candidates=None):
+        """Return the sorted positions, among candidates (all rows by default), that satisfy the predicate."""
+        if candidates is None:
+            candidates = np.arange(len(self.table), dtype=np.int64)
+        return self._evaluate(self.root, np.asarray(candidates, dtype=np.int64))
+
+    def _evaluate(self, node, candidates):
+        if len(candidates) == 0:
+            return candidates
+        if isinstance(node, _Leaf):
+            if self._uses_index(node, len(candidates)):
+                return np.intersect1d(candidates, self.table.live_positions(node.lookup()), assume_unique=True)
+            return candidates[np.asarray(self.filter(node.column_index, candidates, node.test), dtype=np.intp)]
+        if node.kind == 'NOT':
+            return np.setdiff1d(candidates, self._evaluate(node.children[0], candidates), assume_unique=True)
+        if node.kind == 'AND':
+            for child in self._order(node, len(candidates)):
+                candidates = self._evaluate(child, candidates)
+                if len(candidates) == 0:
+                    break
+            return candidates
+        matched, remaining = [], candidates
+        for child in self._order(node, len(candidates)):
+            hits = self._evaluate(child, remaining)
+            matched.append(hits)
+            remaining = np.setdiff1d(remaining, hits, assume_unique=True)
+            if len(remaining) == 0:
+                break
+        return np.sort(np.concatenate(matched))
+
+    def explain(self):
+        """Describe the plan for a full-table evaluation as nested tuples.
+
+        Leaves read ('index' | 'scan', column, operator, value, estimated rows);
+        AND/OR list their children in evaluation order.
+        """
+        return self._explain(self.root, len(self.table))
+
+    def _explain(self, node, candidate_count):
+        if isinstance(node, _Leaf):
+            access = 'index' if self._uses_index(node, candidate_count) else 'scan'
+            return (access, *node.describe(), round(node.estimate(len(self.table)), 1))
+        if node.kind == 'NOT':
+            return 'NOT', self._explain(node.children[0], candidate_count)
+        steps = []
+        for child in self._order(node, candidate_count):
+            steps.append(self._explain(child, candidate_count))
+            if node.kind == 'AND':
+                candidate_count = max(1, int(candidate_count * self._selectivity(child)))
+        return node.kind, steps
+
+
+def compile_row_filter(predicate, resolve, encode):
+    """Compile a predicate into a function of a row lookup, for filtering already decrypted rows.
+
+    `resolve(column)` maps a column name to a key, and the returned function
+    takes a callable mapping such keys to plaintext values (None for a
+    missing outer-join side, which fails every comparison).
+    """
+    predicate = parse_condition(predicate)
+    if isinstance(predicate, (Compare, In)):
+        key = resolve(predicate.column)
+        if isinstance(predicate, In):
+            values = {encode(value) for value in predicate.values}
+            return lambda row: row(key) in values
+        compare, operand = COMPARISONS[predicate.operator], encode(predicate.value)
+        return lambda row: row(key) is not None and compare(row(key), operand)
+    if isinstance(predicate, Not):
+        term = compile_row_filter(predicate.term, resolve, encode)
+        return lambda row: not term(row)
+    terms = [compile_row_filter(term, resolve, encode) for term in predicate.terms]
+    if isinstance(predicate, And):
+        return lambda row: all(term(row) for term in terms)
+    return lambda row: any(term(row) for term in terms)
@@ -0,0 +1,110 @@
+import bisect
+import heapq
+
+
+class SortedIndex:
+    """Multi-valued secondary index mapping column values to row ids, ordered by value.
+
+    Row ids are stable identifiers assigned by ColumnarTable, so entries stay
+    valid when other rows are deleted and the table is compacted.
+    """
+
+    OPERATORS = ('=', '<', '<=', '>', '>=')
+
+    def __init__(self):
+        self.keys = []      # Distinct values, sorted
+        self.postings = {}  # value -> ascending list of row ids
+        self.values = {}    # row id -> value, used to unlink a row on update/delete
+
+    @classmethod
+    def from_pairs(cls, values, row_ids):
+        """Bulk-build an index from parallel sequences of values and row ids."""
+        index = cls()
+        for value, row_id in sorted(zip(values, row_ids)):
+            postings = index.postings.get(value)
+            if postings is None:
+                index.keys.append(value)
+                postings = index.postings[value] = []
+            postings.append(row_id)
+            index.values[row_id] = value
+        return index
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, row_id):
+        postings = self.postings.get(value)
+        if postings is None:
+            bisect.insort(self.keys, value)
+            postings = self.postings[value] = []
+        if not postings or postings[-1] < row_id:
+            postings.append(row_id)
+        else:
+            bisect.insort(postings, row_id)
+        self.values[row_id] = value
+
+    def add_many(self, values, row_ids):
+        """Add a batch of rows whose ids are all larger than every indexed row id."""
+        new_keys = []
+        for value, row_id in zip(values, row_ids):
+            postings = self.postings.get(value)
+            if postings is None:
+                new_keys.append(value)
+                postings = self.postings[value] = []
+            postings.append(row_id)
+            self.values[row_id] = value
+        if new_keys:
+            # One linear merge per batch instead of an insort per new key
+            self.keys = list(heapq.merge(self.keys, sorted(new_keys)))
+
+    def remove(self, row_id):
+        if row_id not in self.values:
+            return
+        value = self.values.pop(row_id)
+        postings = self.postings[value]
+        del postings[bisect.bisect_left(postings, row_id)]
+        if not postings:
+            del self.postings[value]
+            del self.keys[bisect.bisect_left(self.keys, value)]
+
+    def lookup(self, operator, value):
+        """Return the ascending row ids whose value satisfies `<column> <operator> value`."""
+        if operator == '=':
+            return list(self.postings.get(value, ()))
+        if operator == '<':
+            keys = self.keys[:bisect.bisect_left(self.keys, value)]
+        elif operator == '<=':
+            keys = self.keys[:bisect.bisect_right(self.keys, value)]
+        elif operator == '>':
+            keys = self.keys[bisect.bisect_right(self.keys, value):]
+        elif operator == '>=':
+            keys = self.keys[bisect.bisect_left(self.keys, value):]
+        else:
+            raise ValueError(f"Unsupported index operator '{operator}'.")
+        row_ids = [row_id for key in keys for row_id in self.postings[key]]
+        row_ids.sort()
+        return row_ids
+
+    def estimate(self, operator, value):
+        """Estimate how many rows lookup(operator, value) would return, in O(log n)."""
+        if operator == '=':
+            return len(self.postings.get(value, ()))
+        if operator == '<':
+            key_count = bisect.bisect_left(self.keys, value)
+        elif operator == '<=':
+            key_count = bisect.bisect_right(self.keys, value)
+        elif operator == '>':
+            key_count = len(self.keys) - bisect.bisect_right(self.keys, value)
+        elif operator == '>=':
+            key_count = len(self.keys) - bisect.bisect_left(self.keys, value)
+        else:
+            raise ValueError(f"Unsupported index operator '{operator}'.")
+        # Assume rows are spread evenly over the distinct values
+        return key_count * len(self.values) / max(len(self.keys), 1)
+
+    def copy(self):
+        index = SortedIndex()
+        index.keys = list(self.keys)
+        index.postings = {value: list(row_ids) for value, row_ids in self.postings.items()}
+        index.values = dict(self.values)
+        return index
@@ -0,0 +1,219 @@
+"""Asyncio network front-end sharing one ZKDatabase between many clients.
+
+Wire protocol: every message is a 4-byte big-endian length followed by a
+UTF-8 JSON object. Conditions travel as nested lists, e.g.
+``["AND", ["age", ">", 30], ["name", "IN", ["Alice"]]]``.
+
+- The first request on a connection must be ``{"op": "hello", "role": ...}``
+  (plus ``"token"`` when the server was given tokens). It binds the
+  connection to a role from USER_ROLES, and every later request is
+  permission-checked against that role.
+- Requests are ``{"id": n, "op": ..., "args": {...}}``. Responses are
+  ``{"id": n, "ok": true, "result": ...}`` or ``{"id": n, "ok": false,
+  "error": {"type": ..., "message": ...}}``. They may arrive out of order.
+- Clients may pipeline: reads from one connection run concurrently, and
+  a write waits for that connection's earlier requests and holds back its
+  later ones, so each connection observes its own writes.
+
+Database work runs on a bounded thread pool, under a readers-writer lock:
+reads proceed in parallel and writes run alone. Each connection has at most
+max_inflight requests in progress; beyond that the server stops reading
+from its socket, so TCP flow control pushes back on the client.
+"""
+import asyncio
+import json
+import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.zk_database import USER_ROLES
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 64 << 20
+
+READ_OPS = ('select', 'aggregate', 'join', 'explain')
+WRITE_OPS = ('create_table', 'create_index', 'insert', 'insert_many', 'update', 'delete')
+
+
+async def read_frame(reader):
+    """Read one length-prefixed JSON message, or return None at end of stream."""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    length, = _HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit.")
+    return json.loads(await reader.readexactly(length))
+
+
+def encode_frame(message):
+    body = json.dumps(message, default=_json_default).encode('utf-8')
+    return _HEADER.pack(len(body)) + body
+
+
+def _json_default(value):
+    if hasattr(value, 'tolist'):  # NumPy scalars and arrays
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class _ReadWriteLock:
+    """Many readers or one writer; waiting writers block new readers so they are not starved."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+
+class ZKServer:
+    """Serves a ZKDatabase over TCP or a Unix socket.
+
+    With `tokens` (a {token: role} dict), clients authenticate with a token
+    and get the role it maps to. Without tokens, clients choose their role,
+    which only suits trusted networks or permission-restricted Unix sockets.
+    """
+
+    def __init__(self, db, workers=4, max_inflight=32, tokens=None):
+        self.db = db
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zkserver')
+        self.lock = _ReadWriteLock()
+        self.max_inflight = max_inflight
+        self.tokens = tokens
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """Start listening on host:port, or on the Unix socket at path; returns the asyncio server."""
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._serve_connection, path=path)
+        else:
+            self.server = await asyncio.start_server(self._serve_connection, host, port)
+        logger.info("Serving on %s", path or self.server.sockets[0].getsockname())
+        return self.server
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        self.pool.shutdown()
+
+    # ----- Connections -----
+    async def _serve_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+        inflight = asyncio.Semaphore(self.max_inflight)
+        pending = set()
+        try:
+            db = await self._handshake(reader, writer)
+            if db is None:
+                return
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                op = request.get('op')
+                if op in WRITE_OPS:
+                    # A write is a barrier: it sees every earlier request of this connection and precedes later ones
+                    if pending:
+                        await asyncio.wait(pending)
+                    await self._handle(db, request, writer, write_lock)
+                    continue
+                await inflight.acquire()  # Blocks reading further requests while max_inflight are running
+                task = asyncio.create_task(self._handle(db, request, writer, write_lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                task.add_done_callback(lambda _: inflight.release())
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError, ValueError) as error:
+            logger.warning("Closing connection: %s", error)
+        finally:
+            writer.close()
+
+    async def _handshake(self, reader, writer):
+        """Bind the connection to a role; returns the role-bound database view, or None if refused."""
+        hello = await read_frame(reader)
+        if hello is None:
+            return None
+        role, error = hello.get('role'), None
+        if hello.get('op') != 'hello':
+            error = "The first request must be 'hello'."
+        elif self.tokens is not None:
+            role = self.tokens.get(hello.get('token'))
+            if role is None:
+                error = "Invalid token."
+        if error is None and role not in USER_ROLES:
+            error = f"Unknown role '{role}'."
+        if error is not None:
+            writer.write(encode_frame({'id': hello.get('id'), 'ok': False,
+                                       'error': {'type': 'PermissionError', 'message': error}}))
+            await writer.drain()
+            return None
+        writer.write(encode_frame({'id': hello.get('id'), 'ok': True, 'result': {'role': role}}))
+        await writer.drain()
+        return self.db.with_role(role)
+
+    async def _handle(self, db, request, writer, write_lock):
+        op = request.get('op')
+        try:
+            if op not in READ_OPS and op not in WRITE_OPS:
+                raise ValueError(f"Unsupported operation '{op}'.")
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.pool, self._execute, db, op, request.get('args', {}))
+            response = {'id': request.get('id'), 'ok': True, 'result': result}
+        except Exception as error:
+            response = {'id': request.get('id'), 'ok': False,
+                        'error': {'type': type(error).__name__, 'message': str(error)}}
+        async with write_lock:
+            if writer.is_closing():
+                return  # The client went away; nobody is waiting for this response
+            writer.write(encode_frame(response))
+            try:
+                await writer.drain()  # Waits while the client is not reading its responses
+            except ConnectionError:
+                pass
+
+    def _execute(self, db, op, args):
+        """Run one operation on a worker thread, holding the read or write side of the lock."""
+        write = op in WRITE_OPS
+        self.lock.acquire_write() if write else self.lock.acquire_read()
+        try:
+            result = getattr(db, op)(**args)
+        finally:
+            self.lock.release_write() if write else self.lock.release_read()
+        if isinstance(result, dict):  # Grouped aggregates; JSON objects would turn the keys into strings
+            return {'groups': [[key, value] for key, value in result.items()]}
+        return result
@@ -1,5 +1,6 @@
 import hashlib
 import os
+from src.merkle_tree import MerkleTree, verify_membership
 
 class ZKProof:
     def __init__(self):
@@ -9,9 +10,26 @@ class ZKProof:
         return hashlib.sha256(str(x).encode('utf-8') + self.salt).hexdigest()
 
     def generate_proof(self, data, condition=None):
-        self.v = self._hash(data)
         condition_proof = self._hash(condition) if condition else None
-        return self.v, condition_proof
+        return self._hash(data), condition_proof
+
+    def generate_proofs(self, data_items):
+        """Proofs for many values at once, equal to generate_proof(data)[0] for each."""
+        salt = self.salt
+        return [hashlib.sha256(str(data).encode('utf-8') + salt).hexdigest() for data in data_items]
 
     def verify(self, proof, condition_proof, data, condition=None):
         return self._hash(data) == proof and (not condition or self._hash(condition) == condition_proof)
+
+    # ----- Batch Proofs -----
+    def commit(self, proofs):
+        """Commit to a whole result set with one Merkle tree; its root stands for every row."""
+        return MerkleTree.from_proofs(proofs)
+
+    def verify_batch(self, root, data_items):
+        """Check a complete result set against its root with a single comparison."""
+        return MerkleTree.from_proofs(self.generate_proofs(data_items)).root == root
+
+    def verify_membership(self, root, proof, path):
+        """Check that one row proof belongs to a committed result set, in O(log n) hashes."""
+        return verify_membership(root, proof, path)
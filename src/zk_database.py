@@ -1,253 +1,1096 @@
-import hashlib
+import copy
+import csv
+import functools
+import itertools
+import logging
 import os
-import random
+import threading
+import numpy as np
+from src.audit import AuditLog
 from src.homomorphic_encryption import HomomorphicEncryption
+from src.key_rotation import KeyRotation
 from src.zero_knowledge_proof import ZKProof
-from src.utils import str_to_int, int_to_str
+from src.columnar_storage import ColumnarTable, EncryptedColumn
+from src.secondary_index import SortedIndex
+from src.profiling import profiled
+from src.query_cache import QueryCache
+from src.parallel_executor import ParallelExecutor
+from src.join_engine import JoinEngine, JOIN_TYPES
+from src.merkle_tree import MerkleTree, EMPTY_LEAF, leaf_hash
+from src.persistence import DiskStore, LazyIndexes, encode_batch, decode_batch
+from src.query_planner import QueryPlan, compile_row_filter, conjuncts, parse_condition, predicate_columns
+from src.utils import str_to_int
+
+logger = logging.getLogger(__name__)
 
 # User roles for Role-Based Access Control (RBAC)
 USER_ROLES = {
-    'admin': ['select', 'insert', 'update', 'delete'],
+    'admin': ['select', 'insert', 'update', 'delete', 'schema'],
     'read_only': ['select'],
     'write_only': ['insert'],
     'read_write': ['select', 'insert', 'update'],
 }
 
+def _exclusive(method):
+    """Run a method that changes stored data under the write lock, which key rotation also takes.
+
+    While another role view has a transaction open, the method waits for it
+    to end, so that changes reach the write-ahead log in the order they were
+    applied and no rollback undoes another view's work.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock:
+            while self.open_transactions and self not in self.open_transactions:
+                owner = next(iter(self.open_transactions))
+                if owner.transaction_thread == threading.get_ident():
+                    raise RuntimeError("Another view of this database has a transaction open on this thread.")
+                self.transaction_ended.wait()
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _parse_csv_field(field):
+    try:
+        return int(field)
+    except ValueError:
+        return field
+
+
 class ZKDatabase:
-    def __init__(self, user_role='admin'):
-        self.he = HomomorphicEncryption(lwe_dimension=512)
+    def __init__(self, user_role='admin', cache_size=128, workers=1, parallel_mode='thread', path=None,
+                 secret_key=None, proof_salt=None, persist_keys=False, persist_indexes=False, fsync=False,
+                 audit=None, audit_level=logging.INFO, profiler=None):
+        """Open an in-memory database, or a persistent one stored in the directory `path`.
+
+        Each database has its own key (see rotate_key), freshly generated
+        unless secret_key is given as a SecretKey, a list of key words or a
+        list of SecretKeys. A persistent database must be reopened with the
+        keys it was written with: pass secret_key (and proof_salt, to keep
+        verifying old proofs), or set persist_keys=True to store both next
+        to the data. Indexes hold plaintext and are rebuilt on open unless
+        persist_indexes is set.
+
+        Operations are audited through `audit` (an AuditLog); by default a
+        persistent database appends its audit trail to audit.jsonl in `path`.
+
+        Passing a src.profiling.Profiler times every public operation and
+        encryption call and counts decryptions and cache hits per operation.
+        """
+        self.profiler = profiler
+        self.he = HomomorphicEncryption(lwe_dimension=512, profiler=profiler, key=secret_key)
+        self.executor = ParallelExecutor(self.he, workers=workers, mode=parallel_mode)
+        self.join_engine = JoinEngine()
         self.zk_proof = ZKProof()
         self.tables = {}
         self.indexes = {}
         self.role = user_role
-        self.transaction_log = []  # For transaction rollback
-        self.cache = {}  # Caching for queries
-        self.logs = []  # Logs of operations
+        self.transaction_log = []  # Undo records for transaction rollback
+        self.savepoints = []  # (name, undo log position, WAL buffer position) per open transaction/savepoint
+        self.open_transactions = set()  # Role views (and self) with an open transaction; shared with every view
+        self.cache = QueryCache(max_entries=cache_size)  # LRU cache for query results
+        self.write_lock = threading.RLock()  # Held by writers and by key rotation while it swaps a column
+        self.transaction_ended = threading.Condition(self.write_lock)  # Wakes writers of other role views
+        self.transaction_thread = None  # Thread that opened this instance's transaction
+        self.rotation = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)  # Before the audit trail opens its file in it
+        self.persist_indexes = persist_indexes
+        self.persist_keys = persist_keys
+        self.pending_wal = []  # WAL records of the open transaction, written on the outermost commit
+        self.store = None
+        if path is not None:
+            self._open_store(path, secret_key, proof_salt, fsync)
+        elif proof_salt is not None:
+            self.zk_proof.salt = proof_salt
+        if audit is None:
+            # Keyed with the proof salt, so that digests match across restarts only for holders of the salt
+            audit = AuditLog(os.path.join(path, 'audit.jsonl') if path is not None else None, level=audit_level,
+                             key=self.zk_proof.salt)
+        self.audit = audit
+
+    # ----- Persistence -----
+    def _open_store(self, path, secret_key, proof_salt, fsync):
+        """Map the last checkpoint of a store into memory and replay its write-ahead log."""
+        self.store = DiskStore(path, fsync=fsync)
+        stored_keys = self.store.load_key_material()
+        if stored_keys is not None:
+            if secret_key is None:
+                self.he.keys = {key.epoch: key for key in stored_keys[0]}
+            proof_salt = stored_keys[1] if proof_salt is None else proof_salt
+        if proof_salt is not None:
+            self.zk_proof.salt = proof_salt
+        if self.persist_keys:
+            self.store.save_key_material(self.he.keys.values(), self.zk_proof.salt)
+        for record in self.store.load(self, self.he.keys):
+            self._replay(record)
+
+    # ----- Key Management -----
+    def rotate_key(self, key=None, chunk_rows=4096, background=True):
+        """Re-encrypt every column under a new key (a fresh one by default) and return the KeyRotation.
+
+        New writes use the new key at once. Columns are re-encrypted chunk
+        by chunk, in the background by default; queries keep running, and
+        each column switches over atomically when it is done. The old key
+        is dropped once no column needs it; a persistent database stores
+        the new key first when it persists keys, and checkpoints at the end.
+        """
+        with self.write_lock:
+            if self.rotation is not None and not self.rotation.done.is_set():
+                raise RuntimeError("A key rotation is already running.")
+            if self.open_transactions and not background:
+                raise RuntimeError("Cannot rotate keys synchronously while a transaction is open.")
+            key = self.he.add_key(key)
+            if self.store is not None and self.persist_keys:
+                self.store.save_key_material(self.he.keys.values(), self.zk_proof.salt)
+            self.rotation = KeyRotation(self, key.epoch, chunk_rows)
+        logger.info("Rotating to the key of epoch %d", key.epoch)
+        if background:
+            return self.rotation.start()
+        self.rotation.run()
+        return self.rotation
+
+    def _apply_rotate(self, table_name, column_index, epoch, batch):
+        """Replace a column with its re-encryption under the key of `epoch`."""
+        if epoch not in self.he.keys:
+            raise ValueError(f"Opening this database requires the key of epoch {epoch}.")
+        table = self.tables[table_name]['data']
+        seeds, bodies = batch
+        table.data[column_index] = EncryptedColumn.from_arrays(self.he.lwe_dimension, self.he.expand_masks,
+                                                               seeds, bodies, epoch=epoch)
+
+    def _drop_unused_keys(self):
+        """Forget keys that no column is encrypted under any more."""
+        used = {column.epoch for info in self.tables.values() for column in info['data'].data}
+        for epoch in [epoch for epoch in self.he.keys if epoch not in used and epoch != self.he.key.epoch]:
+            self.he.drop_key(epoch)
+        if self.store is not None and self.persist_keys:
+            self.store.save_key_material(self.he.keys.values(), self.zk_proof.salt)
+
+    @profiled('checkpoint', operation=True)
+    @_exclusive
+    def checkpoint(self):
+        """Write all tables to a new on-disk checkpoint and truncate the write-ahead log."""
+        if self.store is None:
+            raise RuntimeError("checkpoint() requires a database opened with a path.")
+        if self.open_transactions:
+            raise RuntimeError("Cannot checkpoint while a transaction is open.")
+        self.store.checkpoint(self, self.he.keys, self.persist_indexes)
+        logger.info("Checkpoint written to %s", self.store.path)
+
+    def _write_wal(self, record):
+        """Log a change for crash recovery; inside a transaction it waits for the outermost commit."""
+        if self.store is None:
+            return
+        if self.savepoints:
+            self.pending_wal.append(record)
+        else:
+            self.store.append([record])
+
+    def _replay(self, record):
+        """Re-apply one write-ahead log record while opening a store."""
+        op = record['op']
+        if op == 'create_table':
+            self._apply_create_table(record['table'], record['columns'], record.get('epoch', 0))
+        elif op == 'create_index':
+            self.indexes[record['table']][record['column']] = self._build_index(record['table'], record['column'])
+        elif op == 'drop_index':
+            self.indexes[record['table']].pop(record['column'], None)
+        elif op == 'insert':
+            self._apply_insert(record['table'], [decode_batch(batch) for batch in record['columns']],
+                               record['proofs'], record['row_ids'])
+        elif op == 'update':
+            self._apply_update(record['table'], record['column'], record['row_ids'], decode_batch(record['batch']))
+        elif op == 'delete':
+            self._apply_delete(record['table'], record['row_ids'])
+        elif op == 'rotate':
+            self._apply_rotate(record['table'], record['column'], record['epoch'], decode_batch(record['batch']))
 
     # ----- Caching Functionality -----
-    def cache_query(self, query, result):
-        """Cache the result of a query."""
-        query_hash = hashlib.sha256(query.encode()).hexdigest()
-        self.cache[query_hash] = result
+    def cache_query(self, key, result, versions=None):
+        """Cache the result of a query under a key built by QueryCache.make_key.
+
+        `versions` are the cache's table versions from before the query ran
+        (see QueryCache.table_versions); the result is dropped if a write
+        landed meanwhile.
+        """
+        self.cache.put(key, result, versions)
+
+    def get_cached_query(self, key):
+        """Retrieve a cached result, or QueryCache.MISS if absent or stale."""
+        result = self.cache.get(key)
+        if self.profiler is not None:
+            self.profiler.count('cache_misses' if result is QueryCache.MISS else 'cache_hits')
+        return result
 
-    def get_cached_query(self, query):
-        """Retrieve cached result if available."""
-        query_hash = hashlib.sha256(query.encode()).hexdigest()
-        return self.cache.get(query_hash)
+    def cache_stats(self):
+        """Return hit/miss/eviction/invalidation counters of the query cache."""
+        return self.cache.stats()
+
+    def close(self):
+        """Stop a running key rotation, release the worker pool, checkpoint and flush the audit trail."""
+        if self.rotation is not None:
+            self.rotation.cancel()
+        self.executor.close()
+        if self.store is not None:
+            if not self.open_transactions:
+                self.checkpoint()
+            self.store.close()
+            self.store = None
+        self.audit.close()
 
     # ----- Role-Based Access Control -----
+    def with_role(self, role):
+        """Return a view of this database that runs operations under another role.
+
+        The view shares tables, indexes, cache, storage and audit trail with
+        this instance, but has its own role, used for permission checks and
+        audit entries, and its own transaction state. Only one view has a
+        transaction open at a time: writes from the others wait for it.
+        """
+        if role not in USER_ROLES:
+            raise ValueError(f"Unknown role '{role}'.")
+        view = copy.copy(self)
+        view.role = role
+        view.transaction_log, view.savepoints, view.pending_wal = [], [], []
+        view.transaction_thread = None
+        return view
+
     def check_permission(self, operation):
         """ Check if the user role has the permission for the operation """
         if operation not in USER_ROLES[self.role]:
             raise PermissionError(f"Role '{self.role}' does not have permission for '{operation}' operation.")
 
     # ----- Transaction Management -----
-    def begin_transaction(self):
-        """Start a transaction by capturing a snapshot of the current state."""
-        snapshot = {
-            'tables': {k: v.copy() for k, v in self.tables.items()},
-            'indexes': {k: v.copy() for k, v in self.indexes.items()}
-        }
-        self.transaction_log.append(snapshot)
-        print("Transaction started.")
-
-    def rollback(self):
-        """Rollback to the last saved state (undo last transaction)."""
-        if self.transaction_log:
-            last_snapshot = self.transaction_log.pop()
-            self.tables = last_snapshot['tables']
-            self.indexes = last_snapshot['indexes']
-            print("Transaction rolled back.")
-        else:
-            print("No transaction to rollback.")
+    # Writers append undo records to transaction_log while a transaction is
+    # open, holding only the rows they touched. Savepoints mark positions in
+    # that log: rolling back undoes the records after the innermost (or named)
+    # savepoint, and committing a nested savepoint keeps its records so that
+    # the enclosing transaction can still undo them. The write-ahead log is
+    # redo-only, so its records are buffered alongside and reach disk on the
+    # outermost commit.
+    @profiled('begin_transaction', operation=True)
+    @_exclusive
+    def begin_transaction(self, name=None):
+        """Start a transaction, or a nested savepoint if one is already open."""
+        if not self.savepoints:
+            self.transaction_thread = threading.get_ident()
+            self.open_transactions.add(self)
+        self.savepoints.append((name, len(self.transaction_log), len(self.pending_wal)))
+        logger.debug("Transaction started.")
 
-    def commit(self):
-        """Commit the transaction by clearing the transaction log."""
-        self.transaction_log.clear()
-        print("Transaction committed.")
+    @profiled('rollback', operation=True)
+    @_exclusive
+    def rollback(self, name=None):
+        """Undo every change since the innermost savepoint (or the named one) and close it."""
+        if not self.savepoints or (name is not None and name not in [n for n, _, _ in self.savepoints]):
+            logger.warning("No transaction to rollback.")
+            return
+        savepoint_name, mark, wal_mark = self.savepoints.pop()
+        while name is not None and savepoint_name != name:
+            savepoint_name, mark, wal_mark = self.savepoints.pop()
+        while len(self.transaction_log) > mark:
+            self._undo(self.transaction_log.pop())
+        del self.pending_wal[wal_mark:]
+        if not self.savepoints:
+            self._end_transaction()
+        logger.debug("Transaction rolled back.")
+
+    @profiled('commit', operation=True)
+    @_exclusive
+    def commit(self, name=None):
+        """Release the innermost savepoint (or the named one); the outermost commit discards the undo log."""
+        if not self.savepoints or (name is not None and name not in [n for n, _, _ in self.savepoints]):
+            logger.warning("No transaction to commit.")
+            return
+        savepoint_name, _, _ = self.savepoints.pop()
+        while name is not None and savepoint_name != name:
+            savepoint_name, _, _ = self.savepoints.pop()
+        if not self.savepoints:
+            self.transaction_log.clear()
+            if self.store is not None:
+                self.store.append(self.pending_wal)
+            self.pending_wal.clear()
+            self._end_transaction()
+        logger.debug("Transaction committed.")
+
+    def _end_transaction(self):
+        self.open_transactions.discard(self)
+        self.transaction_thread = None
+        self.transaction_ended.notify_all()
+
+    def _record_undo(self, *record):
+        if self.savepoints:
+            self.transaction_log.append(record)
+
+    def _undo(self, record):
+        """Apply one undo record, restoring the rows and index entries it captured."""
+        kind, table_name = record[0], record[1]
+        if kind == 'create_table':
+            previous = record[2]
+            if previous is None:
+                self.tables.pop(table_name, None)
+                self.indexes.pop(table_name, None)
+            else:
+                self.tables[table_name], self.indexes[table_name] = previous
+            self.cache.invalidate(table_name)
+            return
+        if kind == 'index':
+            _, _, column_name, previous = record
+            if previous is None:
+                self.indexes[table_name].pop(column_name, None)
+            else:
+                self.indexes[table_name][column_name] = previous
+            return
+        table = self.tables[table_name]['data']
+        indexes = dict(self._maintained_indexes(table_name))
+        if kind == 'insert':
+            row_ids = record[2]
+            for index in indexes.values():
+                for row_id in row_ids:
+                    index.remove(row_id)
+            table.delete_rows(table.positions(row_ids))
+            self.tables[table_name]['commitment'].update(dict.fromkeys(row_ids, EMPTY_LEAF))
+        elif kind == 'update':
+            _, _, column_index, row_ids, old_batch, old_values = record
+            table.update_column(column_index, table.positions(row_ids), old_batch)
+            index = indexes.get(table.columns[column_index])
+            if index is not None and old_values is None:
+                self._rebuild_index_later(table_name, table.columns[column_index])
+            elif index is not None:
+                for row_id, value in zip(row_ids, old_values):
+                    index.remove(row_id)
+                    index.add(value, row_id)
+        elif kind == 'delete':
+            _, _, row_ids, column_batches, proofs, old_values = record
+            table.restore_rows(row_ids, column_batches, proofs)
+            self.tables[table_name]['commitment'].update(
+                {row_id: leaf_hash(proof) for row_id, proof in zip(row_ids, proofs)})
+            for column_name, index in indexes.items():
+                if column_name not in old_values:
+                    self._rebuild_index_later(table_name, column_name)
+                    continue
+                for row_id, value in zip(row_ids, old_values[column_name]):
+                    index.add(value, row_id)
+        self.cache.invalidate(table_name)
 
     # ----- Logging and Auditing -----
-    def log_operation(self, operation, table_name, data=None, condition=None):
-        """Log database operations with encrypted data for auditing purposes."""
-        log_entry = {
-            'operation': operation,
-            'table': table_name,
-            'data': hashlib.sha256(str(data).encode()).hexdigest() if data else None,
-            'condition': condition,
-            'user_role': self.role
-        }
-        self.logs.append(log_entry)
-        print(f"Logged operation: {operation} on {table_name}")
+    def log_operation(self, operation, table_name, data=None, condition=None, rows=None):
+        """Log database operations with hashed data for auditing purposes."""
+        self.audit.record(operation, table_name, self.role, data=data, condition=condition, rows=rows)
 
-    def view_logs(self):
-        """View logged operations."""
-        for log in self.logs:
-            print(log)
+    @property
+    def logs(self):
+        """The most recent audit entries, oldest first (bounded by the audit ring buffer)."""
+        return self.audit.entries
+
+    def view_logs(self, limit=None):
+        """Return the most recent audit entries, at most `limit` of them."""
+        entries = list(self.audit.entries)
+        return entries if limit is None else entries[-limit:]
 
     # ----- Core Operations -----
+    @profiled('create_table', operation=True)
+    @_exclusive
     def create_table(self, table_name, columns):
-        self.tables[table_name] = {'columns': columns, 'rows': []}
-        self.indexes[table_name] = {}
+        self.check_permission('schema')
+        previous = (self.tables[table_name], self.indexes[table_name]) if table_name in self.tables else None
+        self._record_undo('create_table', table_name, previous)
+        self._apply_create_table(table_name, columns, self.he.key.epoch)
+        self._write_wal({'op': 'create_table', 'table': table_name, 'columns': list(columns),
+                         'epoch': self.he.key.epoch})
         self.log_operation('create_table', table_name)
-        print(f"Table {table_name} created with columns: {columns}")
+        logger.info("Table %s created with columns: %s", table_name, columns)
+
+    def _apply_create_table(self, table_name, columns, epoch):
+        self.tables[table_name] = {
+            'columns': columns,
+            'data': ColumnarTable(columns, self.he.lwe_dimension, self.he.expand_masks, epoch),
+            'commitment': MerkleTree(),  # Merkle tree over row proofs, one leaf per row id
+        }
+        self.indexes[table_name] = {column: SortedIndex() for column in columns}
+        self.cache.invalidate(table_name)
+
+    @profiled('create_index', operation=True)
+    @_exclusive
+    def create_index(self, table_name, column_name):
+        """Build a secondary index on a column by decrypting it once."""
+        self.check_permission('schema')
+        if self.savepoints:
+            self._record_undo('index', table_name, column_name, self.indexes[table_name].get(column_name))
+        self.indexes[table_name][column_name] = self._build_index(table_name, column_name)
+        self._write_wal({'op': 'create_index', 'table': table_name, 'column': column_name})
+        logger.info("Index created on %s.%s", table_name, column_name)
+
+    @profiled('drop_index', operation=True)
+    @_exclusive
+    def drop_index(self, table_name, column_name):
+        """Drop a column's secondary index; queries on it fall back to scanning."""
+        self.check_permission('schema')
+        if self.savepoints:
+            self._record_undo('index', table_name, column_name, self.indexes[table_name].get(column_name))
+        self.indexes[table_name].pop(column_name, None)
+        self._write_wal({'op': 'drop_index', 'table': table_name, 'column': column_name})
+        logger.info("Index dropped on %s.%s", table_name, column_name)
 
+    @profiled('insert', operation=True)
+    @_exclusive
     def insert(self, table_name, values):
         self.check_permission('insert')
         if table_name not in self.tables:
-            print("Table not found.")
+            logger.warning("Table %s not found.", table_name)
             return
-        converted_values = [str_to_int(value) if isinstance(value, str) else value for value in values]
-        encrypted_values = [self.he.encrypt(value) for value in converted_values]
+        converted_values = [self._encode_value(value) for value in values]
+        table = self.tables[table_name]['data']
+        column_batches = self._encrypt_columns(table, [[value] for value in converted_values])
         name_field = values[0]
         proof, _ = self.zk_proof.generate_proof(name_field)
-        self.tables[table_name]['rows'].append((encrypted_values, proof))
-        for i, val in enumerate(values):
-            col_name = self.tables[table_name]['columns'][i]
-            if col_name not in self.indexes[table_name]:
-                self.indexes[table_name][col_name] = {}
-            self.indexes[table_name][col_name][val] = len(self.tables[table_name]['rows']) - 1
+        row_ids = self._apply_insert(table_name, column_batches, [proof], rows=[converted_values])
+        self._record_undo('insert', table_name, row_ids)
+        self._write_wal({'op': 'insert', 'table': table_name, 'row_ids': row_ids,
+                         'columns': [encode_batch(batch) for batch in column_batches], 'proofs': [proof]})
         self.log_operation('insert', table_name, data=values)
-        print(f"Inserted: {values} into {table_name} (Encrypted)")
+        logger.debug("Inserted 1 row into %s (Encrypted)", table_name)
 
-    def select(self, table_name, condition=None):
+    def _apply_insert(self, table_name, column_batches, proofs, row_ids=None, rows=None):
+        """Append encrypted rows and index them; without plaintext rows the indexed columns are decrypted."""
+        table = self.tables[table_name]['data']
+        start = len(table)
+        indexes = self._maintained_indexes(table_name)  # Loads persisted indexes before the rows change
+        row_ids = table.append_rows(column_batches, proofs, row_ids)
+        self.tables[table_name]['commitment'].update(
+            {row_id: leaf_hash(proof) for row_id, proof in zip(row_ids, proofs)})
+        for column_name, index in indexes:
+            column_index = table.column_index(column_name)
+            if rows is not None:
+                values = [row[column_index] for row in rows]
+            else:
+                values = self._decrypt_column(table, column_index, np.arange(start, len(table)))
+            index.add_many(values, row_ids)
+        self.cache.invalidate(table_name)
+        return row_ids
+
+    @profiled('insert_many', operation=True)
+    @_exclusive
+    def insert_many(self, table_name, rows, batch_size=10000):
+        """Insert an iterable of rows, batch_size rows at a time; returns the number inserted.
+
+        Each batch is encrypted in one vectorised call, gets its proofs in bulk,
+        updates every index once and writes a single log entry, so per-row
+        overhead stays small. Rows are consumed lazily, so generators and
+        readers of arbitrary size can be streamed in.
+
+        Each batch is atomic, not the whole call: when a batch fails (e.g. a
+        row of the wrong length), none of its rows are kept, the batches
+        before it stay inserted, and the error is re-raised with an
+        `inserted` attribute holding their row count. Open a transaction
+        around the call to undo those as well.
+        """
+        self.check_permission('insert')
+        if table_name not in self.tables:
+            logger.warning("Table %s not found.", table_name)
+            return 0
+        table = self.tables[table_name]['data']
+        rows = iter(rows)
+        inserted = 0
+        try:
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    return inserted
+                self.begin_transaction()
+                try:
+                    self._insert_batch(table_name, table, batch)
+                except Exception:
+                    self.rollback()
+                    raise
+                self.commit()
+                inserted += len(batch)
+        except Exception as error:
+            error.inserted = inserted
+            raise
+
+    def _insert_batch(self, table_name, table, batch):
+        for row in batch:
+            if len(row) != len(table.columns):
+                raise ValueError(f"Expected {len(table.columns)} values per row, got {len(row)}.")
+        converted_rows = [[self._encode_value(value) for value in row] for row in batch]
+        column_batches = self._encrypt_columns(
+            table, [[row[i] for row in converted_rows] for i in range(len(table.columns))])
+        proofs = self.zk_proof.generate_proofs([row[0] for row in batch])
+        row_ids = self._apply_insert(table_name, column_batches, proofs, rows=converted_rows)
+        self._record_undo('insert', table_name, row_ids)
+        self._write_wal({'op': 'insert', 'table': table_name, 'row_ids': row_ids,
+                         'columns': [encode_batch(column_batch) for column_batch in column_batches],
+                         'proofs': proofs})
+        self.log_operation('insert_many', table_name, data=proofs, rows=len(batch))
+        logger.debug("Inserted %d rows into %s (Encrypted)", len(batch), table_name)
+
+    @profiled('load_csv', operation=True)
+    def load_csv(self, table_name, source, batch_size=10000, header=True, delimiter=','):
+        """Stream rows from a CSV file path or file object into a table with insert_many.
+
+        With a header row, fields are matched to table columns by name.
+        Integer fields are stored as integers, anything else as a string.
+        """
+        if isinstance(source, str):
+            with open(source, newline='') as f:
+                return self.load_csv(table_name, f, batch_size, header, delimiter)
+        reader = csv.reader(source, delimiter=delimiter)
+        order = None
+        if header:
+            fields = next(reader, [])
+            if table_name in self.tables:
+                order = [fields.index(column) for column in self.tables[table_name]['columns']]
+        rows = ([_parse_csv_field(row[i]) for i in order] if order is not None
+                else [_parse_csv_field(field) for field in row] for row in reader if row)
+        return self.insert_many(table_name, rows, batch_size)
+
+    @profiled('select', operation=True)
+    def select(self, table_name, condition=None, columns=None):
+        """Select rows matching the condition, decrypting only the projected columns."""
         self.check_permission('select')
-        cached_result = self.get_cached_query(str(condition))
-        if cached_result:
-            print("Returning cached result.")
+        cache_key = self.cache.make_key('SELECT', [table_name], condition, columns)
+        cached_result = self.get_cached_query(cache_key)
+        if cached_result is not QueryCache.MISS:
+            logger.debug("Returning cached result.")
             return cached_result
+        versions = self.cache.table_versions(cache_key)
 
         if table_name not in self.tables:
-            print("Table not found.")
+            logger.warning("Table %s not found.", table_name)
             return []
 
-        selected_rows = []
-        
-        for row, proof in self.tables[table_name]['rows']:
-            decrypted_row = [self.he.decrypt(value) for value in row]
-            if condition:
-                column_name, operator, value = condition
-                column_index = self.tables[table_name]['columns'].index(column_name)
-                row_value = decrypted_row[column_index]
-                if self._evaluate_condition(row_value, operator, value):
-                    selected_rows.append((decrypted_row, proof))
-
-        self.cache_query(str(condition), selected_rows)
+        selected_rows = list(self._select_rows(table_name, condition, columns))
+        self.cache_query(cache_key, selected_rows, versions)
         self.log_operation('select', table_name, condition=condition)
         return selected_rows
 
-    def update(self, table_name, condition, update_values):
-        """Update rows based on the condition"""
+    def iter_select(self, table_name, condition=None, columns=None, batch_size=None, limit=None):
+        """Stream the rows of a select as they are decrypted.
+
+        Yields (row, proof) pairs, or lists of up to batch_size pairs, and stops
+        after `limit` rows. Rows past the point where the caller stops iterating
+        are never decrypted. Results are not cached.
+        """
+        self.check_permission('select')
+        if table_name not in self.tables:
+            logger.warning("Table %s not found.", table_name)
+            return iter(())
+        self.log_operation('select', table_name, condition=condition)
+        return self._batched(self._select_rows(table_name, condition, columns, limit), batch_size)
+
+    @profiled('update', operation=True)
+    @_exclusive
+    def update(self, table_name, condition, update_values, columns=None):
+        """Update rows based on the condition.
+
+        Returns the updated rows projected onto `columns` (post-update values);
+        with the default of no columns nothing is decrypted beyond the predicate.
+        """
         self.check_permission('update')
         self.begin_transaction()
-
-        for row, proof in self.tables[table_name]['rows']:
-            decrypted_row = [self.he.decrypt(value) for value in row]
-            column_name, operator, value = condition
-            column_index = self.tables[table_name]['columns'].index(column_name)
-            row_value = decrypted_row[column_index]
-            if self._evaluate_condition(row_value, operator, value):
-                for update_col, new_value in update_values.items():
-                    update_index = self.tables[table_name]['columns'].index(update_col)
-                    encrypted_new_value = self.he.encrypt(new_value)
-                    row[update_index] = encrypted_new_value
-                self.log_operation('update', table_name, data=update_values)
-                print(f"Row updated: {decrypted_row}")
+        try:
+            updated_rows = self._update_rows(table_name, condition, update_values, columns)
+        except Exception:
+            self.rollback()
+            raise
         self.commit()
+        return updated_rows
+
+    def _update_rows(self, table_name, condition, update_values, columns):
+        table = self.tables[table_name]['data']
+        positions = self._matching_positions(table_name, condition)
+        row_ids = table.live_row_ids()[positions].tolist()
+
+        self.log_operation('update', table_name, data=update_values, condition=condition, rows=len(positions))
+        logger.debug("Rows updated in %s: %d", table_name, len(positions))
+        for update_col, new_value in update_values.items():
+            new_value = self._encode_value(new_value)
+            column_index = table.column_index(update_col)
+            index = dict(self._maintained_indexes(table_name)).get(update_col)
+            old_values = [index.values[row_id] for row_id in row_ids] if index is not None else None
+            self._record_undo('update', table_name, column_index, row_ids,
+                              table.column_batch(column_index, positions), old_values)
+            encrypted_new_values = self.he.encrypt_many([new_value] * len(positions), compact=True,
+                                                        epoch=table.data[column_index].epoch)
+            self._apply_update(table_name, column_index, row_ids, encrypted_new_values, [new_value] * len(row_ids))
+            self._write_wal({'op': 'update', 'table': table_name, 'column': column_index, 'row_ids': row_ids,
+                             'batch': encode_batch(encrypted_new_values)})
+
+        projection = self._projection(table_name, columns or [])
+        decrypted_rows = self._decrypt_rows(table_name, positions, [
+            i for i in projection if table.columns[i] not in update_values
+        ])
+        updated_rows = []
+        for position, decrypted_values in zip(positions, decrypted_rows):
+            decrypted_values = iter(decrypted_values)
+            updated_row = [
+                self._encode_value(update_values[table.columns[i]]) if table.columns[i] in update_values
+                else next(decrypted_values) for i in projection
+            ]
+            updated_rows.append((updated_row, table.proofs[position]))
+        return updated_rows
+
+    def _apply_update(self, table_name, column_index, row_ids, batch, values=None):
+        """Overwrite one column of the given rows and re-index them; values are decrypted when not given."""
+        table = self.tables[table_name]['data']
+        table.update_column(column_index, table.positions(row_ids), batch)
+        index = dict(self._maintained_indexes(table_name)).get(table.columns[column_index])
+        if index is not None:
+            if values is None:
+                values = self.executor.decrypt_many(batch, table.data[column_index].epoch)
+            for row_id, value in zip(row_ids, values):
+                index.remove(row_id)
+                index.add(value, row_id)
+        self.cache.invalidate(table_name)
 
+    @profiled('delete', operation=True)
+    @_exclusive
     def delete(self, table_name, condition):
         """Delete rows based on the condition"""
         self.check_permission('delete')
         self.begin_transaction()
+        try:
+            self._delete_rows(table_name, condition)
+        except Exception:
+            self.rollback()
+            raise
+        self.commit()
 
-        column_name, operator, value = condition
-        column_index = self.tables[table_name]['columns'].index(column_name)
+    def _delete_rows(self, table_name, condition):
+        table = self.tables[table_name]['data']
+        positions = self._matching_positions(table_name, condition)
+        row_ids = table.live_row_ids()[positions].tolist()
+        self._record_undo(
+            'delete', table_name, row_ids,
+            [table.column_batch(i, positions) for i in range(len(table.columns))],
+            [table.proofs[position] for position in positions],
+            {
+                column: [index.values[row_id] for row_id in row_ids]
+                for column, index in self._maintained_indexes(table_name)
+            },
+        )
+        self._apply_delete(table_name, row_ids)
+        self._write_wal({'op': 'delete', 'table': table_name, 'row_ids': row_ids})
 
-        self.tables[table_name]['rows'] = [
-            (row, proof) for row, proof in self.tables[table_name]['rows']
-            if not self._evaluate_condition(self.he.decrypt(row[column_index]), operator, value)
-        ]
+        self.log_operation('delete', table_name, condition=condition, rows=len(row_ids))
+        logger.debug("Rows matching condition %s deleted from %s", condition, table_name)
 
-        self.log_operation('delete', table_name, condition=condition)
-        print(f"Rows matching condition {condition} deleted from {table_name}")
-        self.commit()
+    def _apply_delete(self, table_name, row_ids):
+        table = self.tables[table_name]['data']
+        for _, index in self._maintained_indexes(table_name):
+            for row_id in row_ids:
+                index.remove(row_id)
+        table.delete_rows(table.positions(row_ids))
+        self.tables[table_name]['commitment'].update(dict.fromkeys(row_ids, EMPTY_LEAF))
+        self.cache.invalidate(table_name)
 
-    def aggregate_sum(self, table_name, column_name):
+    @profiled('aggregate', operation=True)
+    def aggregate(self, table_name, column_name, function='SUM', condition=None, group_by=None):
+        """Compute SUM, COUNT or AVG of a column, optionally filtered and grouped.
+
+        Ciphertexts are added homomorphically and decrypted once per aggregate
+        (once per addition budget for very large inputs), never per row.
+        With group_by, returns a dict mapping each value of that indexed
+        column to its aggregate.
+        """
         self.check_permission('select')
-        cached_result = self.get_cached_query(f"SUM-{table_name}-{column_name}")
-        if cached_result:
-            print("Returning cached result.")
+        function = function.upper()
+        if function not in ('SUM', 'COUNT', 'AVG'):
+            raise ValueError(f"Unsupported aggregate function '{function}'.")
+        cache_key = self.cache.make_key(function, [table_name], column_name, condition, group_by)
+        cached_result = self.get_cached_query(cache_key)
+        if cached_result is not QueryCache.MISS:
+            logger.debug("Returning cached result.")
             return cached_result
+        versions = self.cache.table_versions(cache_key)
+
+        if table_name not in self.tables:
+            logger.warning("Table %s not found.", table_name)
+            return None
+        table = self.tables[table_name]['data']
+        positions = self._matching_positions(table_name, condition) if condition else None
+
+        if group_by is None:
+            result = self._aggregate(table_name, column_name, function, positions)
+        else:
+            index = self.indexes[table_name].get(group_by)
+            if index is None:
+                raise ValueError(f"GROUP BY requires an index on {table_name}.{group_by}.")
+            allowed = None if positions is None else set(positions)
+            result = {}
+            for key in index.keys:
+                group_positions = table.positions(index.postings[key]).tolist()
+                if allowed is not None:
+                    group_positions = [position for position in group_positions if position in allowed]
+                if group_positions:
+                    result[key] = self._aggregate(table_name, column_name, function, group_positions)
 
-        result = self._aggregate(table_name, column_name, 'SUM')
-        self.cache_query(f"SUM-{table_name}-{column_name}", result)
-        self.log_operation('aggregate_sum', table_name)
+        self.cache_query(cache_key, result, versions)
+        self.log_operation(f'aggregate_{function.lower()}', table_name, condition=condition)
         return result
 
-    def join(self, table1, table2, table1_column, table2_column, join_type="inner"):
+    def aggregate_sum(self, table_name, column_name, condition=None, group_by=None):
+        return self.aggregate(table_name, column_name, 'SUM', condition, group_by)
+
+    def aggregate_count(self, table_name, column_name, condition=None, group_by=None):
+        return self.aggregate(table_name, column_name, 'COUNT', condition, group_by)
+
+    def aggregate_avg(self, table_name, column_name, condition=None, group_by=None):
+        return self.aggregate(table_name, column_name, 'AVG', condition, group_by)
+
+    def _aggregate(self, table_name, column_name, function, positions=None):
+        """Aggregate one column over the given row positions (all rows when None)."""
+        table = self.tables[table_name]['data']
+        count = len(table) if positions is None else len(positions)
+        if function == 'COUNT':
+            return count
+        if count == 0:
+            return 0 if function == 'SUM' else None
+        column = table.data[table.column_index(column_name)]
+        total = self.executor.decrypt_sum(column.batch(positions), column.epoch)
+        return total if function == 'SUM' else total / count
+
+    @profiled('join', operation=True)
+    def join(self, table1, table2, table1_column, table2_column, join_type="inner", columns=None, condition=None):
+        """Join two tables on equal column values.
+
+        `columns` projects the joined rows, and `condition` filters them. In
+        both, names may be qualified as "table.column"; bare names are
+        resolved against table1 first. Conjuncts of the condition that read
+        one table are pushed down and filter that input before the join,
+        unless it is the null-supplying side of an outer join.
+        """
         self.check_permission('select')
-        cached_result = self.get_cached_query(f"JOIN-{table1}-{table2}-{join_type}")
-        if cached_result:
-            print("Returning cached result.")
+        cache_key = self.cache.make_key('JOIN', [table1, table2], table1_column, table2_column, join_type, columns,
+                                        condition)
+        cached_result = self.get_cached_query(cache_key)
+        if cached_result is not QueryCache.MISS:
+            logger.debug("Returning cached result.")
             return cached_result
+        versions = self.cache.table_versions(cache_key)
 
+        if join_type not in JOIN_TYPES:
+            raise ValueError(f"Unsupported join type '{join_type}'.")
         if table1 not in self.tables or table2 not in self.tables:
-            print("One of the tables not found.")
+            logger.warning("One of the tables %s, %s not found.", table1, table2)
             return []
-        table1_data = self.tables[table1]
-        table2_data = self.tables[table2]
-        col1_idx = table1_data['columns'].index(table1_column)
-        col2_idx = table2_data['columns'].index(table2_column)
-        joined_rows = []
-        indexed_table1 = self.indexes[table1].get(table1_column, {})
-        indexed_table2 = self.indexes[table2].get(table2_column, {})
-
-        if join_type == "inner":
-            common_keys = indexed_table1.keys() & indexed_table2.keys()
-        elif join_type == "left":
-            common_keys = indexed_table1.keys()
-        elif join_type == "right":
-            common_keys = indexed_table2.keys()
-        elif join_type == "outer":
-            common_keys = indexed_table1.keys() | indexed_table2.keys()
-
-        for key in common_keys:
-            row1, row2 = None, None
-            proof1, proof2 = None, None
-
-            if key in indexed_table1:
-                row1, proof1 = table1_data['rows'][indexed_table1[key]]
-                decrypted_row1 = [self.he.decrypt(val) for val in row1]
-            else:
-                decrypted_row1 = [None] * len(table1_data['columns'])
+        joined_rows = list(self._join_rows(table1, table2, table1_column, table2_column, join_type, columns,
+                                           condition=condition))
+        self.cache_query(cache_key, joined_rows, versions)
+        self.log_operation('join', f"{table1}-{table2}", condition=condition)
+        return joined_rows
 
-            if key in indexed_table2:
-                row2, proof2 = table2_data['rows'][indexed_table2[key]]
-                decrypted_row2 = [self.he.decrypt(val) for val in row2]
-            else:
-                decrypted_row2 = [None] * len(table2_data['columns'])
+    def iter_join(self, table1, table2, table1_column, table2_column, join_type="inner", columns=None,
+                  batch_size=None, limit=None, condition=None):
+        """Stream the rows of a join as they are decrypted (see iter_select)."""
+        self.check_permission('select')
+        if join_type not in JOIN_TYPES:
+            raise ValueError(f"Unsupported join type '{join_type}'.")
+        if table1 not in self.tables or table2 not in self.tables:
+            logger.warning("One of the tables %s, %s not found.", table1, table2)
+            return iter(())
+        self.log_operation('join', f"{table1}-{table2}", condition=condition)
+        rows = self._join_rows(table1, table2, table1_column, table2_column, join_type, columns, limit, condition)
+        return self._batched(rows, batch_size)
+
+    # ----- Batch Proofs -----
+    def table_commitment(self, table_name):
+        """Merkle root over the proofs of every row in the table, kept up to date on insert and delete."""
+        return self.tables[table_name]['commitment'].root
+
+    def prove_row(self, table_name, row_id):
+        """Return (row proof, membership path) showing that a row is committed to by table_commitment."""
+        table = self.tables[table_name]['data']
+        position = int(table.positions([row_id])[0])
+        if position >= len(table) or table.live_row_ids()[position] != row_id:
+            raise KeyError(f"Row {row_id} not found in {table_name}.")
+        return table.proofs[position], self.tables[table_name]['commitment'].prove(row_id)
+
+    def commit_results(self, results):
+        """Commit to the (row, proof) pairs of a query with one Merkle tree.
+
+        The tree's root stands for the whole result; tree.prove(i) gives the
+        membership path of the i-th row, checked with ZKProof.verify_membership.
+        """
+        return self.zk_proof.commit([proof for _, proof in results])
 
-            decrypted_joined_row = decrypted_row1 + decrypted_row2
-            proof, _ = self.zk_proof.generate_proof(decrypted_joined_row)
-            joined_rows.append((decrypted_joined_row, proof))
+    # ----- Cursors -----
+    def _cursor_chunk_rows(self):
+        """Rows decrypted per cursor step: one chunk for every scan worker."""
+        return self.executor.chunk_rows * max(1, self.executor.workers)
 
-            if self.zk_proof.verify(proof, None, decrypted_joined_row):
-                print(f"Proof verified for joined row: {decrypted_joined_row}")
+    def _batched(self, rows, batch_size):
+        if batch_size is None:
+            return rows
+        return self._batches(rows, batch_size)
+
+    def _batches(self, rows, batch_size):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _iter_matching_row_ids(self, table_name, condition):
+        """Yield chunks of ids of rows satisfying the condition, in row order."""
+        table = self.tables[table_name]['data']
+        chunk_rows = self._cursor_chunk_rows()
+        plan = self._query_plan(table_name, condition) if condition else None
+        if plan is not None and plan.index_only:
+            row_ids = table.live_row_ids()[plan.matching_positions()].tolist()
+            for start in range(0, len(row_ids), chunk_rows):
+                yield row_ids[start:start + chunk_rows]
+            return
+        next_row_id = 0
+        while True:
+            live_row_ids = table.live_row_ids()
+            start = int(np.searchsorted(live_row_ids, next_row_id))
+            if start >= len(live_row_ids):
+                return
+            positions = np.arange(start, min(start + chunk_rows, len(live_row_ids)))
+            # Resume by row id, since rows deleted between chunks shift the positions of the rest
+            next_row_id = int(live_row_ids[positions[-1]]) + 1
+            if plan is not None:
+                positions = plan.matching_positions(positions)
+            yield live_row_ids[positions].tolist()
+
+    def _select_rows(self, table_name, condition, columns, limit=None):
+        """Generate (row, proof) pairs, decrypting the projection one chunk at a time."""
+        table = self.tables[table_name]['data']
+        projection = self._projection(table_name, columns)
+        remaining = limit
+        for row_ids in self._iter_matching_row_ids(table_name, condition):
+            if remaining is not None:
+                row_ids = row_ids[:remaining]
+            # Rows deleted since their ids were read are skipped
+            positions = table.live_positions(row_ids).tolist()
+            for position, row in zip(positions, self._decrypt_rows(table_name, positions, projection)):
+                yield row, table.proofs[position]
+            if remaining is not None:
+                remaining -= len(positions)
+                if remaining <= 0:
+                    return
+
+    def plan_join(self, table1, table2, table1_column, table2_column):
+        """Return the (strategy, build_side) the join planner picks for these inputs."""
+        return self.join_engine.plan(
+            len(self.tables[table1]['data']), len(self.tables[table2]['data']),
+            table1_column in self.indexes[table1], table2_column in self.indexes[table2],
+        )
+
+    def _join_keys(self, table_name, column_name, ordered, positions=None):
+        """Generate (key, row_id) pairs for a join input, optionally restricted to some row positions.
+
+        Indexed columns yield their keys in sorted order without decrypting
+        anything; otherwise only the join column is decrypted, chunk by chunk.
+        """
+        table = self.tables[table_name]['data']
+        index = self.indexes[table_name].get(column_name)
+        if index is not None:
+            allowed = None if positions is None else set(table.live_row_ids()[positions].tolist())
+            for key in index.keys:
+                for row_id in index.postings[key]:
+                    if allowed is None or row_id in allowed:
+                        yield key, row_id
+            return
+        if positions is None:
+            positions = np.arange(len(table))
+        column_index = table.column_index(column_name)
+        chunk_rows = self._cursor_chunk_rows()
+        pairs = []
+        for start in range(0, len(positions), chunk_rows):
+            chunk = positions[start:start + chunk_rows]
+            keys = self._decrypt_column(table, column_index, chunk)
+            pairs.extend(zip(keys, table.live_row_ids()[chunk].tolist()))
+            if not ordered:
+                yield from pairs
+                pairs = []
+        yield from sorted(pairs)
+
+    def _split_join_condition(self, table1, table2, join_type, condition):
+        """Split a join condition into (table1 filter, table2 filter, residual filter on joined rows)."""
+        pushed1, pushed2, residual = [], [], []
+        for term in conjuncts(parse_condition(condition)):
+            sides = {self._resolve_join_column(table1, table2, column)[0] for column in predicate_columns(term)}
+            # Filtering the null-supplying side of an outer join early would keep rows the filter should drop
+            if sides == {0} and join_type in ('inner', 'left'):
+                pushed1.append(term)
+            elif sides == {1} and join_type in ('inner', 'right'):
+                pushed2.append(term)
             else:
-                print(f"Proof failed for joined row: {decrypted_joined_row}")
+                residual.append(term)
+        combine = lambda terms: None if not terms else terms[0] if len(terms) == 1 else ('AND', *terms)
+        return combine(pushed1), combine(pushed2), combine(residual)
 
-        self.cache_query(f"JOIN-{table1}-{table2}-{join_type}", joined_rows)
-        self.log_operation('join', f"{table1}-{table2}")
-        return joined_rows
+    def _join_pairs(self, table1, table2, table1_column, table2_column, join_type, condition1=None, condition2=None):
+        """Generate matching (row id, row id) pairs; None marks a missing side."""
+        positions1 = np.asarray(self._matching_positions(table1, condition1), dtype=np.intp) if condition1 else None
+        positions2 = np.asarray(self._matching_positions(table2, condition2), dtype=np.intp) if condition2 else None
+        strategy, build_side = self.join_engine.plan(
+            len(self.tables[table1]['data']) if positions1 is None else len(positions1),
+            len(self.tables[table2]['data']) if positions2 is None else len(positions2),
+            table1_column in self.indexes[table1], table2_column in self.indexes[table2],
+        )
+        keys1 = self._join_keys(table1, table1_column, strategy == 'merge', positions1)
+        keys2 = self._join_keys(table2, table2_column, strategy == 'merge', positions2)
+        if strategy == 'merge':
+            return self.join_engine.merge_join(keys1, keys2, join_type)
+        if build_side == 'left':
+            return self.join_engine.hash_join(keys1, keys2, join_type, build_side)
+        return self.join_engine.hash_join(keys2, keys1, join_type, build_side)
+
+    def _join_rows(self, table1, table2, table1_column, table2_column, join_type, columns, limit=None, condition=None):
+        """Generate joined (row, proof) pairs, decrypting matched rows one chunk of pairs at a time."""
+        projection1, projection2 = self._join_projection(table1, table2, columns)
+        condition1, condition2, residual = (None, None, None) if condition is None else \
+            self._split_join_condition(table1, table2, join_type, condition)
+        pairs = self._join_pairs(table1, table2, table1_column, table2_column, join_type, condition1, condition2)
+        row_filter = None
+        read1, read2 = list(projection1), list(projection2)
+        if residual is not None:
+            resolve = lambda column: self._resolve_join_column(table1, table2, column)
+            row_filter = compile_row_filter(residual, resolve, self._encode_value)
+            for side, column_index in map(resolve, predicate_columns(parse_condition(residual))):
+                read = read1 if side == 0 else read2
+                if column_index not in read:
+                    read.append(column_index)
+        offsets = ({column_index: k for k, column_index in enumerate(read1)},
+                   {column_index: k for k, column_index in enumerate(read2)})
+        chunk_rows = self._cursor_chunk_rows()
+        produced = 0
+        while limit is None or produced < limit:
+            chunk_size = chunk_rows if limit is None else min(chunk_rows, limit - produced)
+            chunk = list(itertools.islice(pairs, chunk_size))
+            if not chunk:
+                return
+            # Decrypt each matched row's columns once per chunk, however many pairs it appears in
+            decrypted1 = self._decrypt_row_map(table1, [row_id1 for row_id1, _ in chunk], read1)
+            decrypted2 = self._decrypt_row_map(table2, [row_id2 for _, row_id2 in chunk], read2)
+
+            joined_rows = []
+            for row_id1, row_id2 in chunk:
+                rows = (decrypted1.get(row_id1), decrypted2.get(row_id2))
+                if row_filter is not None and not row_filter(
+                        lambda key: None if rows[key[0]] is None else rows[key[0]][offsets[key[0]][key[1]]]):
+                    continue
+                joined_rows.append(
+                    [None if rows[0] is None else rows[0][offsets[0][i]] for i in projection1] +
+                    [None if rows[1] is None else rows[1][offsets[1][i]] for i in projection2])
+            if limit is not None:
+                joined_rows = joined_rows[:limit - produced]
+            # A proof is a salted hash of the row it was just computed from, so re-verifying it here would add nothing
+            yield from zip(joined_rows, self.zk_proof.generate_proofs(joined_rows))
+            produced += len(joined_rows)
+
+    # ----- Projection -----
+    def _projection(self, table_name, columns):
+        """Resolve projected column names to indices (all columns when None)."""
+        table_columns = self.tables[table_name]['columns']
+        if columns is None:
+            return list(range(len(table_columns)))
+        return [table_columns.index(column) for column in columns]
+
+    def _join_projection(self, table1, table2, columns):
+        """Split a join projection into per-table column indices."""
+        if columns is None:
+            return self._projection(table1, None), self._projection(table2, None)
+        projection1, projection2 = [], []
+        for column in columns:
+            side, column_index = self._resolve_join_column(table1, table2, column)
+            (projection1 if side == 0 else projection2).append(column_index)
+        return projection1, projection2
 
-    def _evaluate_condition(self, row_value, operator, value):
-        if operator == '=':
-            return row_value == value
-        elif operator == '>':
-            return row_value > value
-        elif operator == '<':
-            return row_value < value
-        elif operator == '>=':
-            return row_value >= value
-        elif operator == '<=':
-            return row_value <= value
-        return False
\ No newline at end of file
+    def _resolve_join_column(self, table1, table2, column):
+        """Resolve a possibly qualified column name to (0 for table1 or 1 for table2, column index)."""
+        table_name, _, column_name = column.rpartition('.')
+        for side, candidate in enumerate((table1, table2)):
+            if table_name in (candidate, '') and column_name in self.tables[candidate]['columns']:
+                return side, self.tables[candidate]['columns'].index(column_name)
+        raise ValueError(f"Column '{column}' not found in {table1} or {table2}.")
+
+    def _encrypt_columns(self, table, column_values):
+        """Encrypt one list of plaintexts per column under that column's key, in one call per key epoch."""
+        batches = [None] * len(column_values)
+        by_epoch = {}
+        for i, column in enumerate(table.data):
+            by_epoch.setdefault(column.epoch, []).append(i)
+        for epoch, column_indices in by_epoch.items():
+            seeds, bodies = self.he.encrypt_many([value for i in column_indices for value in column_values[i]],
+                                                 compact=True, epoch=epoch)
+            start = 0
+            for i in column_indices:
+                end = start + len(column_values[i])
+                batches[i] = (seeds[start:end], bodies[start:end])
+                start = end
+        return batches
+
+    def _decrypt_column(self, table, column_index, positions=None):
+        """Decrypt one column at the given positions (all rows by default)."""
+        column = table.data[column_index]  # Read once: key rotation may swap in a re-encrypted column
+        return self.executor.decrypt_many(column.batch(positions), column.epoch)
+
+    def _filter_column(self, table, column_index, positions, test):
+        """Return the offsets within positions whose plaintext in one column passes test."""
+        column = table.data[column_index]
+        return self.executor.filter(column.batch(positions), test, column.epoch)
+
+    def _decrypt_rows(self, table_name, positions, column_indices):
+        """Decrypt the given columns of the rows at `positions`, one batch per column."""
+        table = self.tables[table_name]['data']
+        decrypted_columns = [self._decrypt_column(table, i, positions) for i in column_indices]
+        if not decrypted_columns:
+            return [[] for _ in positions]
+        return [list(row) for row in zip(*decrypted_columns)]
+
+    def _decrypt_row_map(self, table_name, row_ids, column_indices):
+        """Decrypt each distinct, non-None row id once and map it to its projected row."""
+        unique_row_ids = sorted({row_id for row_id in row_ids if row_id is not None})
+        positions = self.tables[table_name]['data'].positions(unique_row_ids)
+        return dict(zip(unique_row_ids, self._decrypt_rows(table_name, positions, column_indices)))
+
+    # ----- Index-Assisted Filtering -----
+    def _maintained_indexes(self, table_name):
+        """(column, index) pairs a write to the table must update; see LazyIndexes.maintained."""
+        indexes = self.indexes[table_name]
+        return indexes.maintained() if isinstance(indexes, LazyIndexes) else list(indexes.items())
+
+    def _rebuild_index_later(self, table_name, column_name):
+        """Replace an index that an undo cannot restore, because it was built after the undo record."""
+        loader = functools.partial(self._build_index, table_name, column_name)
+        indexes = self.indexes[table_name]
+        if isinstance(indexes, LazyIndexes):
+            indexes.defer(column_name, loader)
+        else:
+            indexes[column_name] = loader()
+
+    def _build_index(self, table_name, column_name):
+        """Decrypt a column once and bulk-load it into a new SortedIndex."""
+        table = self.tables[table_name]['data']
+        values = self._decrypt_column(table, table.column_index(column_name))
+        return SortedIndex.from_pairs(values, table.live_row_ids().tolist())
+
+    def _encode_value(self, value):
+        """Encode a plaintext value the same way insert does before encryption."""
+        return str_to_int(value) if isinstance(value, str) else value
+
+    def _query_plan(self, table_name, condition):
+        """Compile a condition against a table once, for index lookups and partial scans."""
+        table = self.tables[table_name]['data']
+        return QueryPlan(condition, table, self.indexes[table_name], self._encode_value,
+                         lambda column_index, positions, test: self._filter_column(table, column_index, positions,
+                                                                                   test))
+
+    def _matching_positions(self, table_name, condition):
+        """Return the positions of rows satisfying the condition, decrypting as few cells as the planner can."""
+        return self._query_plan(table_name, condition).matching_positions().tolist()
+
+    @profiled('explain', operation=True)
+    def explain(self, table_name, condition):
+        """Return the access path and evaluation order the planner picks for a condition."""
+        self.check_permission('select')
+        return self._query_plan(table_name, condition).explain()
@@ -0,0 +1,84 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from src.audit import AuditLog
+
+
+class TestAuditLog(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file = os.path.join(self.path, 'audit.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_ring_buffer_is_bounded(self):
+        """Test if only the most recent entries are kept in memory."""
+        audit = AuditLog(buffer_size=3)
+        for i in range(5):
+            audit.record('insert', f't{i}', 'admin', data=[i])
+        self.assertEqual([entry['table'] for entry in audit.entries], ['t2', 't3', 't4'])
+        self.assertNotEqual(audit.entries[0]['data'], '[2]')  # Data is hashed
+        audit.close()
+
+    def test_digests_are_keyed_and_conditions_redacted(self):
+        """Test if digests depend on the key and conditions keep columns and operators but not values."""
+        audits = [AuditLog(key=b'one'), AuditLog(key=b'one'), AuditLog(key=b'two')]
+        condition = ('AND', ('name', 'IN', ['Alice', 'Bob']), ('NOT', ('balance', '<', 100)))
+        for audit in audits:
+            audit.record('select', 'users', 'admin', data=[1], condition=condition)
+        entries = [audit.entries[0] for audit in audits]
+        self.assertEqual(entries[0], {**entries[1], 'time': entries[0]['time']})
+        self.assertNotEqual(entries[0]['data'], entries[2]['data'])
+        (kind, (column, operator, names), (negation, (_, _, balance))) = entries[0]['condition']
+        self.assertEqual((kind, column, operator, negation), ('AND', 'name', 'IN', 'NOT'))
+        self.assertNotIn('Alice', names)
+        self.assertNotEqual(balance, 100)
+        for audit in audits:
+            audit.close()
+
+    def test_level_filters_entries(self):
+        """Test if entries below the configured level are dropped."""
+        audit = AuditLog(level=logging.WARNING)
+        audit.record('select', 'users', 'admin')
+        self.assertEqual(len(audit.entries), 0)
+        audit.close()
+
+    def test_sink_writes_and_reloads(self):
+        """Test if entries reach the JSONL file and prime the ring buffer of a new log."""
+        audit = AuditLog(self.file, batch_size=2)
+        for i in range(3):
+            audit.record('insert', 'users', 'admin', rows=i)
+        audit.close()
+        reopened = AuditLog(self.file)
+        self.assertEqual([entry['rows'] for entry in reopened.entries], [0, 1, 2])
+        reopened.close()
+
+    def test_sink_flushes_when_idle(self):
+        """Test if a partial batch reaches the file once no more entries are queued."""
+        audit = AuditLog(self.file, batch_size=256)
+        audit.record('insert', 'users', 'admin', rows=1)
+        deadline = time.monotonic() + 5
+        while os.path.getsize(self.file) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(os.path.getsize(self.file), 0)
+        audit.close()
+
+    def test_sink_rotates_by_size(self):
+        """Test if the file is rotated once it would exceed max_bytes."""
+        audit = AuditLog(self.file, max_bytes=400, backup_count=2, batch_size=1)
+        for i in range(20):
+            audit.record('insert', 'users', 'admin', rows=i)
+        audit.close()
+        self.assertTrue(os.path.exists(self.file + '.1'))
+        self.assertTrue(os.path.exists(self.file + '.2'))
+        self.assertFalse(os.path.exists(self.file + '.3'))
+        self.assertLessEqual(os.path.getsize(self.file), 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
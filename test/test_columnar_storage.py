@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from src.columnar_storage import ColumnarTable
+from src.homomorphic_encryption import HomomorphicEncryption
+
+class TestColumnarStorage(unittest.TestCase):
+
+    def setUp(self):
+        """Initialize a two-column table holding five rows."""
+        self.he = HomomorphicEncryption(lwe_dimension=512)
+        self.table = ColumnarTable(["id", "amount"], 512, self.he.expand_masks)
+        self.table.append_rows(
+            [self.he.encrypt_many([1, 2, 3, 4, 5], compact=True), self.he.encrypt_many([10, 20, 30, 40, 50], compact=True)],
+            ["p1", "p2", "p3", "p4", "p5"],
+        )
+
+    def test_column_layout(self):
+        """Test if columns store one 64-bit seed per ciphertext instead of its mask."""
+        seeds, bodies = self.table.column_batch(0)
+        self.assertEqual(seeds.dtype, np.uint64)
+        self.assertEqual(seeds.shape, (5,))
+        self.assertEqual(self.he.decrypt_many((seeds, bodies)), [1, 2, 3, 4, 5])
+        self.assertEqual(self.he.decrypt_many(self.table.row_batch(2)), [3, 30])
+
+    def test_update_and_delete(self):
+        """Test if updates overwrite cells and deletes compact the columns in order."""
+        self.table.update_column(1, [0, 4], self.he.encrypt_many([11, 55], compact=True))
+        self.table.delete_rows([1, 3])
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table.proofs, ["p1", "p3", "p5"])
+        self.assertEqual(self.he.decrypt_many(self.table.column_batch(1)), [11, 30, 55])
+
+    def test_positions(self):
+        """Test if row ids map to positions after deletes, and ids of deleted rows are refused or skipped."""
+        self.table.delete_rows([1, 3])
+        self.assertEqual(self.table.positions([2, 4]).tolist(), [1, 2])
+        for row_ids in ([1], [0, 3], [5]):
+            with self.assertRaises(KeyError):
+                self.table.positions(row_ids)
+        self.assertEqual(self.table.live_positions([0, 1, 2, 4, 5]).tolist(), [0, 1, 2])
+
+    def test_expanded_fallback(self):
+        """Test if expanded ciphertexts survive alongside seeded ones across deletes."""
+        self.table.update_column(1, [3], self.he.encrypt_many([44]))
+        masks, _ = self.table.column_batch(1, [2, 3])
+        self.assertEqual(masks.shape, (2, 512))
+        self.table.delete_rows([0])
+        self.assertEqual(self.he.decrypt_many(self.table.column_batch(1)), [20, 30, 44, 50])
+        self.table.update_column(1, [2], self.he.encrypt_many([45], compact=True))
+        self.assertEqual(self.table.data[1].expanded, {})
+
+    def test_copy_is_independent(self):
+        """Test if a copied table is unaffected by later changes."""
+        snapshot = self.table.copy()
+        self.table.delete_rows([0])
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(self.he.decrypt_many(snapshot.column_batch(0)), [1, 2, 3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
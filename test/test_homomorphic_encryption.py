@@ -0,0 +1,96 @@
+import unittest
+import numpy as np
+from src.homomorphic_encryption import AESCounterStream, HomomorphicEncryption, SecretKey
+from src.utils import str_to_int
+
+class TestHomomorphicEncryption(unittest.TestCase):
+
+    def setUp(self):
+        """Initialize a HomomorphicEncryption instance before each test."""
+        self.he = HomomorphicEncryption(lwe_dimension=512)
+
+    def test_encrypt_decrypt_many(self):
+        """Test if a batch round-trips, including large string-encoded values."""
+        plaintexts = [0, 1, 42, -7, 10 ** 6, str_to_int("Charlie")]
+        masks, bodies = self.he.encrypt_many(plaintexts)
+        self.assertEqual(masks.shape, (len(plaintexts), 512))
+        self.assertEqual(masks.dtype, np.uint32)
+        self.assertEqual(self.he.decrypt_many((masks, bodies)), plaintexts)
+
+    def test_batch_matches_single(self):
+        """Test if batch decryption agrees with the single-value API."""
+        ciphertexts = [self.he.encrypt(value) for value in [3, 5, 8]]
+        self.assertEqual(self.he.decrypt_many(ciphertexts), [3, 5, 8])
+        masks, bodies = self.he.encrypt_many([13, 21])
+        self.assertEqual(self.he.decrypt((masks[1].tolist(), bodies[1])), 21)
+
+    def test_compact_ciphertexts(self):
+        """Test if seeded ciphertexts decrypt and expand to their original masks."""
+        seeds, bodies = self.he.encrypt_many([4, 5, 6], compact=True)
+        self.assertEqual(seeds.dtype, np.uint64)
+        self.assertEqual(self.he.decrypt_many((seeds, bodies)), [4, 5, 6])
+        np.testing.assert_array_equal(self.he.expand_masks(seeds), self.he.expand_masks(seeds.copy()))
+        ciphertext = self.he.encrypt(9, compact=True)
+        self.assertIsInstance(ciphertext[0], int)
+        self.assertEqual(self.he.decrypt(ciphertext), 9)
+        self.assertEqual(len(self.he.add(ciphertext, ciphertext)[0]), 512)
+
+    def test_add_many(self):
+        """Test if batched homomorphic addition sums element-wise."""
+        batch1 = self.he.encrypt_many([1, 2, 3])
+        batch2 = self.he.encrypt_many([10, 20, 30])
+        masks, bodies = self.he.add_many(batch1, batch2)
+        self.assertEqual(masks.dtype, np.uint64)
+        np.testing.assert_array_equal(masks, batch1[0].astype(np.uint64) + batch2[0])
+        self.assertEqual(bodies.tolist(), (batch1[1] + batch2[1]).tolist())
+        self.assertEqual(self.he.decrypt_many((masks, bodies)), [11, 22, 33])
+
+    def test_decrypt_sum(self):
+        """Test if large sums stay correct, including past the addition budget."""
+        plaintexts = list(range(1000, 3000))
+        batch = self.he.encrypt_many(plaintexts, compact=True)
+        self.assertEqual(self.he.decrypt_sum(batch), sum(plaintexts))
+        he = HomomorphicEncryption(lwe_dimension=512, noise_budget_bits=3)
+        batch = he.encrypt_many(plaintexts[:21], compact=True)
+        self.assertEqual(he.decrypt_sum(batch), sum(plaintexts[:21]))
+        mask_sum, body_sum = he.sum_many(batch, chunk_rows=4)
+        self.assertEqual(mask_sum.shape, (512,))
+
+    def test_instances_have_their_own_keys(self):
+        """Test if each instance generates its own key, and a shared key decrypts across instances."""
+        other = HomomorphicEncryption(lwe_dimension=512)
+        batch = self.he.encrypt_many(list(range(20)))
+        self.assertNotEqual(other.decrypt_many(batch), list(range(20)))
+        shared = HomomorphicEncryption(lwe_dimension=512, key=list(self.he.key))
+        self.assertEqual(shared.decrypt_many(batch), list(range(20)))
+        with self.assertRaises(ValueError):
+            HomomorphicEncryption(lwe_dimension=512, key=[1] * 10)
+
+    def test_key_epochs(self):
+        """Test if ciphertexts decrypt under the key of their epoch after a new key is added."""
+        old = self.he.encrypt_many([1, 2, 3], compact=True)
+        key = self.he.add_key()
+        self.assertEqual((key.epoch, self.he.key), (1, key))
+        new = self.he.encrypt_many([4, 5, 6], compact=True)
+        self.assertEqual(self.he.decrypt_many(new), [4, 5, 6])
+        self.assertEqual(self.he.decrypt_many(old, epoch=0), [1, 2, 3])
+        with self.assertRaises(ValueError):
+            self.he.drop_key(1)
+        self.he.drop_key(0)
+        with self.assertRaises(KeyError):
+            self.he.decrypt_many(old, epoch=0)
+        restored = HomomorphicEncryption(lwe_dimension=512, key=[SecretKey(list(key), epoch=1)])
+        self.assertEqual(restored.decrypt_sum(new), 15)
+
+    def test_counter_stream(self):
+        """Test if a keyed stream is reproducible and never repeats a block."""
+        first, second = AESCounterStream(bytes(32)), AESCounterStream(bytes(32))
+        np.testing.assert_array_equal(first.words(10), second.words(10))
+        self.assertFalse(np.array_equal(first.words(4), first.words(4)))
+        values = AESCounterStream().below(1000, 5000)
+        self.assertTrue(all(0 <= value < 1000 for value in values))
+        self.assertEqual(AESCounterStream().uint32((3, 7)).shape, (3, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from src.join_engine import JoinEngine
+
+LEFT = [(1, 'a1'), (2, 'a2'), (2, 'a3'), (5, 'a4')]
+RIGHT = [(2, 'b1'), (2, 'b2'), (3, 'b3'), (5, 'b4')]
+
+EXPECTED = {
+    'inner': {('a2', 'b1'), ('a2', 'b2'), ('a3', 'b1'), ('a3', 'b2'), ('a4', 'b4')},
+}
+EXPECTED['left'] = EXPECTED['inner'] | {('a1', None)}
+EXPECTED['right'] = EXPECTED['inner'] | {(None, 'b3')}
+EXPECTED['outer'] = EXPECTED['left'] | EXPECTED['right']
+
+
+class TestJoinEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = JoinEngine(hash_ratio=4)
+
+    def test_merge_join(self):
+        """Test if the sort-merge join pairs every duplicate key for all join types."""
+        for join_type, expected in EXPECTED.items():
+            pairs = list(self.engine.merge_join(LEFT, RIGHT, join_type))
+            self.assertEqual(len(pairs), len(expected), join_type)
+            self.assertEqual(set(pairs), expected, join_type)
+
+    def test_hash_join(self):
+        """Test if the hash join gives the same pairs whichever side it builds on."""
+        for join_type, expected in EXPECTED.items():
+            for build_side in ('left', 'right'):
+                build, probe = (LEFT, RIGHT) if build_side == 'left' else (RIGHT, LEFT)
+                pairs = list(self.engine.hash_join(build, probe, join_type, build_side))
+                self.assertEqual(len(pairs), len(expected), (join_type, build_side))
+                self.assertEqual(set(pairs), expected, (join_type, build_side))
+
+    def test_plan(self):
+        """Test if the planner merges ordered inputs and hashes the smaller side otherwise."""
+        self.assertEqual(self.engine.plan(100, 120, True, True), ('merge', None))
+        self.assertEqual(self.engine.plan(10, 1000, True, True), ('hash', 'left'))
+        self.assertEqual(self.engine.plan(100, 120, True, False), ('hash', 'left'))
+        self.assertEqual(self.engine.plan(500, 20, False, False), ('hash', 'right'))
+
+
+if __name__ == '__main__':
+    unittest.main()
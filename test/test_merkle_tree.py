@@ -0,0 +1,48 @@
+import hashlib
+import unittest
+from src.merkle_tree import MerkleTree, verify_membership
+
+
+def proof_of(i):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+class TestMerkleTree(unittest.TestCase):
+
+    def setUp(self):
+        """Commit to an odd number of proofs, so some nodes have no sibling."""
+        self.proofs = [proof_of(i) for i in range(11)]
+        self.tree = MerkleTree.from_proofs(self.proofs)
+
+    def test_membership_proofs(self):
+        """Test if every leaf verifies against the root with a logarithmic path."""
+        for slot, proof in enumerate(self.proofs):
+            path = self.tree.prove(slot)
+            self.assertLessEqual(len(path), 4)
+            self.assertTrue(verify_membership(self.tree.root, proof, path))
+        self.assertFalse(verify_membership(self.tree.root, proof_of(99), self.tree.prove(3)))
+        self.assertFalse(verify_membership(self.tree.root, self.proofs[3], self.tree.prove(4)))
+
+    def test_incremental_updates_match_rebuild(self):
+        """Test if appending leaf by leaf gives the same root as committing all at once."""
+        tree = MerkleTree()
+        for slot, proof in enumerate(self.proofs):
+            tree.set(slot, proof)
+        self.assertEqual(tree.root, self.tree.root)
+
+    def test_delete_and_restore(self):
+        """Test if emptying a slot changes the root and refilling it restores the root."""
+        root = self.tree.root
+        self.tree.set(5, None)
+        self.assertNotEqual(self.tree.root, root)
+        self.assertTrue(verify_membership(self.tree.root, self.proofs[6], self.tree.prove(6)))
+        self.tree.set(5, self.proofs[5])
+        self.assertEqual(self.tree.root, root)
+
+    def test_empty_tree(self):
+        """Test if an empty tree still has a well-defined root."""
+        self.assertEqual(MerkleTree().root, MerkleTree.from_proofs([]).root)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from src.homomorphic_encryption import HomomorphicEncryption
+from src.parallel_executor import ParallelExecutor
+from src.query_planner import ValueTest
+from src.zk_database import ZKDatabase
+
+class TestParallelExecutor(unittest.TestCase):
+
+    def setUp(self):
+        """Encrypt a batch spanning several chunks."""
+        self.he = HomomorphicEncryption(lwe_dimension=512)
+        self.plaintexts = list(range(100))
+        self.batch = self.he.encrypt_many(self.plaintexts, compact=True)
+
+    def check_executor(self, executor):
+        try:
+            self.assertEqual(executor.decrypt_many(self.batch), self.plaintexts)
+            self.assertEqual(executor.filter(self.batch, ValueTest('>=', (90,))), list(range(90, 100)))
+            self.assertEqual(executor.decrypt_sum(self.batch), sum(self.plaintexts))
+        finally:
+            executor.close()
+
+    def test_thread_pool(self):
+        """Test if a thread pool merges chunk results in row order."""
+        self.check_executor(ParallelExecutor(self.he, workers=4, mode='thread', chunk_rows=16))
+
+    def test_process_pool(self):
+        """Test if worker processes share the parent's secret key."""
+        self.check_executor(ParallelExecutor(self.he, workers=2, mode='process', chunk_rows=16))
+
+    def test_process_pool_key_epochs(self):
+        """Test if worker processes decrypt each batch under the key of its epoch."""
+        self.he.add_key()
+        batch = self.he.encrypt_many(self.plaintexts, compact=True)
+        executor = ParallelExecutor(self.he, workers=2, mode='process', chunk_rows=16)
+        try:
+            self.assertEqual(executor.decrypt_many(self.batch, epoch=0), self.plaintexts)
+            self.assertEqual(executor.decrypt_sum(batch), sum(self.plaintexts))
+            self.assertEqual(executor.filter(self.batch, ValueTest('IN', (0, 1, 2, 200)), epoch=0), [0, 1, 2])
+        finally:
+            executor.close()
+
+    def test_database_with_workers(self):
+        """Test if ZKDatabase scans give the same answers with a worker pool."""
+        db = ZKDatabase(workers=4)
+        db.executor.chunk_rows = 2
+        db.create_table("t", ["k", "v"])
+        for i in range(10):
+            db.insert("t", [i, i * 10])
+        try:
+            self.assertEqual([row for row, _ in db.select("t", condition=("k", ">=", 7), columns=["v"])],
+                             [[70], [80], [90]])
+            self.assertEqual(db.aggregate_sum("t", "v"), 450)
+        finally:
+            db.close()
+
+    def test_scans_run_on_worker_processes(self):
+        """Test if predicates on unindexed columns are evaluated by the process pool."""
+        db = ZKDatabase(workers=2, parallel_mode='process')
+        db.executor.chunk_rows = 4
+        db.create_table("t", ["k", "v"])
+        db.drop_index("t", "v")
+        db.insert_many("t", [[i, i % 3] for i in range(20)])
+        try:
+            condition = ("OR", ("v", "IN", [2]), ("AND", ("v", "=", 0), ("k", ">", 14)))
+            self.assertEqual([row for row, _ in db.select("t", condition, columns=["k"])],
+                             [[2], [5], [8], [11], [14], [15], [17], [18]])
+            self.assertIsNotNone(db.executor.pool)
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from src.key_rotation import KeyRotation
+from src.zk_database import ZKDatabase
+
+
+class TestPersistence(unittest.TestCase):
+
+    def setUp(self):
+        """Create a persistent database in a temporary directory."""
+        self.path = tempfile.mkdtemp()
+        self.db = ZKDatabase(path=self.path, persist_keys=True)
+        self.key = list(self.db.he.key)
+        self.db.create_table("users", ["user_id", "age"])
+        self.db.insert("users", [1, 30])
+        self.db.insert("users", [2, 25])
+        self.db.insert("users", [3, 35])
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.path)
+
+    def reopen(self, **kwargs):
+        self.db = ZKDatabase(path=self.path, **kwargs)
+
+    def test_reopen_after_checkpoint(self):
+        """Test that tables, indexes and logs survive a clean close."""
+        self.db.insert("users", [4, 20])
+        self.db.delete("users", ("user_id", "=", 4))  # Leaves an empty slot at the end of the Merkle tree
+        root = self.db.table_commitment("users")
+        self.db.close()
+        self.reopen()
+        self.assertEqual(self.db.table_commitment("users"), root)
+        self.assertEqual([row for row, _ in self.db.select("users")], [[1, 30], [2, 25], [3, 35]])
+        self.assertEqual(self.db.indexes["users"]["age"].lookup('>', 26), [0, 2])
+        self.assertEqual(len(self.db.logs), 7)  # Includes the select above
+
+    def test_synced_checkpoint(self):
+        """Test that a store opened with fsync checkpoints, twice over the same WAL position, and reopens."""
+        self.db.close()
+        self.reopen(fsync=True, persist_indexes=True)
+        self.db.checkpoint()
+        self.db.checkpoint()
+        self.db.close()
+        self.reopen()
+        self.assertEqual([row for row, _ in self.db.select("users")], [[1, 30], [2, 25], [3, 35]])
+
+    def test_interleaved_view_transactions(self):
+        """Test if writes from other views wait for an open transaction, keeping the WAL in order."""
+        first, second = self.db.with_role('admin'), self.db.with_role('admin')
+        first.begin_transaction()
+        first.insert("users", [4, 20])
+        with self.assertRaises(RuntimeError):
+            second.insert("users", [5, 50])  # Would wait forever on the thread that holds the transaction
+        writer = threading.Thread(target=second.insert, args=("users", [5, 50]))
+        writer.start()
+        writer.join(timeout=0.2)
+        self.assertTrue(writer.is_alive())
+        first.commit()
+        writer.join(timeout=10)
+        self.assertFalse(writer.is_alive())
+        expected = [[1, 30], [2, 25], [3, 35], [4, 20], [5, 50]]
+        self.assertEqual([row for row, _ in self.db.select("users")], expected)
+        self.db.store.close()
+        self.reopen()
+        self.assertEqual(self.db.tables["users"]["data"].live_row_ids().tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual([row for row, _ in self.db.select("users")], expected)
+
+    def test_open_in_new_directory(self):
+        """Test if a database can be opened in a directory that does not exist yet."""
+        db = ZKDatabase(path=os.path.join(self.path, 'new', 'nested'))
+        db.create_table("t", ["k"])
+        db.close()
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'new', 'nested', 'audit.jsonl')))
+
+    def test_wal_recovery(self):
+        """Test that changes since the last checkpoint are replayed from the write-ahead log."""
+        self.db.checkpoint()
+        self.db.update("users", ("user_id", "=", 2), {"age": 40})
+        self.db.delete("users", ("user_id", "=", 1))
+        self.db.insert("users", [4, 20])
+        root = self.db.table_commitment("users")
+        self.db.store.close()  # Simulate a crash: no checkpoint on the way out
+        self.reopen()
+        self.assertEqual(self.db.table_commitment("users"), root)
+        self.assertEqual([row for row, _ in self.db.select("users")], [[2, 40], [3, 35], [4, 20]])
+        self.assertEqual(self.db.indexes["users"]["age"].lookup('>=', 35), [1, 2])
+        self.db.insert("users", [5, 50])
+        self.assertEqual(self.db.tables["users"]["data"].live_row_ids().tolist(), [1, 2, 3, 4])
+
+    def test_commits_from_role_views(self):
+        """Test if transactions committed through separate role views each reach the WAL once."""
+        first, second = self.db.with_role('admin'), self.db.with_role('admin')
+        first.begin_transaction()
+        first.insert("users", [4, 20])
+        first.commit()
+        second.begin_transaction()
+        second.delete("users", ("user_id", "=", 1))
+        second.commit()
+        self.db.begin_transaction()
+        self.db.delete("users", ("user_id", "=", 3))
+        self.db.commit()
+        expected = [row for row, _ in self.db.select("users")]
+        self.db.store.close()
+        self.reopen()
+        self.assertEqual([row for row, _ in self.db.select("users")], expected)
+        self.assertEqual(expected, [[2, 25], [4, 20]])
+
+    def test_reopen_is_lazy(self):
+        """Test if reopening defers parsing bodies and loading indexes until they are used."""
+        self.db.close()
+        self.reopen()
+        columns, indexes = self.db.tables["users"]["data"].data, self.db.indexes["users"]
+        self.assertTrue(all(column.body_loader is not None for column in columns))
+        self.assertEqual(self.db.select("users", ("age", ">", 26), columns=["age"])[0][0], [30])
+        self.assertIsNotNone(columns[0].body_loader)  # Only the projected column was read
+        self.db.checkpoint()  # Links the untouched files into the new checkpoint
+        self.db.insert("users", [4, 20])
+        self.assertEqual(indexes["user_id"].lookup('>=', 3), [2, 3])
+        self.db.close()
+        self.reopen()
+        self.assertEqual([row for row, _ in self.db.select("users")], [[1, 30], [2, 25], [3, 35], [4, 20]])
+        self.assertEqual(self.db.indexes["users"]["age"].lookup('<', 30), [1, 3])
+
+    def test_writes_leave_unbuilt_indexes_alone(self):
+        """Test if writes and their rollback neither build pending indexes nor leave loaded ones stale."""
+        self.db.close()
+        self.reopen()
+        indexes = self.db.indexes["users"]
+        self.db.insert("users", [4, 20])
+        self.db.update("users", ("user_id", "=", 4), {"user_id": 5})
+        self.db.begin_transaction()
+        self.db.delete("users", ("user_id", "=", 2))
+        self.db.update("users", ("user_id", "=", 1), {"age": 31})
+        self.assertIn("age", indexes.loaders)  # Still to be built
+        self.assertEqual(indexes["age"].lookup('>', 30), [0, 2])  # Built from the rows as they are now
+        self.db.rollback()
+        self.assertEqual(indexes["age"].lookup('>=', 25), [0, 1, 2])
+        self.assertEqual(indexes["age"].lookup('=', 30), [0])
+        self.assertEqual(indexes["user_id"].lookup('>=', 0), [0, 1, 2, 3])
+
+    def test_torn_wal_tail_is_ignored(self):
+        """Test that a partially written WAL record is dropped on recovery."""
+        self.db.store.close()
+        with open(os.path.join(self.path, 'wal.log'), 'a') as f:
+            f.write('{"op": "delete", "table": "us')
+        self.reopen()
+        self.assertEqual(len(self.db.select("users")), 3)
+
+    def test_rolled_back_changes_are_not_logged(self):
+        """Test that only committed transactions reach the write-ahead log."""
+        self.db.begin_transaction()
+        self.db.insert("users", [4, 20])
+        self.db.rollback()
+        self.db.store.close()
+        self.reopen()
+        self.assertEqual(len(self.db.select("users")), 3)
+
+    def test_persisted_indexes(self):
+        """Test that indexes written to disk are loaded without decrypting."""
+        self.db.persist_indexes = True
+        self.db.close()
+        self.reopen()
+        self.assertEqual(self.db.indexes["users"]["user_id"].lookup('<=', 2), [0, 1])
+
+    def test_wrong_key_is_rejected(self):
+        """Test that a store cannot be opened with a different secret key."""
+        self.db.close()
+        os.remove(os.path.join(self.path, 'keys.json'))
+        with self.assertRaises(ValueError):
+            ZKDatabase(path=self.path, secret_key=[7] * 512)
+        self.reopen(secret_key=self.key)
+        self.assertEqual(len(self.db.select("users")), 3)
+
+    def test_older_format_is_rejected(self):
+        """Test that a store without the current mask expansion in its catalog is refused."""
+        self.db.close()
+        with open(os.path.join(self.path, 'CURRENT')) as f:
+            catalog_path = os.path.join(self.path, f.read().strip(), 'catalog.json')
+        with open(catalog_path) as f:
+            catalog = json.load(f)
+        del catalog['mask_expansion']
+        with open(catalog_path, 'w') as f:
+            json.dump(catalog, f)
+        with self.assertRaises(ValueError):
+            self.reopen()
+
+    def test_reopen_after_rotation(self):
+        """Test that a rotated store opens with the new key alone, and no longer with the old one."""
+        self.db.rotate_key(background=False)
+        new_key = self.db.he.key
+        self.assertEqual(sorted(self.db.he.keys), [1])
+        self.db.close()
+        os.remove(os.path.join(self.path, 'keys.json'))
+        with self.assertRaises(ValueError):
+            self.reopen(secret_key=self.key)
+        self.reopen(secret_key=new_key)
+        self.assertEqual([row for row, _ in self.db.select("users")], [[1, 30], [2, 25], [3, 35]])
+
+    def test_rotated_column_is_replayed(self):
+        """Test that a column swapped before a crash is recovered from the write-ahead log."""
+        self.db.checkpoint()
+        rotation = KeyRotation(self.db, self.db.he.add_key().epoch, chunk_rows=2)
+        self.db.store.save_key_material(self.db.he.keys.values(), self.db.zk_proof.salt)
+        rotation._rotate_column("users", self.db.tables["users"], 1)
+        self.db.store.close()
+        self.reopen()
+        self.assertEqual([column.epoch for column in self.db.tables["users"]["data"].data], [0, 1])
+        self.assertEqual([row for row, _ in self.db.select("users")], [[1, 30], [2, 25], [3, 35]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import unittest
+from src.homomorphic_encryption import HomomorphicEncryption
+from src.profiling import Profiler
+from src.zk_database import ZKDatabase
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        """Initialize a profiled database with 100 rows; column 'k' is not indexed."""
+        self.profiler = Profiler()
+        self.db = ZKDatabase(profiler=self.profiler)
+        self.db.create_table("t", ["id", "k"])
+        self.db.drop_index("t", "k")
+        self.db.insert_many("t", [[i, i % 10] for i in range(100)])
+
+    def test_decryptions_per_operation(self):
+        """Test if decryptions are attributed to the operation that caused them."""
+        self.db.select("t", ("id", "<", 5), columns=["k"])  # Index on id, then 5 cells of k
+        self.db.select("t", ("k", "=", 3), columns=[])  # Scans all 100 cells of k
+        self.db.aggregate("t", "k", "SUM")  # One decryption for the whole sum
+        timers = self.profiler.snapshot()['timers']
+        self.assertEqual(timers['select']['calls'], 2)
+        self.assertEqual(timers['select']['counters']['decryptions'], 105)
+        self.assertEqual(timers['select']['per_call']['decryptions'], 52.5)
+        self.assertEqual(timers['aggregate']['counters']['decryptions'], 1)
+        self.assertEqual(timers['he.encrypt_many']['items'], 200)
+
+    def test_cache_counters(self):
+        """Test if cache hits and misses are counted per operation."""
+        self.db.select("t", ("id", "=", 1))
+        self.db.select("t", ("id", "=", 1))
+        snapshot = self.profiler.snapshot()
+        self.assertEqual(snapshot['timers']['select']['counters'], {'cache_misses': 1, 'cache_hits': 1,
+                                                                    'decryptions': 2})
+        self.assertEqual(snapshot['counters']['cache_hits'], 1)
+
+    def test_nested_operations(self):
+        """Test if an operation called by another is timed on its own and counted in both."""
+        self.profiler.reset()  # insert_many in setUp runs its batch in a transaction too
+        self.db.update("t", ("k", "=", 1), {"k": 2})
+        timers = self.profiler.snapshot()['timers']
+        self.assertEqual(timers['update']['counters']['decryptions'], 100)
+        self.assertEqual(timers['begin_transaction']['calls'], 1)
+        self.assertEqual(timers['commit']['calls'], 1)
+
+    def test_dump_and_reset(self):
+        """Test if a snapshot is written as JSON and reset clears it."""
+        path = os.path.join(tempfile.mkdtemp(), 'profile.json')
+        self.profiler.dump(path)
+        with open(path) as file:
+            self.assertIn('insert_many', json.load(file)['timers'])
+        self.profiler.reset()
+        self.assertEqual(self.profiler.snapshot(), {'timers': {}, 'counters': {}})
+
+    def test_disabled_by_default(self):
+        """Test if encryption runs uninstrumented without a profiler."""
+        he = HomomorphicEncryption(lwe_dimension=16)
+        self.assertIsNone(he.profiler)
+        self.assertEqual(he.decrypt(he.encrypt(7)), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from src.query_cache import QueryCache
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        """Initialize a cache holding at most two entries."""
+        self.cache = QueryCache(max_entries=2)
+
+    def test_empty_result_is_a_hit(self):
+        """Test if an empty cached result is returned instead of counting as a miss."""
+        key = self.cache.make_key('SELECT', ['users'], ('age', '>', 99), None)
+        self.cache.put(key, [])
+        self.assertEqual(self.cache.get(key), [])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_lru_eviction(self):
+        """Test if the least recently used entry is evicted first."""
+        keys = [self.cache.make_key('SELECT', ['users'], i) for i in range(3)]
+        self.cache.put(keys[0], 'a')
+        self.cache.put(keys[1], 'b')
+        self.cache.get(keys[0])
+        self.cache.put(keys[2], 'c')
+        self.assertIs(self.cache.get(keys[1]), QueryCache.MISS)
+        self.assertEqual(self.cache.get(keys[0]), 'a')
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_invalidation(self):
+        """Test if bumping a table version only invalidates entries that read it."""
+        users = self.cache.make_key('SELECT', ['users'], None)
+        orders = self.cache.make_key('SELECT', ['orders'], None)
+        self.cache.put(users, 'u')
+        self.cache.put(orders, 'o')
+        self.cache.invalidate('users')
+        self.assertIs(self.cache.get(users), QueryCache.MISS)
+        self.assertEqual(self.cache.get(orders), 'o')
+        self.assertEqual(self.cache.invalidations, 1)
+
+    def test_result_of_a_query_overtaken_by_a_write_is_not_cached(self):
+        """Test if put skips a result whose tables changed after its query started."""
+        key = self.cache.make_key('SELECT', ['users'], None)
+        versions = self.cache.table_versions(key)
+        self.cache.invalidate('users')  # A write lands while the query runs
+        self.cache.put(key, 'stale', versions)
+        self.assertIs(self.cache.get(key), QueryCache.MISS)
+        self.cache.put(key, 'fresh', self.cache.table_versions(key))
+        self.assertEqual(self.cache.get(key), 'fresh')
+
+    def test_callers_cannot_change_cached_results(self):
+        """Test if changing a result after put, or one returned by get, leaves the cached entry intact."""
+        key = self.cache.make_key('SELECT', ['users'], None)
+        result = [([1, 30], 'proof')]
+        self.cache.put(key, result)
+        result[0][0][1] = 99
+        hit = self.cache.get(key)
+        hit[0][0][1] = 98
+        hit.append(([2, 25], 'proof'))
+        self.assertEqual(self.cache.get(key), [([1, 30], 'proof')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+from src.query_planner import QueryPlan, And, Compare, In, Not, Or, compile_row_filter, parse_condition
+from src.secondary_index import SortedIndex
+
+
+class PlainTable:
+    """Stand-in for ColumnarTable holding plaintext columns, with row ids equal to positions."""
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column_index(self, column_name):
+        return self.columns.index(column_name)
+
+    def live_positions(self, row_ids):
+        return np.asarray(row_ids, dtype=np.int64)
+
+
+class TestQueryPlanner(unittest.TestCase):
+
+    def setUp(self):
+        """A table of 200 rows with an index on 'a' only; decrypted cells are counted."""
+        self.table = PlainTable(['a', 'b', 'c'], [[i % 10, i % 7, i] for i in range(200)])
+        self.indexes = {'a': SortedIndex.from_pairs([row[0] for row in self.table.rows], range(200))}
+        self.decrypted = 0
+
+    def filter(self, column_index, positions, test):
+        self.decrypted += len(positions)
+        return [offset for offset, position in enumerate(positions) if test(self.table.rows[position][column_index])]
+
+    def plan(self, condition):
+        return QueryPlan(condition, self.table, self.indexes, lambda value: value, self.filter)
+
+    def brute_force(self, condition):
+        row_filter = compile_row_filter(condition, self.table.column_index, lambda value: value)
+        return [i for i, row in enumerate(self.table.rows) if row_filter(lambda key: row[key])]
+
+    def test_parse_tuples(self):
+        """Test if tuple conditions turn into the equivalent AST."""
+        self.assertEqual(parse_condition(('a', '=', 1)), Compare('a', '=', 1))
+        self.assertEqual(parse_condition(('AND', ('a', '=', 1), ('NOT', ('b', 'IN', [2, 3])))),
+                         And(Compare('a', '=', 1), Not(In('b', [2, 3]))))
+        self.assertEqual(parse_condition(('b', 'NOT IN', [1])), ~In('b', [1]))
+        self.assertEqual(Compare('a', '>', 1) | Compare('b', '<', 2), Or(('a', '>', 1), ('b', '<', 2)))
+
+    def test_results_match_brute_force(self):
+        """Test if planned evaluation agrees with row-by-row evaluation."""
+        conditions = [
+            ('a', '=', 3),
+            ('b', '!=', 3),
+            ('AND', ('a', '>=', 5), ('b', '<', 3)),
+            ('OR', ('a', 'IN', [1, 2]), ('c', '>', 190)),
+            ('NOT', ('OR', ('a', '<', 8), ('b', '=', 0))),
+            ('AND', ('c', '<', 100), ('OR', ('a', '=', 0), ('NOT', ('b', 'IN', [0, 1, 2])))),
+        ]
+        for condition in conditions:
+            self.assertEqual(self.plan(condition).matching_positions().tolist(), self.brute_force(condition))
+
+    def test_index_only_predicate_decrypts_nothing(self):
+        """Test if predicates on indexed columns are answered without decrypting."""
+        plan = self.plan(('OR', ('a', 'IN', [1, 2]), ('NOT', ('a', '>', 3))))
+        self.assertTrue(plan.index_only)
+        plan.matching_positions()
+        self.assertEqual(self.decrypted, 0)
+
+    def test_conjuncts_ordered_by_selectivity(self):
+        """Test if the index narrows candidates first and scans run most selective first."""
+        plan = self.plan(('AND', ('b', '>=', 0), ('c', '=', 7), ('a', '=', 7)))
+        kind, steps = plan.explain()
+        self.assertEqual(kind, 'AND')
+        self.assertEqual([step[:2] for step in steps], [('index', 'a'), ('scan', 'c'), ('scan', 'b')])
+        self.assertEqual(plan.matching_positions().tolist(), [7])
+        self.assertEqual(self.decrypted, 20 + 1)  # 20 rows with a = 7, then only row 7 left for b
+
+    def test_scan_beats_huge_index_lookup(self):
+        """Test if a few candidates are scanned rather than intersected with a large index range."""
+        plan = self.plan(('a', '<', 9))
+        self.assertEqual(plan.explain()[0], 'index')
+        # About 180 postings against decrypting 2 cells at 64 postings each
+        self.assertEqual(plan.matching_positions(np.arange(2)).tolist(), [0, 1])
+        self.assertEqual(self.decrypted, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from src.secondary_index import SortedIndex
+
+class TestSortedIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Index a column holding duplicate values."""
+        self.index = SortedIndex()
+        for row_id, value in enumerate([30, 10, 20, 10, 40]):
+            self.index.add(value, row_id)
+
+    def test_point_lookup_with_duplicates(self):
+        """Test if every row holding a value is returned."""
+        self.assertEqual(self.index.lookup('=', 10), [1, 3])
+        self.assertEqual(self.index.lookup('=', 99), [])
+
+    def test_range_lookup(self):
+        """Test if range operators return ascending row ids."""
+        self.assertEqual(self.index.lookup('<', 20), [1, 3])
+        self.assertEqual(self.index.lookup('<=', 20), [1, 2, 3])
+        self.assertEqual(self.index.lookup('>', 20), [0, 4])
+        self.assertEqual(self.index.lookup('>=', 30), [0, 4])
+
+    def test_remove(self):
+        """Test if removed rows disappear and empty keys are dropped."""
+        self.index.remove(1)
+        self.index.remove(2)
+        self.assertEqual(self.index.lookup('=', 10), [3])
+        self.assertNotIn(20, self.index.keys)
+        self.assertEqual(len(self.index), 3)
+
+    def test_add_many(self):
+        """Test if a batch of new rows merges into the sorted keys and postings."""
+        self.index.add_many([25, 10, 5, 25], [5, 6, 7, 8])
+        self.assertEqual(self.index.keys, [5, 10, 20, 25, 30, 40])
+        self.assertEqual(self.index.lookup('=', 10), [1, 3, 6])
+        self.assertEqual(self.index.lookup('>', 20), [0, 4, 5, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
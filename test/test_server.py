@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+from src.client import AsyncClient, ConnectionPool
+from src.server import ZKServer
+from src.zk_database import ZKDatabase
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        """Serve a fresh database on an ephemeral port and connect an admin client."""
+        self.db = ZKDatabase()
+        self.server = ZKServer(self.db, workers=2, max_inflight=4)
+        await self.server.start(port=0)
+        self.admin = await AsyncClient.connect(port=self.server.port, role='admin')
+        await self.admin.create_table("users", ["user_id", "age"])
+        await self.admin.insert_many("users", [[i, 20 + i % 5] for i in range(20)])
+
+    async def asyncTearDown(self):
+        await self.admin.close()
+        await self.server.close()
+        self.db.close()
+
+    async def test_queries(self):
+        """Test if select, aggregate and join results survive the round trip."""
+        rows = await self.admin.select("users", ["AND", ["age", "=", 21], ["user_id", "<", 10]], ["user_id"])
+        self.assertEqual([row for row, _ in rows], [[1], [6]])
+        self.assertEqual(await self.admin.aggregate("users", "age", "COUNT", group_by="age"),
+                         {20: 4, 21: 4, 22: 4, 23: 4, 24: 4})
+        await self.admin.create_table("orders", ["order_id", "user_id"])
+        await self.admin.insert_many("orders", [[1, 3], [2, 4], [3, 3]])
+        joined = await self.admin.join("users", "orders", "user_id", "user_id", columns=["age", "order_id"],
+                                       condition=["users.user_id", "=", 3])
+        self.assertEqual(sorted(row for row, _ in joined), [[23, 1], [23, 3]])
+
+    async def test_role_binding(self):
+        """Test if each connection is permission-checked against its own role."""
+        reader = await AsyncClient.connect(port=self.server.port, role='read_only')
+        with self.assertRaises(PermissionError):
+            await reader.insert("users", [99, 30])
+        self.assertEqual(len(await reader.select("users")), 20)
+        await reader.close()
+        with self.assertRaises(PermissionError):
+            await AsyncClient.connect(port=self.server.port, role='root')
+
+    async def test_every_op_is_permission_checked(self):
+        """Test if each operation the server exposes is refused to a role without its permission."""
+        denied = [
+            ('write_only', 'select', {'table_name': "users"}),
+            ('write_only', 'aggregate', {'table_name': "users", 'column_name': "age"}),
+            ('write_only', 'join', {'table1': "users", 'table2': "users", 'table1_column': "user_id",
+                                    'table2_column': "user_id"}),
+            ('write_only', 'explain', {'table_name': "users", 'condition': ["age", "=", 21]}),
+            ('read_write', 'create_table', {'table_name': "users", 'columns': ["x"]}),
+            ('read_write', 'create_index', {'table_name': "users", 'column_name': "age"}),
+            ('read_only', 'insert', {'table_name': "users", 'values': [99, 30]}),
+            ('read_only', 'insert_many', {'table_name': "users", 'rows': [[99, 30]]}),
+            ('read_only', 'update', {'table_name': "users", 'condition': ["user_id", "=", 1],
+                                     'update_values': {"age": 99}}),
+            ('read_write', 'delete', {'table_name': "users", 'condition': ["user_id", "=", 1]}),
+        ]
+        for role, op, args in denied:
+            client = await AsyncClient.connect(port=self.server.port, role=role)
+            with self.subTest(role=role, op=op), self.assertRaises(PermissionError):
+                await client.request(op, **args)
+            await client.close()
+        self.assertEqual(len(await self.admin.select("users")), 20)
+
+    async def test_tokens(self):
+        """Test if a server with tokens assigns roles by token only."""
+        server = ZKServer(self.db, tokens={'secret': 'read_write'})
+        await server.start(port=0)
+        client = await AsyncClient.connect(port=server.port, role='admin', token='secret')
+        with self.assertRaises(PermissionError):
+            await client.delete("users", ["user_id", "=", 1])
+        await client.update("users", ["user_id", "=", 1], {"age": 99})
+        await client.close()
+        with self.assertRaises(PermissionError):
+            await AsyncClient.connect(port=server.port, role='admin', token='wrong')
+        await server.close()
+
+    async def test_pipelining_keeps_writes_ordered(self):
+        """Test if pipelined requests on one connection see that connection's earlier writes."""
+        requests = []
+        for i in range(10):
+            requests.append(self.admin.insert("users", [100 + i, 40]))
+            requests.append(self.admin.aggregate("users", "age", "COUNT", condition=["age", "=", 40]))
+        results = await asyncio.gather(*requests)
+        self.assertEqual(results[1::2], list(range(1, 11)))
+
+    async def test_connection_pool(self):
+        """Test if many coroutines share a bounded pool of connections."""
+        async with ConnectionPool(port=self.server.port, role='read_only', size=3) as pool:
+            results = await asyncio.gather(*[pool.select("users", ["user_id", "=", i]) for i in range(20)])
+            self.assertEqual([rows[0][0][0] for rows in results], list(range(20)))
+            self.assertLessEqual(len(pool.clients), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
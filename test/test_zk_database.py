@@ -1,5 +1,7 @@
+import io
 import unittest
 from src.zk_database import ZKDatabase
+from src.utils import str_to_int
 
 class TestZKDatabase(unittest.TestCase):
 
@@ -41,6 +43,30 @@ class TestZKDatabase(unittest.TestCase):
         # Repeat the query (should use cache)
         result2 = self.db.select("users", condition=("balance", ">=", 100))
         self.assertEqual(result1, result2)  # Cached result should match
+        self.assertEqual(self.db.cache_stats()['hits'], 1)
+
+    def test_write_during_select_is_not_cached_over(self):
+        """Test if a select that a write overtook does not leave its stale result in the cache."""
+        select_rows = self.db._select_rows
+
+        def overtaken(*args):
+            rows = list(select_rows(*args))
+            self.db.insert("users", [4, "Dave", 40, 10])
+            return rows
+
+        self.db._select_rows = overtaken
+        self.assertEqual(len(self.db.select("users")), 3)
+        del self.db._select_rows
+        self.assertEqual(len(self.db.select("users")), 4)
+
+    def test_cache_is_per_table_and_invalidated(self):
+        """Test if cached results are keyed on the table and dropped after writes."""
+        self.assertEqual(len(self.db.select("users", condition=("user_id", "=", 1))), 1)
+        self.assertEqual(len(self.db.select("orders", condition=("user_id", "=", 1))), 1)
+        self.db.delete("users", condition=("user_id", "=", 1))
+        self.assertEqual(self.db.select("users", condition=("user_id", "=", 1)), [])
+        self.db.insert("users", [1, "Alice", 30, 100])
+        self.assertEqual(len(self.db.select("users", condition=("user_id", "=", 1))), 1)
 
     def test_transaction_and_rollback(self):
         """Test if transactions and rollback work correctly."""
@@ -56,6 +82,60 @@ class TestZKDatabase(unittest.TestCase):
         decrypted_row, _ = result[0]
         self.assertEqual(decrypted_row[3], 100)  # Balance should be rolled back to 100
 
+    def test_rollback_restores_indexes(self):
+        """Test if rolling back restores dropped indexes and removes created ones."""
+        self.db.drop_index("users", "name")
+        self.db.begin_transaction()
+        self.db.drop_index("users", "age")
+        self.db.create_index("users", "name")
+        self.db.insert("users", [4, "Dave", 40, 10])
+        self.db.rollback()
+        self.assertNotIn("name", self.db.indexes["users"])
+        self.assertEqual(self.db.indexes["users"]["age"].lookup('>=', 30), [0, 2])
+
+    def test_nested_savepoints(self):
+        """Test if an inner rollback keeps outer changes and an outer rollback undoes committed inner ones."""
+        self.db.begin_transaction()
+        self.db.insert("users", [4, "Dana", 40, 400])
+        self.db.begin_transaction("inner")
+        self.db.delete("users", condition=("balance", "<=", 150))
+        self.db.rollback("inner")
+        self.assertEqual(len(self.db.select("users")), 4)
+
+        self.db.begin_transaction()
+        self.db.update("users", ("user_id", "=", 2), {"balance": 0})
+        self.db.commit()
+        self.assertEqual(self.db.select("users", condition=("user_id", "=", 2))[0][0][3], 0)
+
+        self.db.rollback()
+        rows = [row for row, _ in self.db.select("users")]
+        self.assertEqual(rows, [[1, str_to_int("Alice"), 30, 100], [2, str_to_int("Bob"), 25, 200],
+                                [3, str_to_int("Charlie"), 35, 150]])
+        self.assertEqual(self.db.indexes["users"]["balance"].lookup('=', 200), [1])
+        self.assertEqual(self.db.transaction_log, [])
+
+    def test_commit_of_unknown_savepoint_is_refused(self):
+        """Test if committing a savepoint name that is not open leaves every savepoint open."""
+        self.db.begin_transaction()
+        self.db.begin_transaction("inner")
+        self.db.insert("users", [4, "Dana", 40, 400])
+        with self.assertLogs("src.zk_database", "WARNING"):
+            self.db.commit("typo")
+        self.assertEqual([name for name, _, _ in self.db.savepoints], [None, "inner"])
+        self.db.commit("inner")
+        self.db.rollback()
+        self.assertEqual(len(self.db.select("users")), 3)
+
+    def test_undo_log_records_only_changed_rows(self):
+        """Test if an update inside a transaction logs only the rows it changed."""
+        self.db.begin_transaction()
+        self.db.update("users", ("user_id", "=", 3), {"balance": 1})
+        (kind, _, _, row_ids, old_batch, old_values), = self.db.transaction_log
+        self.assertEqual((kind, row_ids, old_values), ('update', [2], [150]))
+        self.assertEqual(len(old_batch[1]), 1)
+        self.db.rollback()
+        self.assertEqual(self.db.select("users", condition=("user_id", "=", 3))[0][0][3], 150)
+
     def test_delete_and_commit(self):
         """Test if delete with transaction commit works."""
         self.db.begin_transaction()
@@ -66,22 +146,253 @@ class TestZKDatabase(unittest.TestCase):
 
     def test_logging(self):
         """Test if logging records all operations."""
+        logs_before = len(self.db.logs)  # create_table and insert entries from setUp
         self.db.select("users", condition=("balance", ">=", 150))
         self.db.update("users", ("user_id", "=", 1), {"balance": 300})
         self.db.delete("users", condition=("user_id", "=", 1))
 
-        logs = self.db.logs
+        logs = self.db.view_logs()[logs_before:]
         self.assertEqual(len(logs), 3)  # Should log 3 operations
         self.assertEqual(logs[0]['operation'], 'select')
         self.assertEqual(logs[1]['operation'], 'update')
         self.assertEqual(logs[2]['operation'], 'delete')
 
+    def test_insert_many(self):
+        """Test if bulk inserts are batched, indexed and logged once per batch."""
+        logs_before = len(self.db.logs)
+        rows = ([user_id, f"user{user_id}", 20 + user_id % 10, user_id] for user_id in range(10, 35))
+        self.assertEqual(self.db.insert_many("users", rows, batch_size=10), 25)
+        self.assertEqual(len(self.db.logs) - logs_before, 3)
+        self.assertEqual(len(self.db.select("users")), 28)
+        result = self.db.select("users", condition=("user_id", ">=", 33), columns=["user_id", "age"])
+        self.assertEqual([row for row, _ in result], [[33, 23], [34, 24]])
+        self.assertEqual(result[0][1], self.db.zk_proof.generate_proof(33)[0])
+
+    def test_insert_many_failure_keeps_whole_batches(self):
+        """Test if a failing batch is not stored and the error reports the rows of the batches before it."""
+        self.db.create_table("t", ["a", "b"])
+        with self.assertRaises(ValueError) as raised:
+            self.db.insert_many("t", [[1, 1], [2, 2], [3, 3], [4]], batch_size=2)
+        self.assertEqual(raised.exception.inserted, 2)
+        self.assertEqual([row for row, _ in self.db.select("t")], [[1, 1], [2, 2]])
+        self.assertEqual(self.db.indexes["t"]["b"].lookup('>=', 0), [0, 1])
+        self.assertEqual(self.db.savepoints, [])
+
+    def test_load_csv(self):
+        """Test if CSV rows are matched to columns by header name."""
+        source = io.StringIO("name,user_id,balance,age\nDana,4,120,28\nEve,5,80,41\n")
+        self.assertEqual(self.db.load_csv("users", source), 2)
+        result = self.db.select("users", condition=("name", "=", "Eve"))
+        self.assertEqual([row for row, _ in result], [[5, str_to_int("Eve"), 41, 80]])
+
+    def test_table_commitment(self):
+        """Test if the table root tracks inserts, deletes and rollbacks, and rows prove membership."""
+        root = self.db.table_commitment("users")
+        proof, path = self.db.prove_row("users", 1)
+        self.assertTrue(self.db.zk_proof.verify_membership(root, proof, path))
+        self.db.begin_transaction()
+        self.db.delete("users", ("user_id", "=", 1))
+        self.assertNotEqual(self.db.table_commitment("users"), root)
+        self.assertRaises(KeyError, self.db.prove_row, "users", 0)
+        self.db.rollback()
+        self.assertEqual(self.db.table_commitment("users"), root)
+        self.db.insert("users", [4, "Dana", 30, 100])
+        self.assertNotEqual(self.db.table_commitment("users"), root)
+
+    def test_commit_results(self):
+        """Test if a query result is committed to by a single root."""
+        results = self.db.join("users", "orders", "user_id", "user_id")
+        tree = self.db.commit_results(results)
+        self.assertTrue(self.db.zk_proof.verify_batch(tree.root, [row for row, _ in results]))
+        self.assertTrue(self.db.zk_proof.verify_membership(tree.root, results[1][1], tree.prove(1)))
+        self.assertFalse(self.db.zk_proof.verify_batch(tree.root, [row for row, _ in results[1:]]))
+
+    def test_compound_conditions(self):
+        """Test if AND/OR/NOT/IN conditions work in select, update and delete."""
+        self.db.drop_index("users", "balance")
+        condition = ("AND", ("age", ">=", 30), ("balance", "IN", [100, 200, 150]))
+        self.assertEqual([row[0] for row, _ in self.db.select("users", condition)], [1, 3])
+        self.assertEqual(self.db.explain("users", condition)[1][0][:2], ("index", "age"))
+        result = self.db.select("users", ("OR", ("name", "=", "Bob"), ("NOT", ("balance", "<", 150))))
+        self.assertEqual([row[0] for row, _ in result], [2, 3])
+        self.db.update("users", ("AND", ("user_id", "!=", 2), ("balance", ">", 120)), {"age": 50})
+        self.assertEqual(self.db.aggregate_sum("users", "age"), 30 + 25 + 50)
+        self.db.delete("users", ("user_id", "NOT IN", [1]))
+        self.assertEqual(len(self.db.select("users")), 1)
+
+    def test_join_condition_pushdown(self):
+        """Test if join conditions filter inputs, and stay post-join filters on null-supplying sides."""
+        result = self.db.join("users", "orders", "user_id", "user_id", condition=("users.age", "<", 35))
+        self.assertEqual([row[0] for row, _ in result], [1, 2])
+        condition = ("AND", ("users.age", "<", 35), ("amount", ">", 100))
+        result = self.db.join("users", "orders", "user_id", "user_id", columns=["name", "amount"], condition=condition)
+        self.assertEqual([row for row, _ in result], [[str_to_int("Bob"), 150]])
+        result = self.db.join("users", "orders", "user_id", "user_id", join_type="left", columns=["users.user_id", "order_id"],
+                              condition=("orders.amount", "<", 100))
+        self.assertEqual([row for row, _ in result], [[1, 101]])
+
+    def test_index_duplicates_and_delete(self):
+        """Test if indexes keep duplicate values and stay correct after deletes."""
+        self.db.insert("users", [4, "Dana", 30, 100])
+        result = self.db.select("users", condition=("age", "=", 30))
+        self.assertEqual(sorted(row[0] for row, _ in result), [1, 4])
+        self.db.delete("users", condition=("user_id", "=", 1))
+        result = self.db.select("users", condition=("age", "<=", 30))
+        self.assertEqual(sorted(row[0] for row, _ in result), [2, 4])
+        self.assertEqual(self.db.indexes["users"]["age"].lookup('=', 30), [3])
+
+    def test_index_after_update(self):
+        """Test if updated values are found through the index."""
+        self.db.update("users", ("name", "=", "Bob"), {"balance": 500})
+        result = self.db.select("users", condition=("balance", ">", 400))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0][0][0], 2)
+
+    def test_select_projection(self):
+        """Test if select returns only the projected columns, in the requested order."""
+        result = self.db.select("users", condition=("age", ">", 26), columns=["balance", "user_id"])
+        self.assertEqual(sorted(row for row, _ in result), [[100, 1], [150, 3]])
+
+    def test_update_projection(self):
+        """Test if update returns the projected post-update values of the updated rows."""
+        result = self.db.update("users", ("user_id", "=", 2), {"balance": 250}, columns=["user_id", "balance"])
+        self.assertEqual([row for row, _ in result], [[2, 250]])
+        result = self.db.update("users", ("user_id", "=", 3), {"age": 36})
+        self.assertEqual([row for row, _ in result], [[]])
+
+    def test_join_projection(self):
+        """Test if join returns only the projected columns of both tables."""
+        joined_result = self.db.join("users", "orders", "user_id", "user_id", columns=["users.age", "amount"])
+        self.assertEqual([row for row, _ in joined_result], [[30, 50], [25, 150]])
+
+    def test_aggregates(self):
+        """Test if SUM, COUNT and AVG are computed over encrypted values."""
+        self.assertEqual(self.db.aggregate_sum("users", "balance"), 450)
+        self.assertEqual(self.db.aggregate_count("users", "balance", condition=("age", ">=", 30)), 2)
+        self.assertEqual(self.db.aggregate_avg("users", "balance", condition=("age", ">=", 30)), 125)
+        self.assertEqual(self.db.aggregate_sum("users", "balance", condition=("age", ">", 99)), 0)
+
+    def test_aggregate_group_by(self):
+        """Test if aggregates are grouped on an indexed column."""
+        self.db.insert("orders", [104, 1, 25])
+        result = self.db.aggregate_sum("orders", "amount", group_by="user_id")
+        self.assertEqual(result, {1: 75, 2: 150, 4: 30})
+        result = self.db.aggregate("orders", "amount", "count", condition=("amount", "<", 100), group_by="user_id")
+        self.assertEqual(result, {1: 2, 4: 1})
+
+    def test_iter_select(self):
+        """Test if iter_select streams rows in batches and honours the limit."""
+        self.db.executor.chunk_rows = 1
+        rows = [row for row, _ in self.db.iter_select("users", columns=["user_id"], limit=2)]
+        self.assertEqual(rows, [[1], [2]])
+        batches = list(self.db.iter_select("users", condition=("balance", ">=", 100), batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        cursor = self.db.iter_select("users", condition=("age", "<", 99))
+        self.assertEqual(next(cursor)[0][1], str_to_int("Alice"))
+
+    def test_iter_select_survives_deletes(self):
+        """Test if rows deleted during an iter_select scan do not make it skip the rows after them."""
+        self.db.create_table("t", ["a", "b"])
+        for value in range(10):
+            self.db.insert("t", [value, value])
+        self.db.drop_index("t", "b")
+        self.db.executor.chunk_rows = 4
+        cursor = self.db.iter_select("t", condition=("b", ">=", 0), columns=["a"])
+        seen = [next(cursor)[0][0]]
+        self.db.delete("t", ("a", "<", 4))
+        seen.extend(row[0] for row, _ in cursor)
+        self.assertEqual(seen, list(range(10)))
+
+    def test_iter_select_index_lookup_survives_deletes(self):
+        """Test if an index lookup reused across cursor chunks skips rows deleted since it ran."""
+        self.db.create_table("t", ["a", "b"])
+        for value in range(10):
+            self.db.insert("t", [value, value])
+        self.db.drop_index("t", "b")
+        self.db.executor.chunk_rows = 4
+        cursor = self.db.iter_select("t", condition=("AND", ("a", ">=", 0), ("b", ">=", 0)), columns=["a"])
+        seen = [next(cursor)[0][0]]
+        self.db.delete("t", ("a", "=", 5))
+        seen.extend(row[0] for row, _ in cursor)
+        self.assertEqual(seen, [0, 1, 2, 3, 4, 6, 7, 8, 9])
+
+    def test_iter_join(self):
+        """Test if iter_join yields the same rows as join and stops at the limit."""
+        joined = self.db.join("users", "orders", "user_id", "user_id", join_type="outer")
+        streamed = list(self.db.iter_join("users", "orders", "user_id", "user_id", join_type="outer"))
+        self.assertEqual([row for row, _ in streamed], [row for row, _ in joined])
+        limited = list(self.db.iter_join("users", "orders", "user_id", "user_id", join_type="outer", limit=3))
+        self.assertEqual(len(limited), 3)
+
+    def test_join_with_duplicate_keys(self):
+        """Test if one-to-many joins keep every matching row, with or without indexes."""
+        self.db.insert("orders", [104, 1, 25])
+        expected = [[1, 101], [1, 104], [2, 102], [3, None]]
+        result = self.db.join("users", "orders", "user_id", "user_id", join_type="left",
+                              columns=["users.user_id", "order_id"])
+        self.assertEqual(sorted(row for row, _ in result), expected)
+
+        self.db.drop_index("users", "user_id")
+        self.db.drop_index("orders", "user_id")
+        self.assertEqual(self.db.plan_join("users", "orders", "user_id", "user_id")[0], 'hash')
+        result = self.db.join("users", "orders", "user_id", "user_id", join_type="left",
+                              columns=["users.user_id", "order_id"])
+        self.assertEqual(sorted(row for row, _ in result), expected)
+        result = self.db.join("users", "orders", "user_id", "user_id", join_type="right",
+                              columns=["users.user_id", "order_id"])
+        self.assertEqual(len(result), 4)
+
     def test_inner_join(self):
         """Test if the INNER JOIN operation works."""
         joined_result = self.db.join("users", "orders", "user_id", "user_id", join_type="inner")
         self.assertEqual(len(joined_result), 2)  # Should return 2 rows where user_id matches
         self.assertEqual(joined_result[0][0][0], 1)  # First row's user_id should be 1
 
+    def test_rotate_key(self):
+        """Test if a synchronous rotation re-encrypts every column and drops the old key."""
+        before = self.db.select("users")
+        rotation = self.db.rotate_key(background=False)
+        self.assertEqual((rotation.progress, rotation.rows_reencrypted), (1.0, 21))
+        self.assertEqual(sorted(self.db.he.keys), [1])
+        self.assertEqual({column.epoch for info in self.db.tables.values() for column in info['data'].data}, {1})
+        self.db.cache.clear()
+        self.assertEqual(self.db.select("users"), before)
+        self.assertEqual(self.db.aggregate_sum("orders", "amount"), 230)
+
+    def test_rotate_key_in_background(self):
+        """Test if queries and writes made during a background rotation all survive it."""
+        rows = [[i, f"user{i}", i % 50, i] for i in range(4, 300)]
+        self.db.insert_many("users", rows)
+        rotation = self.db.rotate_key(chunk_rows=16)
+        self.db.update("users", ("user_id", "=", 1), {"balance": 999})
+        self.db.insert("users", [300, "Zelda", 40, 5])
+        self.db.delete("users", ("user_id", "=", 2))
+        self.assertEqual(len(self.db.select("users", ("age", "<", 50))), 299)
+        with self.assertRaises(RuntimeError):
+            self.db.rotate_key()
+        self.assertTrue(rotation.wait(timeout=60))
+        self.assertEqual(sorted(self.db.he.keys), [1])
+        self.db.cache.clear()
+        result = {row[0]: row for row, _ in self.db.select("users")}
+        self.assertEqual(len(result), 299)
+        self.assertEqual(result[1][3], 999)
+        self.assertEqual(result[300], [300, str_to_int("Zelda"), 40, 5])
+        self.assertNotIn(2, result)
+
+    def test_rotation_waits_for_transactions(self):
+        """Test if a rotation swaps columns only after an open transaction ends."""
+        self.db.begin_transaction()
+        self.db.insert("orders", [104, 3, 10])
+        with self.assertRaises(RuntimeError):
+            self.db.rotate_key(background=False)
+        rotation = self.db.rotate_key()
+        self.assertFalse(rotation.wait(timeout=0.2))
+        self.db.rollback()
+        self.assertTrue(rotation.wait(timeout=60))
+        self.db.cache.clear()
+        self.assertEqual(len(self.db.select("orders")), 3)
+        self.assertEqual(sorted(self.db.he.keys), [1])
+
 
 if __name__ == '__main__':
     unittest.main()